@@ -0,0 +1,282 @@
+"""
+Entrada ASGI da API: /update_session, /add_application e /createjobposting
+rodam de forma assíncrona (engine asyncpg), então um processo segura centenas
+de turnos em andamento esperando o banco sem ocupar uma thread cada. As demais
+rotas continuam no app Flask de main.py, servido pelo mesmo processo.
+
+    uvicorn asgi:app --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+O modo síncrono (gunicorn main:app) continua funcionando como antes.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from db_config import UnknownTenantError, get_async_engine, known_tenants
+from main import app as flask_app
+from service import admission, aio, application, codec, form_schema, idempotency, metrics, session_cache
+
+
+class JSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return (codec.dumps(content) + "\n").encode("utf-8")
+
+
+async def _json(request):
+    body = await request.body()
+    return codec.loads(body) if body else None
+
+
+def measured(route: str):
+    """Registra a latência da rota nas mesmas métricas das rotas Flask."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            response = await handler(request)
+            metrics.REQUEST_LATENCY.observe(
+                time.perf_counter() - started,
+                route=route, method=request.method, status=response.status_code,
+                tenant=await metrics.async_tenant_label(getattr(request.state, "tenant", None)),
+            )
+            return response
+        return wrapper
+    return decorator
+
+
+def admitted(route: str, tenant_from):
+    """Controle de admissão (service/admission.py), compartilhado com as rotas Flask do processo."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            if not admission.ADMISSION_ENABLED:
+                return await handler(request)
+
+            tenant = await admission.async_known_tenant(await tenant_from(request))
+            try:
+                ticket = admission.admission.try_enter(tenant, route)
+                if ticket is None:
+                    # A espera por vaga bloqueia: fica fora do event loop
+                    ticket = await asyncio.to_thread(admission.admission.enter, tenant, route, True, False)
+            except admission.AdmissionRejected as e:
+                return JSONResponse({"error": str(e)}, e.status, headers={"Retry-After": str(e.retry_after)})
+
+            try:
+                return await handler(request)
+            finally:
+                admission.admission.leave(ticket)
+        return wrapper
+    return decorator
+
+
+async def _body_tenant(request):
+    try:
+        payload = await _json(request)
+    except ValueError:
+        return None
+    return admission.payload_tenant(payload)
+
+
+async def _application_tenant(request):
+    # O /add_application só traz a sessão: o tenant é o dela
+    try:
+        payload = await _json(request)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get("ats_chat_stage_id") is None:
+        return None
+    return await aio.chat_stage_tenant(payload["ats_chat_stage_id"])
+
+
+async def _query_tenant(request):
+    return request.query_params.get("tenant")
+
+
+async def _finish_key(deferred, code, body):
+    if deferred.deferred:
+        # Gravação adiada pelo cache de sessões: a chave é concluída depois dela
+        await asyncio.to_thread(deferred.respond, code, body)
+    elif 200 <= code < 300:
+        await aio.complete_idempotency_key(deferred.scope, deferred.key, code, body)
+    else:
+        await aio.release_idempotency_key(deferred.scope, deferred.key)
+
+
+def idempotent(scope: str):
+    """Equivalente assíncrono de service.idempotency.idempotent (mesma tabela e cache)."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            header = request.headers.get("Idempotency-Key")
+            payload = None
+            if not header:
+                try:
+                    payload = await _json(request)
+                except ValueError:
+                    pass
+            key = idempotency.idempotency_key(header, payload)
+            if not key:
+                return await handler(request)
+
+            cached = idempotency.cached_response(scope, key)
+            if cached is None:
+                claimed, row = await aio.claim_idempotency_key(scope, key)
+                if not claimed:
+                    cached = idempotency.stored_response(scope, key, row)
+                    if cached is None:
+                        return JSONResponse({"error": idempotency.IN_PROGRESS_ERROR}, 409)
+
+            if cached is not None:
+                return JSONResponse(cached[1], cached[0], headers={"Idempotent-Replayed": "true"})
+
+            deferred = idempotency.DeferredKey(scope, key)
+            token = idempotency._current.set(deferred)
+            try:
+                response = await handler(request)
+            except Exception:
+                await _finish_key(deferred, 500, None)
+                raise
+            finally:
+                idempotency._current.reset(token)
+
+            await _finish_key(deferred, response.status_code, codec.loads(response.body))
+            return response
+        return wrapper
+    return decorator
+
+
+async def _apply_session_updates(items):
+    # Com o cache write-behind ligado, o estado em memória é o do processo (síncrono)
+    if session_cache.SESSION_CACHE_ENABLED:
+        return await asyncio.to_thread(session_cache.apply_session_updates, items)
+    return await aio.apply_session_updates(items)
+
+
+async def _get_chat_stage_by_id(chat_stage_id, columns=None):
+    if session_cache.SESSION_CACHE_ENABLED:
+        return await asyncio.to_thread(session_cache.get_chat_stage_by_id, chat_stage_id, columns)
+    return await aio.get_chat_stage_by_id(chat_stage_id, columns)
+
+
+async def _get_form_schema(tenant_name, job_posting_id):
+    schema = form_schema.peek_form_schema(tenant_name, job_posting_id)
+    if schema is None:
+        # Carga (síncrona) fora do event loop
+        schema = await asyncio.to_thread(form_schema.get_form_schema, tenant_name, job_posting_id)
+    return schema
+
+
+@measured("/update_session")
+@admitted("/update_session", _body_tenant)
+@idempotent("update_session")
+async def update_session(request):
+    try:
+        payload = await _json(request)
+        if isinstance(payload, dict):
+            request.state.tenant = payload.get("tenant_name")
+
+        # Mesmo caminho do lote, com um único turno
+        result = (await _apply_session_updates([payload]))[0]
+        if "error" in result:
+            return JSONResponse({"error": result["error"]}, result["code"])
+
+        return JSONResponse({"status": "OK"})
+
+    except Exception as e:
+        print("Erro interno:", e)
+        return JSONResponse({"error": str(e)}, 500)
+
+
+@measured("/add_application")
+@admitted("/add_application", _application_tenant)
+@idempotent("add_application")
+async def add_application(request):
+    try:
+        data = await _json(request)
+        chat_id = data["ats_chat_stage_id"]
+
+        # Busca o contexto da conversa
+        result = await _get_chat_stage_by_id(chat_id, application.APPLICATION_CHAT_STAGE_COLUMNS)
+        tenant_name = request.state.tenant = result["tenant_name"]
+        phone = result["candidate_phone_number_id"]
+
+        schema = await _get_form_schema(tenant_name, result["job_posting_id"])
+        fields = application.extract_application_fields(application.context_questions(result["context"]), schema)
+
+        # Cria candidato, telefone, inscrição e respostas em uma única transação
+        await aio.create_application(
+            tenant_name, result["job_posting_id"], fields["name"], fields["email"], fields["cpf"], phone,
+            fields["customized_rows"]
+        )
+
+        return JSONResponse({
+            "nome": fields["name"],
+            "phone": phone,
+            "email": fields["email"],
+            "document": fields["document"],
+            "questions": fields["customized_rows"]
+        })
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({"erro": str(e)}, 500)
+
+
+@measured("/createjobposting")
+@admitted("/createjobposting", _query_tenant)
+async def create_job_posting(request):
+    name = request.query_params.get("name")
+    tenant = request.state.tenant = request.query_params.get("tenant")
+    job_code = request.query_params.get("job_code")
+
+    if not name:
+        return JSONResponse({"error": "Parâmetro 'name' é obrigatório"}, 400)
+
+    if not tenant:
+        return JSONResponse({"error": "Parâmetro 'tenant' é obrigatório"}, 400)
+
+    try:
+        new_id = await aio.create_job_posting(tenant, name, job_code)
+    except UnknownTenantError as e:
+        return JSONResponse({"error": str(e)}, 400)
+
+    return JSONResponse({
+        "message": "Job posting criada com sucesso",
+        "job_posting_id": new_id
+    })
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Comandos do engine assíncrono entram nos totais de /metrics
+    engine = get_async_engine()
+    metrics.install_sqlalchemy_hooks(engine.sync_engine)
+    # Lista de tenants carregada antes da primeira requisição, fora do event loop
+    try:
+        await asyncio.to_thread(known_tenants)
+    except Exception as e:
+        print("Erro ao carregar a lista de tenants:", e)
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/update_session", update_session, methods=["POST"]),
+        Route("/add_application", add_application, methods=["POST"]),
+        Route("/createjobposting", create_job_posting, methods=["GET"]),
+        # Demais rotas: app Flask (síncrono), executado em threads
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark do codec JSON (service/codec.py): compara orjson e a
+biblioteca padrão serializando e desserializando conversation e context com
+tamanhos de conversa realistas. Não precisa de banco.
+
+Uso:
+    python bench/bench_codec.py --messages 10,200,2000 --repeat 200 --output bench_codec.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.seed import build_question_sequence  # noqa: E402
+
+SYSTEM_MESSAGES = [
+    "Olá! Vamos começar sua inscrição. Qual é o seu nome completo?",
+    "Perfeito. Agora informe seu e-mail, por favor.",
+    "Você tem disponibilidade para trabalho presencial? Responda 1 para Sim ou 2 para Não.",
+    "Conte um pouco sobre sua última experiência profissional.",
+]
+CANDIDATE_MESSAGES = [
+    "Sim", "João da Silva Araújo", "joao.araujo@example.com", "1",
+    "Trabalhei três anos como atendente em uma loja de eletrônicos, cuidando do caixa, "
+    "do estoque e do pós-venda. Também ajudei no treinamento de novos colaboradores.",
+]
+BASIC_QUESTIONS = {"steps": {"questions": [
+    {"id": None, "key": key, "name": label, "type": "basic", "sequence": i + 1,
+     "answer_type": "text", "user_answer": "", "answer_options": []}
+    for i, (key, label) in enumerate([("nome", "Qual é o seu nome completo?"), ("e-mail", "Qual é o seu e-mail?"),
+                                      ("cpf", "Qual é o seu CPF?"), ("telefone", "Qual é o seu telefone?")])
+]}}
+
+
+def build_payloads(messages: int):
+    started = datetime(2025, 11, 5, 9, 0, 0)
+    conversation = [
+        {
+            "date": (started + timedelta(seconds=15 * i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "from": "system" if i % 2 == 0 else "candidate",
+            "message": random.choice(SYSTEM_MESSAGES if i % 2 == 0 else CANDIDATE_MESSAGES),
+        }
+        for i in range(messages)
+    ]
+    context = [build_question_sequence(BASIC_QUESTIONS)]
+    for question in context[0]["steps"]["questions"]:
+        question["user_answer"] = random.choice(CANDIDATE_MESSAGES)
+    return {"conversation": conversation, "context": context}
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"median_us": round(timings[len(timings) // 2] * 1e6, 1), "min_us": round(timings[0] * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", default="10,200,2000", help="tamanhos da conversation")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", default=None, help="arquivo JSON para o relatório")
+    args = parser.parse_args()
+
+    from service import codec
+
+    codecs = ["stdlib"] + (["orjson"] if codec.orjson is not None else [])
+    random.seed(42)
+    results = []
+
+    for messages in [int(value) for value in args.messages.split(",")]:
+        payloads = build_payloads(messages)
+        for name, payload in payloads.items():
+            row = {"payload": name, "messages": messages, "bytes": len(json.dumps(payload, ensure_ascii=False).encode())}
+            for codec_name in codecs:
+                # Troca o codec ativo, como faria JSON_CODEC na subida
+                codec.JSON_CODEC = codec_name
+                encoded = codec.dumps(payload)
+                row[codec_name] = {
+                    "dumps": measure(lambda: codec.dumps(payload), args.repeat),
+                    "loads": measure(lambda: codec.loads(encoded), args.repeat),
+                }
+            if "orjson" in row:
+                row["speedup"] = {
+                    op: round(row["stdlib"][op]["median_us"] / row["orjson"][op]["median_us"], 1)
+                    for op in ("dumps", "loads")
+                }
+            results.append(row)
+            print(f"{name:<13} msgs={messages:<5} bytes={row['bytes']:<8} " + " ".join(
+                f"{c}: dumps={row[c]['dumps']['median_us']}us loads={row[c]['loads']['median_us']}us" for c in codecs
+            ))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"codecs": codecs, "repeat": args.repeat, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Resultados gravados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
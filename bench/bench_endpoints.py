@@ -0,0 +1,216 @@
+"""
+Benchmark reprodutível dos endpoints de inscrição (/update_session,
+/add_application e /createjobposting) usando o test client do Flask.
+
+Precisa de um Postgres local (os comandos usam jsonb, CTEs com INSERT e
+search_path, então SQLite não serve como substituto). O tenant informado
+é recriado a partir de bench/schema.sql a cada execução.
+
+Uso:
+    python bench/bench_endpoints.py --database-url postgresql://localhost/bench \
+        --concurrency 1,4,16 --history 0,200,2000 --requests 200 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class StatementCounter:
+    """Conta os comandos SQL executados pela thread atual."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        event.listen(engine, "after_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    def value(self):
+        return getattr(self._local, "count", 0)
+
+
+def total_conflicts():
+    from service.application import chat_stage_conflict_stats
+
+    return sum(chat_stage_conflict_stats().values())
+
+
+def run_scenario(app, counter, name, concurrency, total_requests, make_request, **params):
+    """
+    Dispara total_requests chamadas com `concurrency` threads e resume os tempos.
+    Cada thread recebe um `slot` fixo (0..concurrency-1), para que o cenário
+    possa dedicar recursos (como uma sessão de chat) a uma única thread.
+    """
+    latencies = []
+    statements = []
+    errors = 0
+    slots = iter(range(concurrency))
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker(i):
+        nonlocal errors
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+            with lock:
+                local.slot = next(slots)
+
+        counter.reset()
+        started = time.perf_counter()
+        response = make_request(client, i, local.slot)
+        elapsed = time.perf_counter() - started
+
+        with lock:
+            latencies.append(elapsed)
+            statements.append(counter.value())
+            if response.status_code >= 400:
+                errors += 1
+
+    conflicts_before = total_conflicts()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(total_requests)))
+    duration = time.perf_counter() - started
+    conflicts = total_conflicts() - conflicts_before
+
+    result = {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        **params,
+        "errors": errors,
+        "conflicts": conflicts,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(total_requests / duration, 2) if duration else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "statements_per_request": round(sum(statements) / len(statements), 2),
+    }
+    print(f"{name:<18} c={concurrency:<3} {params} "
+          f"rps={result['throughput_rps']:<8} p50={result['latency_ms']['p50']}ms "
+          f"p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms "
+          f"sql/req={result['statements_per_request']} erros={errors} conflitos={conflicts}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--tenant", default="bench_tenant", help="schema exclusivo do benchmark (é recriado)")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--history", default="0,200,2000", help="tamanhos de conversa já existente nas sessões")
+    parser.add_argument("--requests", type=int, default=200, help="requisições por cenário")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("informe --database-url ou BENCH_DATABASE_URL")
+
+    # db_config lê DATABASE_URL na importação
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("DB_POOL_SIZE", "20")
+
+    from bench import seed
+    from db_config import engine
+    from main import app
+    from service.application import get_basic_questions
+
+    concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+    history_sizes = [int(value) for value in args.history.split(",")]
+
+    seed.apply_schema(engine, args.tenant)
+    counter = StatementCounter(engine)
+    question_sequence = seed.build_question_sequence(get_basic_questions(args.tenant))
+    answer_question = next(q for q in question_sequence["steps"]["questions"] if q["id"] is not None)
+
+    with app.test_client() as client:
+        job_posting_id = client.get(f"/createjobposting?name=Vaga+Benchmark&tenant={args.tenant}&job_code=BENCH").json["job_posting_id"]
+
+    results = []
+    phone_seq = iter(range(10**10, 10**11))
+
+    for history in history_sizes:
+        for concurrency in concurrency_levels:
+            # Uma sessão por thread (pelo slot), para medir o caminho sem conflitos de versão;
+            # "conflicts" no resultado confirma que nenhum retry entrou na medição
+            stages = [
+                seed.create_chat_stage(engine, args.tenant, job_posting_id, question_sequence, str(next(phone_seq)), history)
+                for _ in range(concurrency)
+            ]
+
+            def update_session(client, i, slot, stages=stages):
+                return client.post("/update_session", json={
+                    "chat_stage_id": stages[slot],
+                    "tenant_name": args.tenant,
+                    "candidate_message": f"Resposta {i}",
+                    "system_message": answer_question["name"],
+                    "question_id": answer_question["id"],
+                    "interaction": "answer" if i % 2 else "question",
+                    "status": "em_andamento",
+                })
+
+            results.append(run_scenario(app, counter, "update_session", concurrency, args.requests,
+                                        update_session, history=history))
+
+    for concurrency in concurrency_levels:
+        stages = [
+            seed.create_chat_stage(engine, args.tenant, job_posting_id, question_sequence, str(next(phone_seq)), answered=True)
+            for _ in range(args.requests)
+        ]
+
+        def add_application(client, i, slot, stages=stages):
+            return client.post("/add_application", json={"ats_chat_stage_id": stages[i]})
+
+        results.append(run_scenario(app, counter, "add_application", concurrency, args.requests, add_application))
+
+        def create_job_posting(client, i, slot):
+            return client.get(f"/createjobposting?name=Vaga+{i}&tenant={args.tenant}&job_code=B{i}")
+
+        results.append(run_scenario(app, counter, "createjobposting", concurrency, args.requests, create_job_posting))
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        commit = None
+
+    report = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "commit": commit,
+        "python": platform.python_version(),
+        "requests_per_scenario": args.requests,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados gravados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Gerador de carga que reproduz o fluxo do workflow do n8n (file/workflow_n8n.json)
+contra a API rodando localmente, sem precisar do n8n nem da Evolution API.
+
+Cada candidato simulado:
+  1. envia a mensagem inicial com o código da vaga e a sessão é criada como no
+     nó create_session (INSERT direto em public.ats_chat_stage);
+  2. percorre o question_sequence da vaga: a cada mensagem busca a sessão ativa
+     (GET /session/active) e registra o turno (POST /update_session), com um
+     tempo de digitação aleatório e, às vezes, mensagens duplicadas em rajada;
+  3. finaliza a inscrição (POST /add_application).
+
+Uso:
+    python bench/load_n8n.py --base-url http://localhost:5000 \
+        --database-url postgresql://localhost/bench --candidates 200 --concurrency 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+
+class Recorder:
+    """Guarda latências e erros por endpoint e a duração de cada conversa."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.conversations = []
+        self.failed_conversations = 0
+
+    def call(self, endpoint, session, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=60, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            stats = self.calls.setdefault(endpoint, {"latencies": [], "errors": 0, "status": {}})
+            stats["latencies"].append(elapsed)
+            status = response.status_code if response is not None else "conexao"
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+            if not ok:
+                stats["errors"] += 1
+        return response, elapsed
+
+    def conversation(self, wall_time, server_time, ok):
+        with self._lock:
+            self.conversations.append((wall_time, server_time))
+            if not ok:
+                self.failed_conversations += 1
+
+    def report(self):
+        endpoints = {}
+        for endpoint, stats in self.calls.items():
+            total = len(stats["latencies"])
+            endpoints[endpoint] = {
+                "requests": total,
+                "errors": stats["errors"],
+                "error_rate": round(stats["errors"] / total, 4) if total else 0,
+                "status": stats["status"],
+                "latency_s": {
+                    "p50": percentile(stats["latencies"], 0.50),
+                    "p95": percentile(stats["latencies"], 0.95),
+                    "p99": percentile(stats["latencies"], 0.99),
+                },
+            }
+
+        wall = [wall_time for wall_time, _ in self.conversations]
+        server = [server_time for _, server_time in self.conversations]
+        return {
+            "conversations": len(self.conversations),
+            "failed_conversations": self.failed_conversations,
+            "conversation_wall_s": {"p50": percentile(wall, 0.5), "p95": percentile(wall, 0.95), "p99": percentile(wall, 0.99)},
+            "conversation_server_s": {"p50": percentile(server, 0.5), "p95": percentile(server, 0.95), "p99": percentile(server, 0.99)},
+            "endpoints": endpoints,
+        }
+
+
+def simulate_candidate(args, engine, recorder, job_posting_id, question_sequence, index):
+    from bench import seed
+
+    http = requests.Session()
+    base = args.base_url.rstrip("/")
+    phone = f"55{random.randint(10**10, 10**11 - 1)}"
+    server_time = 0.0
+    ok = True
+    started = time.perf_counter()
+
+    def think():
+        # Tempo de leitura/digitação do candidato (exponencial, comprimido por --time-scale)
+        time.sleep(random.expovariate(1 / args.think_time) / args.time_scale)
+
+    def lookup():
+        nonlocal server_time
+        response, elapsed = recorder.call("session_active", http, "GET", f"{base}/session/active", params={"phone": phone})
+        server_time += elapsed
+        return response
+
+    # Mensagem inicial "@VAGA<id>-<tenant>": sem sessão ativa, o n8n cria uma
+    lookup()
+    chat_stage_id = seed.create_chat_stage(engine, args.tenant, job_posting_id, question_sequence, phone)
+
+    questions = question_sequence["steps"]["questions"]
+    for position, question in enumerate(questions):
+        think()
+        lookup()
+
+        status = "finalizada" if position == len(questions) - 1 else "em_andamento"
+        payload = {
+            "chat_stage_id": chat_stage_id,
+            "tenant_name": args.tenant,
+            "candidate_message": f"Resposta do candidato {index} para {question['key']}",
+            "system_message": question["name"],
+            "question_id": question["id"],
+            "interaction": "answer" if question["id"] is not None else "question",
+            "status": status,
+        }
+
+        # Às vezes o candidato manda duas mensagens seguidas e o n8n dispara duas execuções
+        burst = 2 if random.random() < args.double_message_rate else 1
+        with ThreadPoolExecutor(max_workers=burst) as executor:
+            calls = [
+                executor.submit(recorder.call, "update_session", requests.Session() if n else http,
+                                "POST", f"{base}/update_session", json=payload)
+                for n in range(burst)
+            ]
+            for call in calls:
+                response, elapsed = call.result()
+                server_time += elapsed
+                ok = ok and response is not None and response.status_code < 400
+
+    think()
+    response, elapsed = recorder.call("add_application", http, "POST", f"{base}/add_application",
+                                      json={"ats_chat_stage_id": chat_stage_id})
+    server_time += elapsed
+    ok = ok and response is not None and response.status_code < 400
+
+    recorder.conversation(time.perf_counter() - started, server_time, ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"),
+                        help="banco usado pela API; as sessões são criadas direto nele, como faz o n8n")
+    parser.add_argument("--tenant", default="bench_tenant")
+    parser.add_argument("--reset", action="store_true", help="recria o schema do tenant antes de rodar")
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10, help="candidatos conversando ao mesmo tempo")
+    parser.add_argument("--think-time", type=float, default=8.0, help="tempo médio (s) entre mensagens do candidato")
+    parser.add_argument("--time-scale", type=float, default=10.0, help="fator de compressão do tempo de digitação")
+    parser.add_argument("--double-message-rate", type=float, default=0.1, help="fração de turnos enviados em duplicidade")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="arquivo JSON para o relatório")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("informe --database-url ou BENCH_DATABASE_URL")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    from sqlalchemy import create_engine, text
+    from bench import seed
+
+    database_url = args.database_url.replace("postgres://", "postgresql://", 1)
+    engine = create_engine(database_url, pool_size=args.concurrency, max_overflow=args.concurrency)
+    if args.reset:
+        seed.apply_schema(engine, args.tenant)
+
+    response = requests.get(f"{args.base_url.rstrip('/')}/createjobposting",
+                            params={"name": "Vaga Carga", "tenant": args.tenant, "job_code": "LOAD"}, timeout=60)
+    response.raise_for_status()
+    job_posting_id = response.json()["job_posting_id"]
+
+    with engine.begin() as conn:
+        basic = conn.execute(text(f'SELECT question_sequence FROM "{args.tenant}".ats_jobposting WHERE id = :id'),
+                             {"id": job_posting_id}).scalar()
+    question_sequence = seed.build_question_sequence(basic if isinstance(basic, dict) else json.loads(basic))
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(simulate_candidate, args, engine, recorder, job_posting_id, question_sequence, i)
+            for i in range(args.candidates)
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print("Erro na simulação:", e)
+                recorder.conversation(0, 0, False)
+
+    report = recorder.report()
+    report["duration_s"] = round(time.perf_counter() - started, 2)
+    report["parameters"] = {key: value for key, value in vars(args).items() if key != "database_url"}
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
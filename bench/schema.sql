@@ -0,0 +1,151 @@
+-- Schema de benchmark derivado do DDL de referência (file/workflow_n8n.json).
+-- {schema} é substituído pelo tenant de benchmark. Ids viram identity e as
+-- colunas NOT NULL que a API não preenche recebem DEFAULT, como no banco real.
+
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+
+CREATE TABLE {schema}.ats_jobposting (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name character varying(255) NOT NULL,
+    status character varying(50) NOT NULL,
+    positions integer NOT NULL,
+    limit_days integer,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    city character varying(255),
+    description text NOT NULL,
+    external_publication boolean NOT NULL,
+    netvagas_external_publication boolean NOT NULL,
+    google_for_jobs_external_publication boolean NOT NULL,
+    already_suspended boolean NOT NULL,
+    already_canceled boolean NOT NULL,
+    linkedin_external_publication boolean NOT NULL,
+    unlisted_external_publication boolean NOT NULL,
+    careerjet_external_publication boolean NOT NULL,
+    jooble_external_publication boolean NOT NULL,
+    competencies smallint[] NOT NULL,
+    question_sequence jsonb,
+    job_code character varying(100)
+);
+
+CREATE TABLE {schema}.ats_candidate (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name character varying(255) NOT NULL,
+    email character varying(255) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    birthdate date,
+    cpf character varying(11),
+    portfolio text NOT NULL DEFAULT '',
+    professional_goal text NOT NULL DEFAULT '',
+    professional_summary text NOT NULL DEFAULT '',
+    realocation_possibility boolean NOT NULL DEFAULT false,
+    rg character varying(14) NOT NULL DEFAULT '',
+    travel_possibility boolean NOT NULL DEFAULT false,
+    uuid uuid NOT NULL DEFAULT gen_random_uuid(),
+    antivirus_file_status character varying(255) NOT NULL DEFAULT '',
+    resume_summary text NOT NULL DEFAULT '',
+    attachment_content text NOT NULL DEFAULT '',
+    attachment_processing_status character varying(255) NOT NULL DEFAULT '',
+    has_search_index boolean NOT NULL DEFAULT false
+);
+
+CREATE TABLE {schema}.ats_recruitmentprocess (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    status character varying(255) NOT NULL,
+    subscription_type character varying(255) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    candidate_id bigint NOT NULL,
+    stage_id bigint NOT NULL,
+    candidate_source_option character varying(255),
+    stage_type character varying(50) NOT NULL,
+    job_posting_id bigint NOT NULL
+);
+
+CREATE TABLE {schema}.ats_candidatephonecontact (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    number character varying(255) NOT NULL,
+    type character varying(255) NOT NULL,
+    country_code integer NOT NULL,
+    candidate_id bigint NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL
+);
+
+CREATE TABLE {schema}.ats_candidatesourceoption (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name character varying(255) NOT NULL,
+    visible boolean NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now(),
+    is_protected boolean NOT NULL DEFAULT false,
+    sequence smallint NOT NULL,
+    slug character varying(50) NOT NULL DEFAULT ''
+);
+
+CREATE TABLE {schema}.ats_answeralternative (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    question_alternative_id bigint NOT NULL,
+    recruitment_process_id bigint NOT NULL
+);
+
+CREATE TABLE {schema}.ats_answertext (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    text text,
+    created_at timestamp with time zone NOT NULL,
+    updated_at timestamp with time zone NOT NULL,
+    question_id bigint NOT NULL,
+    recruitment_process_id bigint NOT NULL
+);
+
+CREATE TABLE {schema}.ats_candidateregisterfield (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    key character varying(255) NOT NULL,
+    visible character varying(255) NOT NULL,
+    required character varying(255) NOT NULL,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+INSERT INTO {schema}.ats_candidateregisterfield (key, visible, required) VALUES
+    ('Nome', 'required', 'required'),
+    ('E-mail', 'required', 'required'),
+    ('CPF', 'required', 'required'),
+    ('Telefone', 'required', 'required'),
+    ('País', 'visible', 'optional'),
+    ('Cidade', 'visible', 'optional'),
+    ('Data de Nascimento', 'visible', 'optional'),
+    ('Source', 'required', 'required');
+
+INSERT INTO {schema}.ats_candidatesourceoption (name, visible, sequence) VALUES
+    ('Instagram', true, 1),
+    ('Facebook', true, 2),
+    ('Indicação', true, 3),
+    ('Outros', true, 4);
+
+-- Table: public.ats_chat_stage (colunas usadas pelo n8n e pela API)
+CREATE SEQUENCE IF NOT EXISTS public.chat_sessions_id_seq;
+
+CREATE TABLE IF NOT EXISTS public.ats_chat_stage
+(
+    id integer NOT NULL DEFAULT nextval('public.chat_sessions_id_seq'::regclass),
+    candidate_phone_number_id character varying(30) NOT NULL,
+    job_public_code character varying(100),
+    step integer DEFAULT 0,
+    context jsonb DEFAULT '{}'::jsonb,
+    conversation jsonb DEFAULT '[]'::jsonb,
+    interaction character varying(50),
+    updated_at timestamp without time zone DEFAULT now(),
+    status character varying(50) DEFAULT 'em_andamento'::character varying,
+    job_posting_id integer,
+    tenant_name character varying(100) DEFAULT NULL::character varying,
+    CONSTRAINT chat_sessions_pkey PRIMARY KEY (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at
+    ON public.ats_chat_stage USING btree
+    (updated_at DESC NULLS FIRST);
@@ -0,0 +1,101 @@
+"""
+Preparação do banco para benchmarks e testes de carga: cria o schema do
+tenant a partir de bench/schema.sql, aplica as migrações de sql/ e cria
+vagas e sessões de conversa (ats_chat_stage) com histórico.
+"""
+import glob
+import json
+import os
+
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CUSTOM_QUESTIONS = [
+    {"name": "Quantos anos de experiência com vendas você possui?", "answer_type": "text"},
+    {"name": "Você tem disponibilidade para trabalho presencial?", "answer_type": "options",
+     "answer_options": [{"option": "Sim", "option_id": 1}, {"option": "Não", "option_id": 2}]},
+    {"name": "Conte um pouco sobre sua última experiência.", "answer_type": "text"},
+]
+
+
+def apply_schema(engine, tenant: str):
+    """
+    Recria o schema do tenant de benchmark, remove as sessões dele em
+    public.ats_chat_stage e aplica as migrações de sql/ em ordem.
+    Use sempre um tenant exclusivo para benchmark: o schema é apagado.
+    """
+    with engine.begin() as conn:
+        with open(os.path.join(ROOT, "bench", "schema.sql"), encoding="utf-8") as f:
+            conn.exec_driver_sql(f.read().replace("{schema}", tenant))
+        for path in sorted(glob.glob(os.path.join(ROOT, "sql", "*.sql"))):
+            with open(path, encoding="utf-8") as f:
+                conn.exec_driver_sql(f.read().replace("{tenant}", tenant))
+        conn.execute(text("DELETE FROM public.ats_chat_stage WHERE tenant_name = :tenant"), {"tenant": tenant})
+
+
+def build_question_sequence(basic_questions: dict, custom_questions: int = len(CUSTOM_QUESTIONS)):
+    """Perguntas básicas do tenant seguidas de perguntas personalizadas com id."""
+    questions = list(basic_questions["steps"]["questions"])
+    for i in range(custom_questions):
+        template = CUSTOM_QUESTIONS[i % len(CUSTOM_QUESTIONS)]
+        questions.append({
+            "id": 1000 + i,
+            "key": f"custom_{i}",
+            "name": template["name"],
+            "type": "customized",
+            "sequence": len(questions) + 1,
+            "answer_type": template["answer_type"],
+            "user_answer": "",
+            "answer_options": template.get("answer_options", []),
+        })
+    return {"steps": {"questions": questions, "total_questions": len(questions)}}
+
+
+def create_chat_stage(engine, tenant: str, job_posting_id: int, question_sequence: dict, phone: str,
+                      history: int = 0, answered: bool = False):
+    """
+    Cria uma sessão como o nó create_session do n8n (context = [question_sequence])
+    com `history` mensagens já trocadas. Com answered=True, todas as perguntas
+    já vêm respondidas (pronta para o /add_application).
+    """
+    sequence = json.loads(json.dumps(question_sequence))
+    if answered:
+        for question in sequence["steps"]["questions"]:
+            if question["answer_type"] == "options" and question["answer_options"]:
+                question["user_answer"] = str(question["answer_options"][0]["option_id"])
+            elif question["key"] == "cpf":
+                question["user_answer"] = phone[-11:].rjust(11, "0")
+            elif question["key"] == "e-mail":
+                question["user_answer"] = f"{phone}@example.com"
+            else:
+                question["user_answer"] = f"Resposta {question['key']}"
+
+    with engine.begin() as conn:
+        chat_stage_id = conn.execute(text("""
+            INSERT INTO public.ats_chat_stage
+            (candidate_phone_number_id, job_posting_id, tenant_name, step, status, updated_at, context, conversation)
+            VALUES (:phone, :job_posting_id, :tenant, 0, 'em_andamento', now(), CAST(:context AS jsonb), '[]'::jsonb)
+            RETURNING id
+        """), {
+            "phone": phone,
+            "job_posting_id": job_posting_id,
+            "tenant": tenant,
+            "context": json.dumps([sequence]),
+        }).scalar()
+
+        if history:
+            conn.execute(text("""
+                UPDATE public.ats_chat_stage
+                SET conversation = (
+                    SELECT jsonb_agg(jsonb_build_object(
+                        'date', to_char(now() - make_interval(secs => :history - n), 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'),
+                        'from', CASE WHEN n % 2 = 0 THEN 'system' ELSE 'candidate' END,
+                        'message', 'Mensagem de histórico número ' || n
+                    ) ORDER BY n)
+                    FROM generate_series(1, :history) AS n
+                )
+                WHERE id = :chat_stage_id
+            """), {"chat_stage_id": chat_stage_id, "history": history})
+
+    return chat_stage_id
@@ -1,5 +1,14 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from service import codec
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
@@ -13,4 +22,214 @@ if DATABASE_URL.startswith("postgres://"):
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL não está definida!")
 
-engine = create_engine(DATABASE_URL)
\ No newline at end of file
+# Configuração do pool (por worker do gunicorn)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=POOL_PRE_PING,
+    # jsonb lido do banco (psycopg2) e gravado pelo SQLAlchemy passa pelo mesmo codec
+    json_serializer=codec.dumps,
+    json_deserializer=codec.loads,
+)
+
+# Schemas de tenant são interpolados no search_path, então só aceitamos identificadores simples
+TENANT_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_pool_lock = threading.Lock()
+_pool_metrics = {
+    "checkouts": 0,
+    "checkout_timeouts": 0,
+    "checkout_wait_total": 0.0,
+    "checkout_wait_max": 0.0,
+    "connection_age_max": 0.0,
+}
+
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    connection_record.info["connected_at"] = time.monotonic()
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    age = time.monotonic() - connection_record.info.get("connected_at", time.monotonic())
+    with _pool_lock:
+        _pool_metrics["connection_age_max"] = max(_pool_metrics["connection_age_max"], age)
+
+
+class UnknownTenantError(ValueError):
+    """Tenant com nome inválido ou sem schema correspondente no banco."""
+
+
+# Schemas de tenant conhecidos, carregados uma vez; um tenant novo faz a lista
+# ser recarregada no máximo a cada TENANT_ALLOWLIST_REFRESH segundos
+TENANT_ALLOWLIST_REFRESH = float(os.environ.get("TENANT_ALLOWLIST_REFRESH", "5"))
+
+_known_tenants = None
+_known_tenants_loaded_at = 0.0
+_known_tenants_lock = threading.Lock()
+
+
+def known_tenants(refresh: bool = False):
+    """Schemas do banco que podem ser usados como tenant."""
+    global _known_tenants, _known_tenants_loaded_at
+
+    with _known_tenants_lock:
+        if _known_tenants is None or refresh:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql("""
+                    SELECT schema_name
+                    FROM information_schema.schemata
+                    WHERE schema_name NOT IN ('public', 'information_schema')
+                      AND left(schema_name, 3) <> 'pg_'
+                """).scalars().all()
+            _known_tenants = frozenset(rows)
+            _known_tenants_loaded_at = time.monotonic()
+        return _known_tenants
+
+
+def _check_tenant_name(tenant_name: str):
+    """
+    Confere o tenant só com a lista já carregada, sem acessar o banco.
+    Retorna True se é conhecido e False se a lista precisa ser (re)carregada;
+    levanta UnknownTenantError se é inválido ou ausente de uma lista recente.
+    """
+    if not tenant_name or not TENANT_NAME_PATTERN.match(tenant_name):
+        raise UnknownTenantError(f"Tenant inválido: {tenant_name!r}")
+
+    tenants = _known_tenants
+    if tenants is None:
+        return False
+    if tenant_name in tenants:
+        return True
+    if time.monotonic() - _known_tenants_loaded_at < TENANT_ALLOWLIST_REFRESH:
+        raise UnknownTenantError(f"Tenant desconhecido: {tenant_name!r}")
+    return False
+
+
+def validate_tenant_name(tenant_name: str):
+    if not _check_tenant_name(tenant_name):
+        known_tenants(refresh=True)
+        if not _check_tenant_name(tenant_name):
+            raise UnknownTenantError(f"Tenant desconhecido: {tenant_name!r}")
+    return tenant_name
+
+
+async def async_validate_tenant_name(tenant_name: str):
+    """
+    validate_tenant_name para o event loop: a lista de tenants é carregada
+    com o psycopg2 (e sob lock), então a carga roda em uma thread.
+    """
+    if not _check_tenant_name(tenant_name):
+        await asyncio.to_thread(validate_tenant_name, tenant_name)
+    return tenant_name
+
+
+@contextmanager
+def tenant_transaction(tenant_name: str = None):
+    """
+    Equivalente a engine.begin(), mas com o search_path da transação apontado
+    para o schema do tenant (seguido de public). Assim os comandos usam nomes
+    de tabela sem schema e o SQL é idêntico para todos os tenants.
+    Também mede o tempo de espera por uma conexão do pool.
+    """
+    if tenant_name is not None:
+        validate_tenant_name(tenant_name)
+
+    started = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeoutError:
+        with _pool_lock:
+            _pool_metrics["checkout_timeouts"] += 1
+        raise
+
+    waited = time.perf_counter() - started
+    with _pool_lock:
+        _pool_metrics["checkouts"] += 1
+        _pool_metrics["checkout_wait_total"] += waited
+        _pool_metrics["checkout_wait_max"] = max(_pool_metrics["checkout_wait_max"], waited)
+
+    with conn:
+        with conn.begin():
+            if tenant_name is not None:
+                # SET LOCAL vale só para esta transação; a conexão volta limpa ao pool
+                conn.exec_driver_sql(f'SET LOCAL search_path TO "{tenant_name}", public')
+            yield conn
+
+
+def pool_stats():
+    """Métricas do pool de conexões deste worker."""
+    pool = engine.pool
+    capacity = POOL_SIZE + MAX_OVERFLOW
+    checked_out = pool.checkedout()
+
+    with _pool_lock:
+        metrics = dict(_pool_metrics)
+
+    checkouts = metrics["checkouts"]
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 3) if capacity else None,
+        "checkouts": checkouts,
+        "checkout_timeouts": metrics["checkout_timeouts"],
+        "checkout_wait_avg": round(metrics["checkout_wait_total"] / checkouts, 6) if checkouts else 0.0,
+        "checkout_wait_max": round(metrics["checkout_wait_max"], 6),
+        "connection_age_max": round(metrics["connection_age_max"], 3),
+    }
+
+
+# --- Modo assíncrono (asgi.py) ---
+# O driver assíncrono (asyncpg) só é carregado quando o engine é usado pela
+# primeira vez; o modo síncrono (main.py) não depende dele.
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+_async_engine = None
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        _async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=POOL_PRE_PING,
+            json_serializer=codec.dumps,
+            json_deserializer=codec.loads,
+        )
+    return _async_engine
+
+
+@asynccontextmanager
+async def async_tenant_transaction(tenant_name: str = None):
+    """
+    Versão assíncrona de tenant_transaction: transação no engine asyncpg com o
+    search_path do tenant. O PostgreSQL replaneja os prepared statements do
+    asyncpg quando o search_path muda, então o cache de comandos por conexão
+    continua valendo entre tenants.
+    """
+    if tenant_name is not None:
+        await async_validate_tenant_name(tenant_name)
+
+    async with get_async_engine().begin() as conn:
+        if tenant_name is not None:
+            await conn.exec_driver_sql(f'SET LOCAL search_path TO "{tenant_name}", public')
+        yield conn
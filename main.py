@@ -1,22 +1,90 @@
-from flask import Flask, request, jsonify
-from service.application import get_basic_questions, create_candidate, create_candidate_phone, create_recruitment_process, get_chat_stage_by_id, update_chat_stage, save_answers
-import pandas as pd
-import json
-from datetime import datetime
-from db_config import engine
-from sqlalchemy import text
-
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from service import startup
+
+with startup.timed("flask"):
+    from flask import Flask, Response, request, jsonify, g, send_file, stream_with_context
+with startup.timed("sqlalchemy"):
+    from db_config import engine, pool_stats, UnknownTenantError
+with startup.timed("service"):
+    from service.application import invalidate_basic_questions, basic_questions_cache_stats, create_application, chat_stage_conflict_stats, chat_stage_tenant, context_questions, extract_application_fields, APPLICATION_CHAT_STAGE_COLUMNS
+    from service.session_cache import get_chat_stage_by_id, get_active_sessions_by_phone, apply_session_updates, get_chat_messages, session_cache_stats
+    from service.browser import browser_pool
+    from service.jobs import DatabaseJobStore, JobQueue, QueueFullError, RetryableJobError
+    from service.history import compact_chat_stages, CHAT_HOT_MESSAGES
+    from service.export import export_applications, parse_export_date, ExportNotFoundError
+    from service.evolution import ingest_evolution_event, evolution_dedupe_stats, media_path
+    from service.idempotency import idempotent, idempotency_cache_stats
+    from service.form_schema import get_form_schema, invalidate_form_schema, form_schema_cache_stats
+    from service.cache_sync import cache_sync_stats, CACHE_SYNC_INTERVAL
+    from service import admission
+    from service.jobposting import create_job_posting as create_job_posting_for_tenant, create_job_postings
+    from service import codec, metrics, statements
+import os
 import time
 
-
 app = Flask(__name__)
+codec.install_flask_provider(app)
+
+# Opcional: abre sessões do Chrome já na subida do worker
+if os.environ.get("BROWSER_POOL_WARMUP"):
+    browser_pool.warm_up(int(os.environ["BROWSER_POOL_WARMUP"]))
+
+# Fila das inscrições finais (Selenium), processada fora da requisição HTTP. O
+# estado dos jobs fica em public.form_jobs, para que a consulta do job funcione
+# em qualquer worker; FORM_JOB_STORE=memory só serve com um único worker
+form_jobs = JobQueue(
+    workers=int(os.environ.get("FORM_JOB_WORKERS", str(browser_pool.size))),
+    max_pending=int(os.environ.get("FORM_JOB_MAX_PENDING", "100")),
+    max_attempts=int(os.environ.get("FORM_JOB_MAX_ATTEMPTS", "3")),
+    backoff=float(os.environ.get("FORM_JOB_BACKOFF", "2")),
+    store=None if os.environ.get("FORM_JOB_STORE", "database") == "memory" else DatabaseJobStore(),
+)
+
+def _request_tenant(req):
+    # O tenant vem na query string (createjobposting), no corpo JSON (update_session
+    # e o lote) ou é o da sessão do ats_chat_stage_id (add_application); a própria
+    # rota pode defini-lo em g.tenant_name
+    tenant = g.get("tenant_name") or req.args.get("tenant") or req.args.get("tenant_name")
+    if tenant:
+        return tenant
+    payload = req.get_json(silent=True)
+    tenant = admission.payload_tenant(payload)
+    if not tenant and isinstance(payload, dict) and payload.get("ats_chat_stage_id") is not None:
+        tenant = chat_stage_tenant(payload["ats_chat_stage_id"])
+    return tenant
+
+def _gauges():
+    for key, value in pool_stats().items():
+        yield f"db_pool_{key}", {}, value
+    for key, value in form_jobs.stats().items():
+        yield f"form_jobs_{key}", {}, value
+    for key, value in browser_pool.stats().items():
+        yield f"browser_pool_{key}", {}, value
+    for key, value in basic_questions_cache_stats().items():
+        yield f"basic_questions_cache_{key}", {}, value
+    for key, value in cache_sync_stats().items():
+        yield f"cache_sync_{key}", {}, value
+    for key, value in evolution_dedupe_stats().items():
+        yield f"evolution_dedupe_{key}", {}, value
+    for key, value in idempotency_cache_stats().items():
+        yield f"idempotency_cache_{key}", {}, value
+    for key, value in statements.statement_stats().items():
+        yield f"sql_statements_{key}", {}, value
+    for key, value in session_cache_stats().items():
+        yield f"session_cache_{key}", {}, value
+    for key, value in form_schema_cache_stats().items():
+        yield f"form_schema_cache_{key}", {}, value
+    for tenant, conflicts in chat_stage_conflict_stats().items():
+        yield "chat_stage_conflicts_total", {"tenant": tenant}, conflicts
+    yield from admission.admission_stats()
+
+metrics.install_sqlalchemy_hooks(engine)
+metrics.install_flask_hooks(app, _request_tenant)
+metrics.register_collector(_gauges)
+admission.install_flask_hooks(app, _request_tenant)
+
+@app.errorhandler(UnknownTenantError)
+def unknown_tenant(e):
+    return jsonify({"error": str(e)}), 400
 
 # GET simples: retorna uma mensagem JSON
 @app.route("/", methods=["GET"])
@@ -24,63 +92,15 @@ def home():
     return jsonify({"message": "Olá!"})
 
 @app.route("/update_session", methods=["POST"])
+@idempotent("update_session")
 def update_session():
     try:
         payload = request.get_json(force=True)
 
-        candidate_message = payload.get("candidate_message")
-        system_message = payload.get("system_message")
-        question_id = payload.get("question_id")
-        interaction = payload.get("interaction")
-        chat_stage_id = payload.get("chat_stage_id")
-        tenant_name = payload.get("tenant_name")
-        status = payload.get("status")
-
-        now_iso = datetime.utcnow().isoformat() + "Z"
-
-        # Busca os dados atuais (sem expor engine aqui)
-        result = get_chat_stage_by_id(chat_stage_id, tenant_name)
-        if not result:
-            return jsonify({"error": "Registro não encontrado"}), 404
-
-        conversation = result["conversation"] or []
-        if isinstance(conversation, str):
-            conversation = json.loads(conversation)
-
-        conversation.extend([
-            {"date": now_iso, "from": "system", "message": system_message},
-            {"date": now_iso, "from": "candidate", "message": candidate_message}
-        ])
-
-        context = result["context"] or {}
-        if isinstance(context, str):
-            context = json.loads(context)
-
-        if interaction == "answer":
-            updated = False
-            for question in context.get("steps", {}).get("questions", []):
-                if question.get("id") == question_id:
-                    question["candidate_answer"] = candidate_message
-                    updated = True
-                    break
-
-            if not updated:
-                return jsonify({"error": f"Questão com id {question_id} não encontrada no contexto"}), 400
-
-            update_chat_stage(
-                chat_stage_id=chat_stage_id,
-                tenant_name=tenant_name,
-                conversation=conversation,
-                status=status,
-                context=context
-            )
-        else:
-            update_chat_stage(
-                chat_stage_id=chat_stage_id,
-                tenant_name=tenant_name,
-                conversation=conversation,
-                status=status
-            )
+        # Mesmo caminho do lote, com um único turno
+        result = apply_session_updates([payload])[0]
+        if "error" in result:
+            return jsonify({"error": result["error"]}), result["code"]
 
         return jsonify({"status": "OK"}), 200
 
@@ -88,75 +108,149 @@ def update_session():
         print("Erro interno:", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/update_session/batch", methods=["POST"])
+def update_session_batch():
+    try:
+        payload = request.get_json(force=True)
+
+        # Aceita a lista direto ou dentro de {"items": [...]}
+        items = payload.get("items") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return jsonify({"error": "Envie uma lista de itens em 'items'"}), 400
+
+        results = apply_session_updates(items)
+
+        return jsonify({
+            "results": results,
+            "applied": sum(1 for result in results if "error" not in result),
+            "failed": sum(1 for result in results if "error" in result)
+        }), 200
+
+    except Exception as e:
+        print("Erro interno:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/session/active", methods=["GET"])
+def active_session():
+    phone = request.args.get("phone")
+    if not phone:
+        return jsonify({"error": "Parâmetro 'phone' é obrigatório"}), 400
+
+    sessions = get_active_sessions_by_phone(phone)
+
+    return jsonify({
+        "session": sessions[0] if sessions else None,
+        "sessions": sessions
+    })
+
+
+@app.route("/chat_stage/<int:chat_stage_id>/messages", methods=["GET"])
+def chat_stage_messages(chat_stage_id):
+    """Últimas N mensagens da sessão (histórico quente e arquivado), paginando com ?before=."""
+    try:
+        limit = int(request.args.get("limit", "50"))
+    except ValueError:
+        return jsonify({"error": "Parâmetro 'limit' inválido"}), 400
+
+    try:
+        page = get_chat_messages(chat_stage_id, limit, request.args.get("before"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if page is None:
+        return jsonify({"error": "Registro não encontrado"}), 404
+
+    return jsonify(page)
+
+
+@app.route("/chat_stage/compact", methods=["POST"])
+def compact_chat_stage_history():
+    """Arquiva o histórico antigo das sessões (chamado por agendador)."""
+    payload = request.get_json(silent=True) or {}
+    try:
+        keep_last = int(payload.get("keep_last", CHAT_HOT_MESSAGES))
+        limit = int(payload.get("limit", 100))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Parâmetros 'keep_last' e 'limit' devem ser inteiros"}), 400
+
+    # Ids de ats_chat_stage (coluna integer); bool também é int em Python
+    chat_stage_ids = payload.get("chat_stage_ids")
+    if chat_stage_ids is not None and not (
+        isinstance(chat_stage_ids, list)
+        and all(type(chat_stage_id) is int and 0 < chat_stage_id < 2 ** 31 for chat_stage_id in chat_stage_ids)
+    ):
+        return jsonify({"error": "Parâmetro 'chat_stage_ids' deve ser uma lista de ids inteiros"}), 400
+
+    summary = compact_chat_stages(keep_last=keep_last, limit=limit, chat_stage_ids=chat_stage_ids)
+    return jsonify(summary)
+
+
+@app.route("/ingest/evolution", methods=["POST"])
+def ingest_evolution():
+    try:
+        body = request.get_json(force=True)
+        # O n8n às vezes repassa o webhook como lista com um item
+        if isinstance(body, list):
+            body = body[0] if body else {}
+        # Aceita também o item do nó Webhook do n8n ({"body": {...}})
+        if isinstance(body, dict) and isinstance(body.get("body"), dict) and "data" not in body:
+            body = body["body"]
+        if not isinstance(body, dict):
+            return jsonify({"error": "Corpo do webhook inválido"}), 400
+
+        event, skipped = ingest_evolution_event(body)
+        if skipped == "em_processamento":
+            return jsonify({"error": "Mensagem ainda em processamento", "reason": skipped}), 409
+        if event is None:
+            return jsonify({"ignored": True, "reason": skipped}), 200
+
+        # Sem MEDIA_BASE_URL, a mídia é baixada pelo mesmo endereço do webhook
+        if event["media"] and event["media"]["url"].startswith("/"):
+            event["media"]["url"] = request.url_root.rstrip("/") + event["media"]["url"]
+
+        return jsonify(event), 200
+
+    except ValueError as e:
+        # Mídia em base64 inválida
+        return jsonify({"error": str(e)}), 400
+
+    except Exception as e:
+        print("Erro ao processar webhook da Evolution:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/media/<media_id>", methods=["GET"])
+def download_media(media_id):
+    """Mídia (áudio/documento) recebida pelo /ingest/evolution, disponível por MEDIA_RETENTION_HOURS."""
+    path = media_path(media_id)
+    if path is None:
+        return jsonify({"error": "Mídia não encontrada"}), 404
+    return send_file(path, max_age=0)
+
 
 # POST: recebe JSON e retorna processado
 @app.route("/add_application", methods=["POST"])
+@idempotent("add_application")
 def add_application():
     try:
         data = request.get_json(force=True)
         chat_id = data["ats_chat_stage_id"]
 
         # Busca o contexto da conversa
-        result = get_chat_stage_by_id(chat_id)
+        result = get_chat_stage_by_id(chat_id, columns=APPLICATION_CHAT_STAGE_COLUMNS)
         context = result["context"]
-        tenant_name = result["tenant_name"]
+        tenant_name = g.tenant_name = result["tenant_name"]
         job_posting_id = result["job_posting_id"]
         phone = result["candidate_phone_number_id"]
-        questions = context[0].get("steps", {}).get("questions", [])
-
-        # Inicializa variáveis
-        name = cpf = email = document = None
-        customized_rows = []
-
-        for q in questions:
-            q_type = q.get("type")
-            q_key = q.get("key")
-            q_user_answer = q.get("user_answer")
-
-            # Campos individuais
-            if q_key == "name" and q_type == "basic":
-                name = q_user_answer
-            elif q_key == "email" and q_type == "basic":
-                email = q_user_answer
-            elif q_key == "cpf" and q_type == "basic":
-                cpf = q_user_answer
-            elif q_key == "document":
-                document = q_user_answer
-
-            # Dados para o dataframe
-            if q_type == "customized":
-                customized_rows.append({
-                    "id": q.get("id"),
-                    "name": q.get("name"),
-                    "key": q.get("key"),
-                    "answer_type": q.get("answer_type"),
-                    "user_answer": q.get("user_answer"),
-                    "answer_options": q.get("answer_options", [])
-                })
-                
-        print(customized_rows)
-
-        # Apenas para debug no log
-        print("Name:", name)
-        print("Phone:", phone)
-        print("Cpf:", cpf)
-        print("Email:", email)
-        print("Document:", document)
-
-        # Cria o DataFrame com perguntas personalizadas
-        questions_df = pd.DataFrame(customized_rows)
-
-        #cria o candidato
-        candidate_id = create_candidate(tenant_name, name, email, cpf)
-
-        #cria telefone do candidato
-        create_candidate_phone(tenant_name, candidate_id, phone)
-
-        #registra a inscrição
-        recruitment_process_id = create_recruitment_process(tenant_name, candidate_id, job_posting_id)
-
-        #salva as respostas
-        save_answers(questions_df, recruitment_process_id, tenant_name)
+        questions = context_questions(context)
+
+        fields = extract_application_fields(questions, get_form_schema(tenant_name, job_posting_id))
+        name, email, cpf, document = fields["name"], fields["email"], fields["cpf"], fields["document"]
+        customized_rows = fields["customized_rows"]
+
+        # Cria candidato, telefone, inscrição e respostas em uma única transação
+        create_application(tenant_name, job_posting_id, name, email, cpf, phone, customized_rows)
 
         # Opcional: retornar dados como JSON
         return jsonify({
@@ -164,7 +258,7 @@ def add_application():
             "phone": phone,
             "email": email,
             "document": document,
-            "questions": questions_df.to_dict(orient="records")
+            "questions": customized_rows
         }), 200
 
     except Exception as e:
@@ -173,22 +267,6 @@ def add_application():
         return jsonify({"erro": str(e)}), 500
 
 
-        # # Cria o DataFrame com as perguntas
-        # df_questions = pd.DataFrame(body["questions"])
-
-        # #cria o candidato
-        # candidate_id = create_candidate(tenant_name,name,email,document)
-
-        # #cria telefone do candidato
-        # create_candidate_phone(tenant_name, candidate_id, phone)
-
-        # #registra a inscrição
-        # recruitment_process_id = create_recruitment_process(tenant_name, candidate_id, job_posting_id)
-
-        # #salva as respostas
-        # #save_answers(df_questions, recruitment_process_id, tenant_name)
-        #return jsonify({"chat_id": chat_id}), 200
-
 @app.route("/createjobposting", methods=["GET"])
 def create_job_posting():
     name = request.args.get("name")
@@ -199,129 +277,200 @@ def create_job_posting():
         return jsonify({"error": "Parâmetro 'name' é obrigatório"}), 400
 
     if not tenant:
-        return jsonify({"error": "Parâmetro 'name' é obrigatório"}), 400
+        return jsonify({"error": "Parâmetro 'tenant' é obrigatório"}), 400
 
-    question_json = get_basic_questions(tenant)
-    now = datetime.utcnow()
-
-    with engine.begin() as conn:
-        insert_sql = text(f"""
-            INSERT INTO {tenant}.ats_jobposting (
-                name,
-                status,
-                positions,
-                created_at,
-                updated_at,
-                description,
-                external_publication,
-                netvagas_external_publication,
-                google_for_jobs_external_publication,
-                already_suspended,
-                already_canceled,
-                linkedin_external_publication,
-                unlisted_external_publication,
-                careerjet_external_publication,
-                jooble_external_publication,
-                competencies,
-                question_sequence,
-                job_code 
-            ) VALUES (
-                :name,
-                :status,
-                :positions,
-                :created_at,
-                :updated_at,
-                :description,
-                :external_publication,
-                :netvagas_external_publication,
-                :google_for_jobs_external_publication,
-                :already_suspended,
-                :already_canceled,
-                :linkedin_external_publication,
-                :unlisted_external_publication,
-                :careerjet_external_publication,
-                :jooble_external_publication,
-                :competencies,
-                :question_sequence,
-                :job_code
-            )
-            RETURNING id
-        """)
-
-        result = conn.execute(insert_sql, {
-            "name": name,
-            "status": "aberta",
-            "positions": 0,
-            "created_at": now,
-            "updated_at": now,
-            "description": "",
-            "external_publication": False,
-            "netvagas_external_publication": False,
-            "google_for_jobs_external_publication": False,
-            "already_suspended": False,
-            "already_canceled": False,
-            "linkedin_external_publication": False,
-            "unlisted_external_publication": False,
-            "careerjet_external_publication": False,
-            "jooble_external_publication": False,
-            "competencies": [],
-            "question_sequence": json.dumps(question_json, ensure_ascii=False),
-            "job_code": job_code
-        })
-
-        new_id = result.scalar()
+    new_id = create_job_posting_for_tenant(tenant, name, job_code)
 
     return jsonify({
         "message": "Job posting criada com sucesso",
         "job_posting_id": new_id
     })
 
+@app.route("/jobposting/<int:job_posting_id>/applications", methods=["GET"])
+def job_posting_applications(job_posting_id):
+    """
+    Exporta as inscrições da vaga em NDJSON (padrão) ou CSV, em streaming.
+    Filtros opcionais: since/until (created_at) e updated_since (updated_at).
+    """
+    tenant = g.tenant_name = request.args.get("tenant")
+    output_format = request.args.get("format", "ndjson")
 
+    if not tenant:
+        return jsonify({"error": "Parâmetro 'tenant' é obrigatório"}), 400
 
-def preencher_formulario(nome, email, telefone, data_nascimento, cpf, origem):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless=new")  # modo headless (novo padrão para Chrome 109+)
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--log-level=3")
+    try:
+        chunks = export_applications(
+            tenant, job_posting_id, output_format,
+            since=parse_export_date(request.args.get("since"), "since"),
+            until=parse_export_date(request.args.get("until"), "until"),
+            updated_since=parse_export_date(request.args.get("updated_since"), "updated_since"),
+        )
+    except ExportNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except UnknownTenantError:
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if output_format == "csv":
+        return Response(stream_with_context(chunks), mimetype="text/csv", headers={
+            "Content-Disposition": f"attachment; filename=jobposting_{job_posting_id}_applications.csv"
+        })
+    return Response(stream_with_context(chunks), mimetype="application/x-ndjson")
 
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+# Limite de vagas por chamada do /createjobposting/bulk
+JOB_POSTING_BULK_MAX = int(os.environ.get("JOB_POSTING_BULK_MAX", "500"))
 
+@app.route("/createjobposting/bulk", methods=["POST"])
+def create_job_posting_bulk():
     try:
-        driver.get("https://oportunidades.mindsight.com.br/demoprodutos/428/register")
+        payload = request.get_json(force=True)
 
-        wait = WebDriverWait(driver, 15)
+        # Aceita a lista direto ou dentro de {"items": [...]}
+        items = payload.get("items") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return jsonify({"error": "Envie uma lista de itens em 'items'"}), 400
+        if len(items) > JOB_POSTING_BULK_MAX:
+            return jsonify({"error": f"Máximo de {JOB_POSTING_BULK_MAX} vagas por chamada"}), 400
 
-        # Preencher campos obrigatórios
-        wait.until(EC.presence_of_element_located((By.ID, "name"))).send_keys(nome)
-        driver.find_element(By.ID, "email").send_keys(email)
-        driver.find_element(By.ID, "candidatePhoneNumbers_0_phoneNumber").send_keys(telefone)
-        driver.find_element(By.ID, "birthday").send_keys(data_nascimento)
-        driver.find_element(By.ID, "candidateCPF").send_keys(cpf)
+        results = create_job_postings(items)
 
-        # Selecionar origem (ex: Instagram)
-        dropdown = driver.find_element(By.ID, "candidateSource")
-        driver.execute_script("arguments[0].click();", dropdown)
-        time.sleep(1)  # pequeno delay para carregar opções
+        return jsonify({
+            "results": results,
+            "created": sum(1 for result in results if "error" not in result),
+            "failed": sum(1 for result in results if "error" in result)
+        }), 200
+
+    except Exception as e:
+        print("Erro interno:", e)
+        return jsonify({"error": str(e)}), 500
 
-        opcao_xpath = f"//div[contains(@class, 'ant-select-item-option') and .//div[text()='{origem}']]"
-        opcao = driver.find_element(By.XPATH, opcao_xpath)
-        driver.execute_script("arguments[0].click();", opcao)
 
-        # Submeter o formulário
-        btn = driver.find_element(By.XPATH, "//button[.//span[text()='Enviar candidatura']]")
-        driver.execute_script("arguments[0].click();", btn)
+@app.route("/cache/basic_questions/invalidate", methods=["POST"])
+def invalidate_basic_questions_cache():
+    # Sem tenant, limpa o cache de todos os tenants
+    payload = request.get_json(silent=True) or {}
+    tenant = payload.get("tenant") or request.args.get("tenant")
 
-        time.sleep(5)  # aguarda resposta
+    removed = invalidate_basic_questions(tenant)
 
-        return True
-    except Exception as e:
-        print("Erro ao enviar:", str(e))
-        return False
+    # "removed" conta só este worker; os demais descartam em até propagation_seconds
+    return jsonify({
+        "tenant": tenant,
+        "removed": removed,
+        "scope": "all_workers",
+        "propagation_seconds": CACHE_SYNC_INTERVAL,
+        "stats": basic_questions_cache_stats()
+    })
+
+@app.route("/cache/basic_questions/stats", methods=["GET"])
+def basic_questions_cache_status():
+    return jsonify(basic_questions_cache_stats())
+
+@app.route("/cache/form_schema/invalidate", methods=["POST"])
+def invalidate_form_schema_cache():
+    # Sem tenant e vaga, limpa o cache de todas as vagas
+    payload = request.get_json(silent=True) or {}
+    tenant = payload.get("tenant") or request.args.get("tenant")
+    job_posting_id = payload.get("job_posting_id") or request.args.get("job_posting_id")
+
+    if job_posting_id is not None:
+        try:
+            if isinstance(job_posting_id, bool):
+                raise TypeError(job_posting_id)
+            job_posting_id = int(job_posting_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Parâmetro 'job_posting_id' deve ser inteiro"}), 400
+        if not tenant:
+            return jsonify({"error": "Parâmetro 'tenant' é obrigatório junto com 'job_posting_id'"}), 400
+
+    removed = invalidate_form_schema(tenant, job_posting_id)
+
+    # "removed" conta só este worker; os demais descartam em até propagation_seconds
+    return jsonify({
+        "tenant": tenant,
+        "job_posting_id": job_posting_id,
+        "removed": removed,
+        "scope": "all_workers",
+        "propagation_seconds": CACHE_SYNC_INTERVAL,
+        "stats": form_schema_cache_stats()
+    })
+
+
+REGISTER_URL = os.environ.get("REGISTER_URL", "https://oportunidades.mindsight.com.br/demoprodutos/428/register")
+FORM_TIMEOUT = float(os.environ.get("FORM_TIMEOUT", "15"))
+# Elementos que a página mostra depois do envio: confirmação de sucesso ou
+# erro de validação do servidor (ex.: CPF já cadastrado)
+FORM_SUCCESS_SELECTOR = os.environ.get("FORM_SUCCESS_SELECTOR", ".ant-result-success, .ant-message-success")
+FORM_ERROR_SELECTOR = os.environ.get("FORM_ERROR_SELECTOR", ".ant-form-item-explain-error, .ant-message-error")
+
+def preencher_formulario(nome, email, telefone, data_nascimento, cpf, origem, url=REGISTER_URL):
+    started = time.perf_counter()
+    sucesso = False
+    try:
+        sucesso = _preencher_formulario(nome, email, telefone, data_nascimento, cpf, origem, url)
+        return sucesso
     finally:
-        driver.quit()
+        metrics.SELENIUM_SECONDS.observe(time.perf_counter() - started, result="ok" if sucesso else "erro")
+
+def _preencher_formulario(nome, email, telefone, data_nascimento, cpf, origem, url):
+    """
+    Preenche e envia o formulário de cadastro. Falhas antes do clique em
+    "Enviar candidatura" lançam RetryableJobError (nada foi enviado, a fila
+    pode tentar de novo). Depois do clique o resultado só conta como sucesso
+    se a página mostrar a confirmação; erro de validação ou falta de resposta
+    retornam False sem nova tentativa, para não cadastrar o candidato duas vezes.
+    """
+    # Selenium só é carregado quando a primeira inscrição é enviada
+    By = startup.lazy_import("selenium.webdriver.common.by").By
+    WebDriverWait = startup.lazy_import("selenium.webdriver.support.ui").WebDriverWait
+    EC = startup.lazy_import("selenium.webdriver.support.expected_conditions")
+
+    # A sessão do Chrome vem do pool e é devolvida limpa ao final
+    with browser_pool.session() as driver:
+        wait = WebDriverWait(driver, FORM_TIMEOUT)
+
+        try:
+            driver.get(url)
+
+            # Preencher campos obrigatórios
+            wait.until(EC.presence_of_element_located((By.ID, "name"))).send_keys(nome)
+            driver.find_element(By.ID, "email").send_keys(email)
+            driver.find_element(By.ID, "candidatePhoneNumbers_0_phoneNumber").send_keys(telefone)
+            driver.find_element(By.ID, "birthday").send_keys(data_nascimento)
+            driver.find_element(By.ID, "candidateCPF").send_keys(cpf)
+
+            # Selecionar origem (ex: Instagram), aguardando as opções carregarem
+            dropdown = driver.find_element(By.ID, "candidateSource")
+            driver.execute_script("arguments[0].click();", dropdown)
+
+            opcao_xpath = f"//div[contains(@class, 'ant-select-item-option') and .//div[text()='{origem}']]"
+            opcao = wait.until(EC.presence_of_element_located((By.XPATH, opcao_xpath)))
+            driver.execute_script("arguments[0].click();", opcao)
+
+            btn = driver.find_element(By.XPATH, "//button[.//span[text()='Enviar candidatura']]")
+        except Exception as e:
+            print("Formulário não enviado:", str(e))
+            raise RetryableJobError(f"Formulário não enviado: {e}") from e
+
+        # Submeter o formulário; daqui em diante não há nova tentativa
+        try:
+            driver.execute_script("arguments[0].click();", btn)
+
+            wait.until(EC.any_of(
+                EC.visibility_of_element_located((By.CSS_SELECTOR, FORM_SUCCESS_SELECTOR)),
+                EC.visibility_of_element_located((By.CSS_SELECTOR, FORM_ERROR_SELECTOR)),
+            ))
+        except Exception as e:
+            print("Envio não confirmado:", str(e))
+            return False
+
+        erros = [el.text for el in driver.find_elements(By.CSS_SELECTOR, FORM_ERROR_SELECTOR) if el.is_displayed()]
+        if erros:
+            print("Formulário recusado:", "; ".join(erros))
+            return False
+
+        return True
 
 @app.route("/inscricaofinal", methods=["GET"])
 def inscricao_final():
@@ -335,16 +484,54 @@ def inscricao_final():
     if not all([nome, email, telefone, cpf, data_nascimento, origem]):
         return jsonify({"status": "erro", "mensagem": "Parâmetros obrigatórios ausentes."}), 400
 
-    sucesso = preencher_formulario(nome, email, telefone, data_nascimento, cpf, origem)
+    try:
+        job_id = form_jobs.submit(preencher_formulario, nome, email, telefone, data_nascimento, cpf, origem)
+    except QueueFullError as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 503, {"Retry-After": str(admission.ADMISSION_RETRY_AFTER)}
+
+    return jsonify({
+        "status": "na_fila",
+        "mensagem": "Inscrição enfileirada para envio.",
+        "job_id": job_id,
+        "status_url": f"/inscricaofinal/{job_id}"
+    }), 202
+
+@app.route("/inscricaofinal/stats", methods=["GET"])
+def inscricao_final_stats():
+    return jsonify(form_jobs.stats())
+
+@app.route("/inscricaofinal/<job_id>", methods=["GET"])
+def inscricao_final_status(job_id):
+    job = form_jobs.get(job_id)
+    if not job:
+        return jsonify({"status": "erro", "mensagem": "Job não encontrado."}), 404
+
+    return jsonify(job)
+
+
+@app.route("/startup", methods=["GET"])
+def startup_report():
+    return jsonify(startup.report())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/metrics/db", methods=["GET"])
+def db_metrics():
+    return jsonify(pool_stats())
 
-    if sucesso:
-        return jsonify({"status": "ok", "mensagem": "Formulário enviado com sucesso."})
-    else:
-        return jsonify({"status": "erro", "mensagem": "Erro ao enviar formulário."}), 500
+@app.route("/metrics/chat_stage", methods=["GET"])
+def chat_stage_metrics():
+    return jsonify({"conflicts_by_tenant": chat_stage_conflict_stats()})
 
+@app.route("/browser/health", methods=["GET"])
+def browser_health():
+    return jsonify(browser_pool.check_health())
 
 
 
+print(f"🚀 Aplicação carregada em {startup.mark_ready():.3f}s")
 
 # Executa localmente (Railway ignora essa parte no deploy)
 if __name__ == "__main__":
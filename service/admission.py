@@ -0,0 +1,364 @@
+"""
+Controle de admissão por tenant e por rota, na frente das rotas da API.
+
+Cada requisição passa por dois limites, sempre por processo (worker):
+
+  - do tenant: no máximo ADMISSION_TENANT_CONCURRENCY requisições em
+    andamento e, se ADMISSION_TENANT_RATE > 0, um balde de fichas com essa
+    taxa (req/s). Estourar o limite do tenant responde 429: um tenant em
+    campanha não consome a capacidade dos outros.
+  - da rota: concorrência e taxa configuradas em ADMISSION_ROUTE_LIMITS
+    (JSON, ex.: {"/inscricaofinal": {"concurrency": 4, "rate": 5, "burst": 20}}).
+    Estourar o limite da rota responde 503: o serviço está saturado.
+
+Sem vaga de concorrência, a requisição espera até ADMISSION_QUEUE_TIMEOUT
+segundos antes de ser recusada. As recusas trazem Retry-After e devolvem as
+fichas já cobradas da requisição. Limites específicos por tenant vão em
+ADMISSION_TENANT_LIMITS (mesmo formato, com o nome do tenant como chave).
+
+Só tenants válidos (db_config.validate_tenant_name) têm limites e métricas
+próprios; um nome desconhecido conta apenas nos limites da rota, então os
+contadores não crescem com o que vem nas requisições.
+"""
+import math
+import os
+import threading
+import time
+
+from db_config import UnknownTenantError, async_validate_tenant_name, validate_tenant_name
+from service import codec
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_TENANT_CONCURRENCY = int(os.environ.get("ADMISSION_TENANT_CONCURRENCY", "16"))
+ADMISSION_TENANT_RATE = float(os.environ.get("ADMISSION_TENANT_RATE", "0"))
+ADMISSION_TENANT_BURST = float(os.environ.get("ADMISSION_TENANT_BURST", "0"))
+ADMISSION_TENANT_LIMITS = codec.loads(os.environ.get("ADMISSION_TENANT_LIMITS", "{}"))
+# A fila do Selenium é compartilhada por todos os tenants: limita a entrada nela
+ADMISSION_ROUTE_LIMITS = codec.loads(os.environ.get(
+    "ADMISSION_ROUTE_LIMITS", '{"/inscricaofinal": {"concurrency": 8, "rate": 5, "burst": 20}}'
+))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "0.05"))
+# Retry-After (s) sugerido quando falta vaga de concorrência
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_EXEMPT_ROUTES = {
+    route.strip() for route in os.environ.get(
+        "ADMISSION_EXEMPT_ROUTES",
+        "/,/metrics,/metrics/db,/metrics/chat_stage,/startup,/browser/health,"
+        "/inscricaofinal/stats,/cache/basic_questions/stats",
+    ).split(",") if route.strip()
+}
+
+# Acima disso, baldes cheios (parados) são descartados
+_MAX_BUCKETS = 1024
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada; status é 429 (limite do tenant) ou 503 (limite da rota)."""
+
+    def __init__(self, message: str, status: int, retry_after: int, scope: str, reason: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.scope = scope
+        self.reason = reason
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` fichas por segundo, no máximo `burst` acumuladas."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now: float):
+        """Consome uma ficha; retorna 0 ou os segundos até a próxima ficha."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Devolve a ficha de uma requisição que acabou recusada."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def idle(self, now: float):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Ticket:
+    __slots__ = ("keys", "released")
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.released = False
+
+
+class AdmissionController:
+    def __init__(self, tenant_concurrency: int, tenant_rate: float, tenant_burst: float,
+                 tenant_limits: dict, route_limits: dict, queue_timeout: float, retry_after: int):
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst or tenant_rate
+        self.tenant_limits = tenant_limits
+        self.route_limits = route_limits
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        # Contadores de requisições em andamento; a chave sai quando zera
+        self._inflight = {}
+        self._waiting = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+        self.admitted = 0
+        self.shed = {}
+
+    def _limits(self, scope: str, key: str):
+        """(concorrência, taxa, rajada) do tenant ou da rota; 0 = sem limite."""
+        if scope == "tenant":
+            limits = self.tenant_limits.get(key, {})
+            concurrency = limits.get("concurrency", self.tenant_concurrency)
+            rate = limits.get("rate", self.tenant_rate)
+            burst = limits.get("burst", rate if "rate" in limits else self.tenant_burst)
+        else:
+            limits = self.route_limits.get(key, {})
+            concurrency = limits.get("concurrency", 0)
+            rate = limits.get("rate", 0)
+            burst = limits.get("burst", rate)
+        return int(concurrency), float(rate), float(burst)
+
+    def _reject(self, scope: str, key: str, reason: str, retry_after: float):
+        label = (scope, key, reason)
+        self.shed[label] = self.shed.get(label, 0) + 1
+        status = 429 if scope == "tenant" else 503
+        message = (
+            f"Limite de requisições do tenant {key} atingido" if scope == "tenant"
+            else f"Serviço saturado em {key}, tente novamente"
+        )
+        return AdmissionRejected(message, status, max(1, math.ceil(retry_after)), scope, reason)
+
+    def _take_rates(self, checks, now):
+        taken = []
+        for scope, key, (_, rate, burst) in checks:
+            if rate <= 0:
+                continue
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                if len(self._buckets) >= _MAX_BUCKETS:
+                    self._prune_buckets(now)
+                bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst, now)
+            wait = bucket.take(now)
+            if wait:
+                # Ex.: a ficha do tenant já saiu, mas a rota recusou
+                for charged in taken:
+                    charged.refund()
+                raise self._reject(scope, key, "rate", wait)
+            taken.append(bucket)
+
+    def _refund_rates(self, checks):
+        for scope, key, (_, rate, _) in checks:
+            bucket = self._buckets.get((scope, key)) if rate > 0 else None
+            if bucket is not None:
+                bucket.refund()
+
+    def _prune_buckets(self, now):
+        for bucket_key in [bucket_key for bucket_key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[bucket_key]
+
+    def _saturated(self, checks):
+        for scope, key, (concurrency, _, _) in checks:
+            if concurrency > 0 and self._inflight.get((scope, key), 0) >= concurrency:
+                return scope, key
+        return None
+
+    def _checks(self, tenant, route: str):
+        checks = [("route", route, self._limits("route", route))]
+        if tenant:
+            checks.insert(0, ("tenant", tenant, self._limits("tenant", tenant)))
+        return checks
+
+    def _admit(self, checks):
+        keys = [(scope, key) for scope, key, _ in checks]
+        for key in keys:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+        self.admitted += 1
+        return Ticket(keys)
+
+    def try_enter(self, tenant, route: str):
+        """
+        enter() sem bloquear, para o event loop: se falta vaga de concorrência
+        e há fila, retorna None sem recusar, com as fichas já cobradas; quem
+        chama espera a vaga com enter(..., check_rates=False) em uma thread.
+        """
+        if self.queue_timeout <= 0:
+            return self.enter(tenant, route, wait=False)
+
+        checks = self._checks(tenant, route)
+        with self._lock:
+            self._take_rates(checks, time.monotonic())
+            if self._saturated(checks) is not None:
+                return None
+            return self._admit(checks)
+
+    def enter(self, tenant, route: str, wait: bool = True, check_rates: bool = True):
+        """
+        Admite a requisição ou levanta AdmissionRejected. Retorna um Ticket,
+        que deve ser devolvido com leave() ao fim da requisição. check_rates=False
+        pula os baldes de fichas (nova tentativa de quem já foi cobrado, ver
+        try_enter). `tenant` deve ser um tenant válido (ver known_tenant).
+        """
+        checks = self._checks(tenant, route)
+
+        with self._lock:
+            if check_rates:
+                self._take_rates(checks, time.monotonic())
+
+            saturated = self._saturated(checks)
+            if saturated is not None and wait and self.queue_timeout > 0:
+                deadline = time.monotonic() + self.queue_timeout
+                queue = saturated
+                self._waiting[queue] = self._waiting.get(queue, 0) + 1
+                try:
+                    while saturated is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._released.wait(remaining)
+                        saturated = self._saturated(checks)
+                finally:
+                    if self._waiting[queue] > 1:
+                        self._waiting[queue] -= 1
+                    else:
+                        del self._waiting[queue]
+
+            if saturated is not None:
+                self._refund_rates(checks)
+                raise self._reject(saturated[0], saturated[1], "concurrency", self.retry_after)
+
+            return self._admit(checks)
+
+    def leave(self, ticket: Ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            for key in ticket.keys:
+                count = self._inflight.get(key, 0) - 1
+                if count > 0:
+                    self._inflight[key] = count
+                else:
+                    self._inflight.pop(key, None)
+            self._released.notify_all()
+
+    def stats(self):
+        """Métricas no formato de metrics.register_collector."""
+        with self._lock:
+            metrics = [("admission_admitted_total", {}, self.admitted)]
+            metrics.extend(
+                ("admission_inflight", {"scope": scope, "key": key}, count)
+                for (scope, key), count in self._inflight.items()
+            )
+            metrics.extend(
+                ("admission_queued", {"scope": scope, "key": key}, count)
+                for (scope, key), count in self._waiting.items()
+            )
+            metrics.extend(
+                ("admission_shed_total", {"scope": scope, "key": key, "reason": reason}, count)
+                for (scope, key, reason), count in self.shed.items()
+            )
+            return metrics
+
+
+admission = AdmissionController(
+    tenant_concurrency=ADMISSION_TENANT_CONCURRENCY,
+    tenant_rate=ADMISSION_TENANT_RATE,
+    tenant_burst=ADMISSION_TENANT_BURST,
+    tenant_limits=ADMISSION_TENANT_LIMITS,
+    route_limits=ADMISSION_ROUTE_LIMITS,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    retry_after=ADMISSION_RETRY_AFTER,
+)
+
+
+def admission_stats():
+    return admission.stats()
+
+
+def known_tenant(tenant_name):
+    """O tenant, se válido; None caso contrário (só os limites da rota valem)."""
+    if not tenant_name:
+        return None
+    try:
+        return validate_tenant_name(tenant_name)
+    except UnknownTenantError:
+        return None
+
+
+async def async_known_tenant(tenant_name):
+    """known_tenant para o event loop."""
+    if not tenant_name:
+        return None
+    try:
+        return await async_validate_tenant_name(tenant_name)
+    except UnknownTenantError:
+        return None
+
+
+def payload_tenant(payload):
+    """
+    Tenant do corpo JSON: tenant_name (ou tenant) do objeto ou, num lote
+    (lista ou {"items": [...]}), o tenant_name comum a todos os itens.
+    """
+    if isinstance(payload, dict):
+        tenant = payload.get("tenant_name") or payload.get("tenant")
+        if tenant or not isinstance(payload.get("items"), list):
+            return tenant
+        payload = payload["items"]
+    if not isinstance(payload, list):
+        return None
+    tenants = {item.get("tenant_name") if isinstance(item, dict) else None for item in payload}
+    return tenants.pop() if len(tenants) == 1 else None
+
+
+def install_flask_hooks(app, tenant_resolver):
+    """
+    Aplica o controle de admissão a todas as rotas (menos as isentas) do app.
+    Deve ser instalado depois de metrics.install_flask_hooks, para que as
+    recusas também entrem nas métricas de latência.
+    """
+    from flask import jsonify, request
+
+    if not ADMISSION_ENABLED:
+        return
+
+    @app.before_request
+    def _admit_request():
+        if request.url_rule is None or request.url_rule.rule in ADMISSION_EXEMPT_ROUTES:
+            return None
+        try:
+            ticket = admission.enter(known_tenant(tenant_resolver(request)), request.url_rule.rule)
+        except AdmissionRejected as e:
+            response = jsonify({"error": str(e)})
+            response.status_code = e.status
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        request.environ["admission.ticket"] = ticket
+        return None
+
+    @app.teardown_request
+    def _release_admission(exc):
+        ticket = request.environ.pop("admission.ticket", None)
+        if ticket is not None:
+            admission.leave(ticket)
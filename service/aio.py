@@ -0,0 +1,122 @@
+"""
+Versões assíncronas (engine asyncpg, ver db_config.async_tenant_transaction)
+das operações usadas pelas rotas de asgi.py. A regra de negócio e os comandos
+SQL são os mesmos de service/application.py e service/jobposting.py; aqui
+muda apenas a forma de executar.
+"""
+import asyncio
+
+from db_config import async_tenant_transaction
+from service import application, codec, form_schema, idempotency, jobposting
+
+# O asyncpg devolve json/jsonb de consultas text() como string
+JSON_COLUMNS = ("context", "conversation")
+
+
+def _decode_row(row):
+    row = dict(row)
+    for column in JSON_COLUMNS:
+        if isinstance(row.get(column), str):
+            row[column] = codec.loads(row[column])
+    return row
+
+
+async def get_chat_stage_by_id(chat_stage_id, columns=None):
+    statement = application.chat_stage_statement(columns)
+
+    async with async_tenant_transaction() as conn:
+        result = (await conn.execute(statement, {"chat_stage_id": int(chat_stage_id)})).mappings().first()
+
+    if not result:
+        return None
+
+    return application._chat_stage_row(_decode_row(result))
+
+
+async def chat_stage_tenant(chat_stage_id):
+    """Mesmo comportamento de application.chat_stage_tenant."""
+    try:
+        chat_stage_id = int(chat_stage_id)
+    except (TypeError, ValueError):
+        return None
+    tenant_name = application.cached_chat_stage_tenant(chat_stage_id)
+    if tenant_name is None:
+        row = await get_chat_stage_by_id(chat_stage_id, ("tenant_name",))
+        tenant_name = application.remember_chat_stage_tenant(chat_stage_id, row and row["tenant_name"])
+    return tenant_name
+
+
+async def _select_chat_stages(conn, chat_stage_ids):
+    rows = (await conn.execute(application.SELECT_CHAT_STAGES_SQL, {"ids": list(chat_stage_ids)})).mappings().all()
+    return {row["id"]: _decode_row(row) for row in rows}
+
+
+async def apply_session_updates(items: list):
+    """Mesmo contrato (e mesma concorrência otimista) de application.apply_session_updates."""
+    update = application.SessionUpdate(items)
+
+    while update.pending:
+        async with async_tenant_transaction() as conn:
+            stages = await _select_chat_stages(conn, update.pending)
+            for chat_stage_id, statement, params in update.plan(stages):
+                update.written(chat_stage_id, (await conn.execute(statement, params)).rowcount == 1)
+
+        delay = update.next_attempt()
+        if delay:
+            await asyncio.sleep(delay)
+
+    update.invalidate_active_sessions()
+
+    if update.missing_schemas:
+        await asyncio.to_thread(form_schema.warm_form_schemas, update.missing_schemas)
+
+    return update.results
+
+
+async def create_application(tenant_name: str, job_posting_id: int, name: str, email: str, cpf: str, phone: str, answers: list):
+    """Mesmo comportamento de application.create_application."""
+    params = application.create_application_params(job_posting_id, name, email, cpf, phone)
+    schema = form_schema.peek_form_schema(tenant_name, job_posting_id)
+    if schema is None:
+        schema = await asyncio.to_thread(form_schema.get_form_schema, tenant_name, job_posting_id)
+
+    async with async_tenant_transaction(tenant_name) as conn:
+        for statement, statement_params in application.create_application_statements(tenant_name, params):
+            result = await conn.execute(statement, statement_params)
+        result = result.mappings().first()
+        for statement, answer_params in application.answer_statements(answers, result["recruitment_process_id"], schema):
+            await conn.execute(statement, answer_params)
+
+    return application._application_result(result)
+
+
+async def create_job_posting(tenant_name: str, name: str, job_code: str = None):
+    # As perguntas básicas vêm do cache; na falta, a carga (síncrona) roda fora do event loop
+    question_sequence = await asyncio.to_thread(application.get_basic_questions, tenant_name)
+    statement, params = jobposting.job_posting_insert(question_sequence, [(name, job_code)])
+
+    async with async_tenant_transaction(tenant_name) as conn:
+        return (await conn.execute(statement, params)).scalar()
+
+
+# --- Idempotência (mesma tabela e cache de service/idempotency.py) ---
+
+async def claim_idempotency_key(scope: str, key: str):
+    params = idempotency.claim_params(scope, key)
+    async with async_tenant_transaction() as conn:
+        if (await conn.execute(idempotency.CLAIM_SQL, params)).first() is not None:
+            return True, None
+        row = (await conn.execute(idempotency.SELECT_SQL, params)).mappings().first()
+
+    return False, idempotency.claimed_row(row)
+
+
+async def complete_idempotency_key(scope: str, key: str, code: int, body):
+    async with async_tenant_transaction() as conn:
+        await conn.execute(idempotency.COMPLETE_SQL, idempotency.complete_params(scope, key, code, body))
+    idempotency.remember_response(scope, key, code, body)
+
+
+async def release_idempotency_key(scope: str, key: str):
+    async with async_tenant_transaction() as conn:
+        await conn.execute(idempotency.RELEASE_SQL, {"scope": scope, "key": key})
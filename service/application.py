@@ -1,97 +1,80 @@
-from flask import Flask, request, jsonify
-from db_config import engine
 from sqlalchemy import text
+from db_config import tenant_transaction
+from service import cache_sync, codec, form_schema, statements
+from service.form_schema import context_questions
 from datetime import datetime
-import pandas as pd
-import json
+from functools import lru_cache
+from service.cache import TTLCache
+import copy
+import os
+import random
+import re
+import threading
+import time
 import unicodedata
 
 
-def create_candidate(tenant_name: str, name: str, email: str, cpf: str):
-    """
-    Cadastra um novo candidato na tabela ats_candidate.
-    Apenas os campos iniciais: nome, email e CPF.
-    """
-
-        # Define timestamps
-    now = datetime.now()
-
-    # SQL de inserção
-    sql = text(f"""
-        INSERT INTO {tenant_name}.ats_candidate 
+def normalize_digits(value):
+    """Mantém só os dígitos (CPF e telefone); vazio vira None."""
+    digits = re.sub(r"\D", "", str(value)) if value is not None else ""
+    return digits or None
+
+def normalize_email(value):
+    email = str(value).strip().lower() if value is not None else ""
+    return email or None
+
+# Resolve o candidato pelo CPF, e-mail ou telefone normalizados (nessa ordem de
+# prioridade), reaproveitando o cadastro e o telefone existentes; só o processo
+# seletivo é sempre criado. As expressões de busca são as mesmas dos índices de
+# sql/005_candidate_lookup_indexes.sql.
+CREATE_APPLICATION_SQL = statements.register("create_application", """
+    WITH existing AS (
+        SELECT candidate_id AS id
+        FROM (
+            SELECT id AS candidate_id, 1 AS priority
+            FROM ats_candidate
+            WHERE regexp_replace(cpf, '\\D', '', 'g') = :cpf
+            UNION ALL
+            SELECT id, 2
+            FROM ats_candidate
+            WHERE lower(email) = :email
+            UNION ALL
+            SELECT candidate_id, 3
+            FROM ats_candidatephonecontact
+            WHERE regexp_replace("number", '\\D', '', 'g') = :number
+        ) matches
+        ORDER BY priority, candidate_id
+        LIMIT 1
+    ),
+    new_candidate AS (
+        INSERT INTO ats_candidate
         (name, email, cpf, created_at, updated_at)
-        VALUES (:name, :email, :cpf, :created_at, :updated_at)
-        RETURNING id;
-    """)
-
-    # Executa a inserção
-    with engine.begin() as conn:
-        result = conn.execute(
-            sql,
-            {
-                "name": name,
-                "email": email,
-                "cpf": cpf,
-                "created_at": now,
-                "updated_at": now,
-            }
-        ).mappings().first()
-
-    print(f"Candidato cadastrado com ID: {result['id']}")
-    return result["id"]
-
-def create_candidate_phone(tenant_name: str, candidate_id: int, phone: str):
-    """
-    Cadastra o telefone do candidato na tabela ats_candidatephonecontact.
-    Campos obrigatórios: number, type, country_code, candidate_id, timestamps.
-    """
-    # Caso não tenha código, define 55 como padrão (Brasil)
-    country_code = 55
-
-    # Define tipo padrão (ex: mobile)
-    phone_type = "mobile"
-
-    # Define timestamps
-    now = datetime.now()
-
-    # SQL de inserção
-    sql = text(f"""
-        INSERT INTO {tenant_name}.ats_candidatephonecontact 
+        SELECT :name, COALESCE(:email, ''), :cpf, :created_at, :updated_at
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING id
+    ),
+    candidate AS (
+        SELECT id FROM existing
+        UNION ALL
+        SELECT id FROM new_candidate
+    ),
+    existing_phone AS (
+        SELECT phone.id
+        FROM ats_candidatephonecontact phone, candidate
+        WHERE regexp_replace(phone."number", '\\D', '', 'g') = :number
+          AND phone.candidate_id = candidate.id
+        LIMIT 1
+    ),
+    new_phone AS (
+        INSERT INTO ats_candidatephonecontact
         ("number", type, country_code, candidate_id, created_at, updated_at)
-        VALUES (:number, :type, :country_code, :candidate_id, :created_at, :updated_at)
-        RETURNING id;
-    """)
-
-    # Executa a inserção
-    with engine.begin() as conn:
-        result = conn.execute(
-            sql,
-            {
-                "number": phone,
-                "type": phone_type,
-                "country_code": country_code,
-                "candidate_id": candidate_id,
-                "created_at": now,
-                "updated_at": now,
-            }
-        ).mappings().first()
-
-    print(f"📞 Telefone cadastrado com ID: {result['id']}")
-    return result["id"]
-
-def create_recruitment_process(tenant_name: str, candidate_id: int, job_posting_id: int):
-    """
-    Cria o registro de inscrição do candidato em uma vaga (ats_recruitmentprocess).
-    Campos fixos:
-      - status: 'em_andamento'
-      - subscription_type: 'automático'
-      - stage_type: 'inscrito'
-    """
-
-    now = datetime.now()
-
-    sql = text(f"""
-        INSERT INTO {tenant_name}.ats_recruitmentprocess 
+        SELECT :number, :phone_type, :country_code, candidate.id, :created_at, :updated_at
+        FROM candidate
+        WHERE CAST(:number AS text) IS NOT NULL AND NOT EXISTS (SELECT 1 FROM existing_phone)
+        RETURNING id
+    ),
+    process AS (
+        INSERT INTO ats_recruitmentprocess
         (
             status,
             subscription_type,
@@ -102,186 +85,775 @@ def create_recruitment_process(tenant_name: str, candidate_id: int, job_posting_
             stage_type,
             job_posting_id
         )
-        VALUES (
+        SELECT
             :status,
             :subscription_type,
             :created_at,
             :updated_at,
-            :candidate_id,
+            candidate.id,
             :stage_id,
             :stage_type,
             :job_posting_id
-        )
-        RETURNING id;
-    """)
+        FROM candidate
+        RETURNING id
+    )
+    SELECT
+        candidate.id AS candidate_id,
+        (SELECT id FROM existing_phone UNION ALL SELECT id FROM new_phone LIMIT 1) AS phone_id,
+        process.id AS recruitment_process_id,
+        EXISTS (SELECT 1 FROM existing) AS existing_candidate
+    FROM candidate, process;
+""")
+
+# Duas inscrições simultâneas do mesmo candidato não se enxergam no WHERE NOT
+# EXISTS de CREATE_APPLICATION_SQL e criariam dois cadastros. Antes dele, a
+# transação trava (até o fim) cada chave de busca normalizada; as chaves vêm
+# ordenadas, então duas inscrições nunca esperam uma pela outra em ciclo. Um
+# índice único não serve: a busca é por três chaves e as bases dos tenants já
+# têm CPFs repetidos.
+LOCK_CANDIDATE_KEYS_SQL = statements.register("lock_candidate_keys", """
+    SELECT pg_advisory_xact_lock(hashtextextended(keys.key, 0))
+    FROM unnest(CAST(:keys AS text[])) WITH ORDINALITY AS keys(key, position)
+    ORDER BY keys.position
+""")
+
+def candidate_lock_params(tenant_name: str, params: dict):
+    """Parâmetros de LOCK_CANDIDATE_KEYS_SQL: as chaves de busca de create_application_params."""
+    keys = [f"{tenant_name}:{field}:{params[field]}" for field in ("cpf", "email", "number") if params[field]]
+    return {"keys": sorted(keys)}
+
+def create_application_params(job_posting_id: int, name: str, email: str, cpf: str, phone: str):
+    """Parâmetros de CREATE_APPLICATION_SQL, com CPF, e-mail e telefone normalizados."""
+    now = datetime.now()
+    return {
+        "name": name,
+        "email": normalize_email(email),
+        "cpf": normalize_digits(cpf),
+        "number": normalize_digits(phone),
+        "phone_type": "mobile",
+        "country_code": 55,  # Brasil
+        "status": "em_andamento",
+        "subscription_type": "automático",
+        "stage_id": 1,  # por padrão, estágio inicial = 1
+        "stage_type": "inscrito",
+        "job_posting_id": job_posting_id,
+        "created_at": now,
+        "updated_at": now,
+    }
 
-    # Executa o insert
-    with engine.begin() as conn:
-        result = conn.execute(
-            sql,
-            {
-                "status": "em_andamento",
-                "subscription_type": "automático",
-                "created_at": now,
-                "updated_at": now,
-                "candidate_id": candidate_id,
-                "stage_id": 1,  # por padrão, estágio inicial = 1
-                "stage_type": "inscrito",
-                "job_posting_id": job_posting_id,
-            }
-        ).mappings().first()
+def create_application_statements(tenant_name: str, params: dict):
+    """
+    Comandos de create_application, na ordem: trava as chaves do candidato e
+    grava candidato, telefone e processo (o último devolve os ids).
+    """
+    return [
+        (LOCK_CANDIDATE_KEYS_SQL, candidate_lock_params(tenant_name, params)),
+        (CREATE_APPLICATION_SQL, params),
+    ]
+
+def _application_result(result):
+    if result["existing_candidate"]:
+        print(f"Candidato já cadastrado, reaproveitando ID: {result['candidate_id']}")
+    else:
+        print(f"Candidato cadastrado com ID: {result['candidate_id']}")
+    print(f"📞 Telefone com ID: {result['phone_id']}")
+    print(f"🧩 Processo seletivo criado com ID: {result['recruitment_process_id']}")
+    return dict(result)
+
+def create_application(tenant_name: str, job_posting_id: int, name: str, email: str, cpf: str, phone: str, answers: list):
+    """
+    Registra a inscrição completa do candidato em uma única transação:
+      - ats_candidate (nome, email e CPF), reaproveitado se já houver um
+        candidato com o mesmo CPF, e-mail ou telefone
+      - ats_candidatephonecontact (telefone, código 55 e tipo mobile por padrão),
+        criado só se o candidato ainda não tiver esse número
+      - ats_recruitmentprocess (status 'em_andamento', inscrição automática, estágio 'inscrito')
+      - respostas das perguntas personalizadas (ver save_answers)
+    Candidato, telefone e processo são resolvidos em um só comando (ver
+    CREATE_APPLICATION_SQL), com as chaves do candidato travadas (ver
+    LOCK_CANDIDATE_KEYS_SQL); se qualquer etapa falhar nada é gravado.
+    """
+    params = create_application_params(job_posting_id, name, email, cpf, phone)
+    # Carregado antes de abrir a transação (pode precisar de outra conexão)
+    schema = form_schema.get_form_schema(tenant_name, job_posting_id)
 
-    print(f"🧩 Processo seletivo criado com ID: {result['id']}")
-    return result["id"]
+    with tenant_transaction(tenant_name) as conn:
+        for statement, statement_params in create_application_statements(tenant_name, params):
+            result = conn.execute(statement, statement_params)
+        result = result.mappings().first()
+        save_answers(conn, answers, result["recruitment_process_id"], schema)
 
-def save_answers(df_questions, recruitment_process_id: int, tenant_name: str):
+    return _application_result(result)
+
+ANSWER_TEXT_COLUMNS = ("text", "created_at", "updated_at", "question_id", "recruitment_process_id")
+ANSWER_ALTERNATIVE_COLUMNS = ("created_at", "updated_at", "question_alternative_id", "recruitment_process_id")
+
+def answer_statements(questions: list, recruitment_process_id: int, schema=None):
     """
-    Salva as respostas das questões do candidato nas tabelas:
+    Comandos que gravam as respostas das questões do candidato, como uma
+    lista de (comando, parâmetros):
       - ats_answertext (para respostas textuais)
       - ats_answeralternative (para respostas de múltipla escolha)
+    Cada tabela é gravada com um único INSERT. Com o esquema compilado da
+    vaga, a opção escolhida vem do mapa de opções (pelo id ou pelo texto).
     """
 
     now = datetime.now()
+    text_rows = []
+    alternative_rows = []
+
+    for question in questions:
+        question_id = int(question["id"]) if question.get("id") is not None else None
+        answer = question.get("user_answer")
+        answer_type = question.get("answer_type")
+        answer_options = question.get("answer_options") or []
+
+        # 🧾 Caso 1: resposta do tipo texto
+        if answer_type == "text":
+            text_rows.append({
+                "text": answer,
+                "created_at": now,
+                "updated_at": now,
+                "question_id": question_id,
+                "recruitment_process_id": recruitment_process_id,
+            })
+
+        # 🧾 Caso 2: resposta do tipo múltipla escolha (options)
+        elif answer_type == "options":
+            # Busca o ID da opção que corresponde à resposta
+            matched_option_id = schema.match_option(question_id, answer) if schema is not None else None
 
-    with engine.begin() as conn:
-        for _, row in df_questions.iterrows():
-            question_id = int(row["id"]) if pd.notna(row["id"]) else None
-            answer = row["user_answer"]
-            answer_type = row["answer_type"]
-            answer_options = row.get("answer_options", [])
-
-            # 🧾 Caso 1: resposta do tipo texto
-            if answer_type == "text":
-                sql = text(f"""
-                    INSERT INTO {tenant_name}.ats_answertext
-                    (text, created_at, updated_at, question_id, recruitment_process_id)
-                    VALUES (:text, :created_at, :updated_at, :question_id, :recruitment_process_id);
-                """)
-                conn.execute(
-                    sql,
-                    {
-                        "text": answer,
-                        "created_at": now,
-                        "updated_at": now,
-                        "question_id": question_id,
-                        "recruitment_process_id": recruitment_process_id,
-                    },
-                )
-
-            # 🧾 Caso 2: resposta do tipo múltipla escolha (options)
-            elif answer_type == "options":
-                # Busca o ID da opção que corresponde à resposta
+            if matched_option_id is None:
                 matched_option_id = 0
-                
                 if isinstance(answer_options, list):
                     for opt in answer_options:
                         if str(opt.get("option_id")) == str(answer):
                             matched_option_id = opt["option_id"]
                             break
 
-                sql = text(f"""
-                    INSERT INTO {tenant_name}.ats_answeralternative
-                    (created_at, updated_at, question_alternative_id, recruitment_process_id)
-                    VALUES (:created_at, :updated_at, :question_alternative_id, :recruitment_process_id);
-                """)
-                conn.execute(
-                    sql,
-                    {
-                        "created_at": now,
-                        "updated_at": now,
-                        "question_alternative_id": matched_option_id,
-                        "recruitment_process_id": recruitment_process_id,
-                    }
-                )
-
-            else:
-                print(f"⚠️ Tipo de resposta desconhecido: {answer_type} (pergunta {question_id})")
+            alternative_rows.append({
+                "created_at": now,
+                "updated_at": now,
+                "question_alternative_id": matched_option_id,
+                "recruitment_process_id": recruitment_process_id,
+            })
+
+        else:
+            print(f"⚠️ Tipo de resposta desconhecido: {answer_type} (pergunta {question_id})")
+
+    commands = []
+    if text_rows:
+        commands.append((
+            statements.multi_row_insert("ats_answertext", ANSWER_TEXT_COLUMNS, len(text_rows)),
+            statements.multi_row_params(text_rows, ANSWER_TEXT_COLUMNS)
+        ))
+
+    if alternative_rows:
+        commands.append((
+            statements.multi_row_insert("ats_answeralternative", ANSWER_ALTERNATIVE_COLUMNS, len(alternative_rows)),
+            statements.multi_row_params(alternative_rows, ANSWER_ALTERNATIVE_COLUMNS)
+        ))
+
+    return commands
+
+def save_answers(conn, questions: list, recruitment_process_id: int, schema=None):
+    """
+    Salva as respostas das questões do candidato (ver answer_statements),
+    usando a conexão (transação do tenant) recebida.
+    """
+    for statement, params in answer_statements(questions, recruitment_process_id, schema):
+        conn.execute(statement, params)
 
     print("✅ Todas as respostas foram registradas com sucesso.")
 
-def get_chat_stage_by_id(chat_stage_id):
+def _customized_row(q):
+    return {
+        "id": q.get("id"),
+        "name": q.get("name"),
+        "key": q.get("key"),
+        "answer_type": q.get("answer_type"),
+        "user_answer": q.get("user_answer"),
+        "answer_options": q.get("answer_options", [])
+    }
+
+def extract_application_fields(questions: list, schema=None):
+    """
+    Separa, das perguntas respondidas na conversa, os dados do candidato
+    (nome, e-mail, CPF, documento) e as perguntas personalizadas, que são
+    gravadas como respostas. Com o esquema compilado da vaga (e o context no
+    mesmo formato dele), os campos são lidos direto das posições conhecidas.
+    """
+    fields = {"name": None, "email": None, "cpf": None, "document": None, "customized_rows": []}
+
+    if schema is not None and schema.layout_matches(questions):
+        for field, position in schema.fields.items():
+            fields[field] = questions[position].get("user_answer")
+        fields["customized_rows"] = [_customized_row(questions[position]) for position in schema.customized]
+        return fields
+
+    for q in questions:
+        q_type = q.get("type")
+        q_key = q.get("key")
+        q_user_answer = q.get("user_answer")
+
+        # Campos individuais
+        # As perguntas básicas usam as chaves do cadastro do tenant ("nome", "e-mail")
+        if q_key in ("name", "nome") and q_type == "basic":
+            fields["name"] = q_user_answer
+        elif q_key in ("email", "e-mail") and q_type == "basic":
+            fields["email"] = q_user_answer
+        elif q_key == "cpf" and q_type == "basic":
+            fields["cpf"] = q_user_answer
+        elif q_key == "document":
+            fields["document"] = q_user_answer
+
+        # Perguntas personalizadas, gravadas como respostas
+        if q_type == "customized":
+            fields["customized_rows"].append(_customized_row(q))
+
+    return fields
+
+# Formato da data das mensagens gravadas na conversation
+MESSAGE_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+def _chat_stage_row(row):
+    """Linha de ats_chat_stage como dict, com a conversation decodificada (lista)."""
+    chat_stage = dict(row)
+    if "conversation" not in chat_stage:
+        return chat_stage
+
+    conversation = chat_stage["conversation"]
+    if isinstance(conversation, str):
+        conversation = codec.loads(conversation)
+    chat_stage["conversation"] = conversation if isinstance(conversation, list) else []
+    return chat_stage
+
+SELECT_CHAT_STAGE_SQL = statements.register("select_chat_stage", """
+    SELECT * FROM public.ats_chat_stage WHERE id = :chat_stage_id
+""")
+
+# Colunas de ats_chat_stage aceitas na leitura projetada (columns=...)
+CHAT_STAGE_COLUMNS = (
+    "id", "candidate_phone_number_id", "job_public_code", "step", "context", "conversation",
+    "interaction", "updated_at", "status", "job_posting_id", "tenant_name", "version",
+)
+
+# O que /add_application lê da sessão: sem a conversation
+APPLICATION_CHAT_STAGE_COLUMNS = ("context", "tenant_name", "job_posting_id", "candidate_phone_number_id")
+
+@lru_cache(maxsize=64)
+def chat_stage_projection(columns: tuple):
+    """
+    SELECT só com as colunas pedidas (sem a conversation, a menos que ela
+    esteja entre as colunas). Um comando por combinação de colunas.
+    """
+    unknown = [column for column in columns if column not in CHAT_STAGE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Colunas inválidas de ats_chat_stage: {', '.join(unknown)}")
+
+    return text(f"""
+        SELECT {", ".join(columns)}
+        FROM public.ats_chat_stage
+        WHERE id = :chat_stage_id
+    """)
+
+def chat_stage_statement(columns=None):
+    """Consulta da sessão inteira ou, com columns, só dessas colunas."""
+    return SELECT_CHAT_STAGE_SQL if columns is None else chat_stage_projection(tuple(columns))
+
+def get_chat_stage_by_id(chat_stage_id, tenant_name=None, columns=None):
     """
     Busca os dados atuais (conversation e context) da tabela ats_chat_stage.
+    Mensagens já arquivadas (service/history.py) não estão na conversation,
+    use get_chat_messages.
+
+    Com columns (ex.: ("context", "tenant_name")) retorna só essas colunas,
+    sem carregar o histórico.
+    """
+    statement = chat_stage_statement(columns)
+
+    with tenant_transaction() as conn:
+        result = conn.execute(statement, {"chat_stage_id": chat_stage_id}).mappings().first()
+
+    if not result:
+        return None
+
+    return _chat_stage_row(result)
+
+# Tenant de cada sessão (não muda), para o controle de admissão do /add_application
+_chat_stage_tenants = TTLCache(
+    maxsize=int(os.environ.get("SESSION_LOOKUP_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("CHAT_STAGE_TENANT_CACHE_TTL", "3600")),
+)
+
+def cached_chat_stage_tenant(chat_stage_id):
+    return _chat_stage_tenants.get(chat_stage_id)
+
+def remember_chat_stage_tenant(chat_stage_id, tenant_name):
+    if tenant_name:
+        _chat_stage_tenants.set(chat_stage_id, tenant_name)
+    return tenant_name
+
+def chat_stage_tenant(chat_stage_id):
+    """tenant_name da sessão, do cache ou do banco; None se ela não existir."""
+    try:
+        chat_stage_id = int(chat_stage_id)
+    except (TypeError, ValueError):
+        return None
+    tenant_name = cached_chat_stage_tenant(chat_stage_id)
+    if tenant_name is None:
+        row = get_chat_stage_by_id(chat_stage_id, columns=("tenant_name",))
+        tenant_name = remember_chat_stage_tenant(chat_stage_id, row and row["tenant_name"])
+    return tenant_name
+
+# Cache curto da busca de sessão por telefone (cada mensagem recebida faz essa busca)
+_active_sessions_cache = TTLCache(
+    maxsize=int(os.environ.get("SESSION_LOOKUP_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("SESSION_LOOKUP_CACHE_TTL", "2")),
+)
+_phone_by_chat_stage = TTLCache(
+    maxsize=int(os.environ.get("SESSION_LOOKUP_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("SESSION_LOOKUP_CACHE_TTL", "2")),
+)
+
+SELECT_ACTIVE_SESSIONS_SQL = statements.register("select_active_sessions", """
+    SELECT s.*
+    FROM (
+        SELECT DISTINCT ON (job_posting_id) *
+        FROM public.ats_chat_stage
+        WHERE candidate_phone_number_id = :phone
+        ORDER BY job_posting_id, updated_at DESC
+    ) s
+    WHERE s.interaction IS DISTINCT FROM 'finalizado'
+    ORDER BY s.updated_at DESC
+""")
+
+def get_active_sessions_by_phone(phone: str):
+    """
+    Retorna as sessões ativas do telefone: a mais recente de cada vaga cuja
+    interaction não seja 'finalizado', da mais recente para a mais antiga.
+    Usa o índice idx_chat_stage_phone_job_updated (phone, vaga, updated_at).
+    """
+    sessions = _active_sessions_cache.get(phone)
+    if sessions is not None:
+        return sessions
+
+    with tenant_transaction() as conn:
+        rows = conn.execute(SELECT_ACTIVE_SESSIONS_SQL, {"phone": phone}).mappings().all()
+
+    sessions = [_chat_stage_row(row) for row in rows]
+    # Sem sessão, não guarda: a sessão que o n8n acabou de criar aparece já na próxima busca
+    if not sessions:
+        return sessions
+    _active_sessions_cache.set(phone, sessions)
+    for session in sessions:
+        _phone_by_chat_stage.set(session["id"], phone)
+    return sessions
+
+def invalidate_active_sessions(chat_stage_id, phone: str = None):
+    """
+    Descarta do cache a busca por telefone que contém a sessão alterada. Com
+    phone (o telefone da sessão), descarta também a busca desse telefone que
+    ainda não incluía a sessão.
+    """
+    for key in {_phone_by_chat_stage.pop(chat_stage_id), phone} - {None}:
+        _active_sessions_cache.invalidate(key)
+
+# As mensagens do turno são acrescentadas à conversation no próprio banco
+# (jsonb ||), no mesmo UPDATE do status: o turno não lê nem reenvia o histórico,
+# e o n8n, que lê e regrava a coluna conversation, continua vendo a conversa inteira.
+# Uma variante do UPDATE para cada combinação de (grava context, confere version)
+WRITE_CHAT_STAGE_SQL = {
+    (with_context, with_version): statements.register(
+        f"write_chat_stage_{int(with_context)}{int(with_version)}",
+        """
+        UPDATE public.ats_chat_stage
+        SET status = :status,
+            updated_at = now(),
+            conversation = CASE WHEN jsonb_typeof(conversation) = 'array' THEN conversation ELSE '[]'::jsonb END
+                           || CAST(:messages AS jsonb)
+        """
+        + (", context = :context" if with_context else "")
+        + " WHERE id = :chat_stage_id"
+        + (" AND version = :expected_version" if with_version else "")
+    )
+    for with_context in (False, True)
+    for with_version in (False, True)
+}
+
+def write_chat_stage_params(chat_stage_id, status, messages, context=None, expected_version=None):
+    """Parâmetros de WRITE_CHAT_STAGE_SQL e a variante do comando a usar."""
+    update_fields = {
+        "status": status,
+        "chat_stage_id": chat_stage_id,
+        "messages": codec.dumps(messages),
+    }
+
+    if context is not None:
+        update_fields["context"] = codec.dumps(context)
+
+    if expected_version is not None:
+        update_fields["expected_version"] = expected_version
+
+    return WRITE_CHAT_STAGE_SQL[(context is not None, expected_version is not None)], update_fields
+
+def _write_chat_stage(conn, chat_stage_id, status, messages, context=None, expected_version=None):
+    """
+    Atualiza status (e context) da sessão e acrescenta as mensagens à
+    conversation; a coluna version é incrementada pelo trigger de
+    sql/003_ats_chat_stage_version.sql. Com expected_version, a
+    gravação só acontece se a versão no banco ainda for a lida
+    (compare-and-swap); retorna False quando outra execução gravou antes.
     """
-    with engine.begin() as conn:
-        select_sql = text(f"""
-            SELECT *
-            FROM public.ats_chat_stage
-            WHERE id = :chat_stage_id
-        """)
-        result = conn.execute(select_sql, {"chat_stage_id": chat_stage_id}).mappings().first()
-        return result
+    update_sql, update_fields = write_chat_stage_params(chat_stage_id, status, messages, context, expected_version)
+    return conn.execute(update_sql, update_fields).rowcount == 1
 
-def update_chat_stage(chat_stage_id, tenant_name, conversation, status, context=None):
+def update_chat_stage(chat_stage_id, tenant_name, messages, status, context=None, expected_version=None):
 
     """
-    Atualiza os campos conversation, status e opcionalmente context da tabela ats_chat_stage.
+    Atualiza status e opcionalmente context da tabela ats_chat_stage e
+    acrescenta as novas mensagens ao histórico, sem reescrever a conversation.
+    Com expected_version, só grava se a sessão não mudou desde a leitura e
+    retorna False em caso de conflito (nada é gravado).
     """
-    with engine.begin() as conn:
-        update_fields = {
-            "conversation": json.dumps(conversation),
-            "status": status,
-            "chat_stage_id": chat_stage_id
-        }
+    with tenant_transaction() as conn:
+        if not _write_chat_stage(conn, chat_stage_id, status, messages, context, expected_version):
+            if expected_version is not None:
+                _record_chat_stage_conflict(tenant_name)
+            return False
 
-        update_sql = f"""
-            UPDATE {tenant_name}.ats_chat_stage
-            SET conversation = :conversation,
-                status = :status
-        """
+    invalidate_active_sessions(chat_stage_id)
+    return True
 
-        if context is not None:
-            update_fields["context"] = json.dumps(context)
-            update_sql += ", context = :context"
+# Concorrência otimista: conflitos de versão são reprocessados algumas vezes
+CHAT_STAGE_MAX_RETRIES = int(os.environ.get("CHAT_STAGE_MAX_RETRIES", "5"))
+CHAT_STAGE_RETRY_BACKOFF = float(os.environ.get("CHAT_STAGE_RETRY_BACKOFF", "0.01"))
 
-        update_sql += " WHERE id = :chat_stage_id"
+_chat_stage_conflicts = {}
+_chat_stage_conflicts_lock = threading.Lock()
 
-        conn.execute(text(update_sql), update_fields)
+def _record_chat_stage_conflict(tenant_name):
+    with _chat_stage_conflicts_lock:
+        _chat_stage_conflicts[tenant_name] = _chat_stage_conflicts.get(tenant_name, 0) + 1
 
-def get_basic_questions(tenant: str):
+def chat_stage_conflict_stats():
+    """Quantidade de conflitos de versão em ats_chat_stage por tenant."""
+    with _chat_stage_conflicts_lock:
+        return dict(_chat_stage_conflicts)
 
-    question_labels = {
-        "nome":   {"label": "Qual o seu nome completo?", "answer_type": "text"},
-        "e-mail":  {"label": "Qual o seu e-mail?","answer_type": "text"},
-        "cpf":    {"label": "Informe seu CPF (somente números, não incula pontos ou traços)","answer_type": "text"},
-        "linkedin ou currículo":  {"label": "Por favor, nos envie seu currículo ou o link do seu perfil do linkedin. se escolher enviar o currículo, utilize a opção de envio de documento aqui do whatsapp.?", "answer_type": "text"},
-        "cidade":  {"label": "Em qual cidade você está morando hoje?", "answer_type": "text"},
-        "data de nascimento":  {"label": "Qual sua data de nascimento? responda nesse formato (DD/MM/AAAA), por favor","answer_type": "text"},
-        "pretensão salarial":  {"label": "Qual a sua pretensão salarial?", "answer_type": "text"},
-        "portfolio / github / site":  {"label": "Você possui algum site, github ou link com seu portfólio? se sim, digite o endereço de acesso. caso contrário é só responder não.", "answer_type": "text"},
-        "phone":  {"label": "Qual o seu telefone?", "answer_type": "text"},
-        "telefone":  {"label": "Qual o seu telefone?", "answer_type": "text"},
-        "source": {"label": "Como você ficou sabendo da vaga? escolha uma das opções abaixo", "answer_type": "options"}
-    }
+class SessionUpdateError(Exception):
+    """Erro ao aplicar um turno da conversa; status_code é o código HTTP sugerido."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def apply_session_turn(context, item, now, schema=None):
+    """
+    Aplica um turno (payload do /update_session) ao context, alterando-o no
+    lugar, e retorna as mensagens do turno a serem gravadas.
+    Lança SessionUpdateError se a questão respondida não existir.
+    Com o esquema compilado da vaga (form_schema), a questão é achada pela
+    posição em vez de varrer o context.
+    """
+    candidate_message = item.get("candidate_message")
+    date = now.strftime(MESSAGE_DATE_FORMAT)
+
+    if item.get("interaction") == "answer":
+        question_id = item.get("question_id")
+        questions = context_questions(context)
+
+        question = schema.find(questions, question_id) if schema is not None else None
+        if question is None:
+            question = next((q for q in questions if q.get("id") == question_id), None)
+        if question is None:
+            raise SessionUpdateError(f"Questão com id {question_id} não encontrada no contexto")
+
+        if schema is not None and form_schema.FORM_SCHEMA_VALIDATE_ANSWERS:
+            error = schema.validate_answer(question_id, candidate_message)
+            if error:
+                raise SessionUpdateError(error, 422)
+
+        question["candidate_answer"] = candidate_message
+
+    return [
+        {"date": date, "from": "system", "message": item.get("system_message")},
+        {"date": date, "from": "candidate", "message": candidate_message}
+    ]
+
+SELECT_CHAT_STAGES_SQL = statements.register("select_chat_stages", """
+    SELECT id, tenant_name, job_posting_id, candidate_phone_number_id, context, status, version
+    FROM public.ats_chat_stage
+    WHERE id = ANY(:ids)
+""")
+
+def _select_chat_stages(conn, chat_stage_ids):
+    rows = conn.execute(SELECT_CHAT_STAGES_SQL, {"ids": list(chat_stage_ids)}).mappings().all()
+    return {row["id"]: row for row in rows}
+
+def stage_form_schema(stage):
+    """
+    Esquema compilado da vaga da sessão, só do cache: é chamado com a
+    transação aberta (ou sob lock), onde carregar do banco pediria uma segunda
+    conexão do pool. Na falta, os turnos usam a busca linear e quem chamou
+    carrega o esquema depois (form_schema.warm_form_schemas).
+    """
+    return form_schema.peek_form_schema(stage.get("tenant_name"), stage.get("job_posting_id"))
+
+def _apply_stage_turns(stage, items, indexes, times, schema=None):
+    """
+    Aplica, em ordem, os turnos de uma sessão sobre uma cópia do seu context.
+    times[index] é o horário do turno (data das mensagens gravadas).
+    Retorna os resultados por item, as mensagens e o estado final a gravar.
+    """
+    context = stage["context"] or {}
+    if isinstance(context, str):
+        context = codec.loads(context)
+    else:
+        context = copy.deepcopy(context)
+
+    outcome = {"results": {}, "messages": [], "status": stage["status"], "context": None}
+
+    for index in indexes:
+        item = items[index]
+        try:
+            turn_messages = apply_session_turn(context, item, times[index], schema)
+        except SessionUpdateError as e:
+            outcome["results"][index] = {"chat_stage_id": stage["id"], "error": str(e), "code": e.status_code}
+            continue
+
+        outcome["messages"].extend(turn_messages)
+        outcome["status"] = item.get("status")
+        if item.get("interaction") == "answer":
+            outcome["context"] = context
+        outcome["results"][index] = {"chat_stage_id": stage["id"], "status": "OK", "code": 200}
+
+    return outcome
+
+def group_session_items(items: list):
+    """
+    Agrupa os índices dos turnos por chat_stage_id, na ordem recebida.
+    Retorna a lista de resultados (já preenchida para itens inválidos) e os grupos.
+    """
+    results = [None] * len(items)
+    groups = {}
+
+    for index, item in enumerate(items):
+        try:
+            chat_stage_id = int(item.get("chat_stage_id"))
+        except (TypeError, ValueError, AttributeError):
+            results[index] = {"error": "chat_stage_id inválido", "code": 400}
+            continue
+        groups.setdefault(chat_stage_id, []).append(index)
+
+    return results, groups
 
-    # Lista de chaves ignoradas
-    ignored_keys = {"pais", "país", "country", "estado", "state"}
+class SessionUpdate:
+    """
+    Regra de apply_session_updates sem acesso ao banco, compartilhada com
+    service/aio.py. Quem executa abre uma transação por tentativa, lê as
+    sessões de `pending`, roda os UPDATEs de plan() e informa o resultado de
+    cada um com written(); depois chama next_attempt(), que devolve a espera
+    (fora da transação) antes de reprocessar as sessões em conflito.
+    """
+
+    def __init__(self, items: list, received_at: list = None):
+        self.items = items
+        self.times = received_at or [datetime.utcnow()] * len(items)
+        self.results, self.groups = group_session_items(items)
+        # Sempre em ordem de id: execuções concorrentes travam as linhas na mesma ordem
+        self.pending = sorted(self.groups)
+        self.attempt = 0
+        self.missing_schemas = []
+        self.phones = {}
+        self._writing = {}
+        self._conflicts = []
+
+    def _finish(self, results: dict):
+        for index, result in results.items():
+            self.results[index] = result
+
+    def _fail(self, chat_stage_id, error: str, code: int):
+        for index in self.groups[chat_stage_id]:
+            self.results[index] = {"chat_stage_id": chat_stage_id, "error": error, "code": code}
+
+    def plan(self, stages: dict):
+        """Aplica os turnos às sessões lidas; retorna os UPDATEs como (chat_stage_id, comando, parâmetros)."""
+        writes = []
+        for chat_stage_id in self.pending:
+            stage = stages.get(chat_stage_id)
+            if stage is None:
+                self._fail(chat_stage_id, "Registro não encontrado", 404)
+                continue
+
+            self.phones[chat_stage_id] = stage["candidate_phone_number_id"]
+            schema = stage_form_schema(stage)
+            if schema is None:
+                self.missing_schemas.append((stage["tenant_name"], stage["job_posting_id"]))
+            outcome = _apply_stage_turns(stage, self.items, self.groups[chat_stage_id], self.times, schema)
+            if not outcome["messages"]:
+                self._finish(outcome["results"])
+                continue
+
+            self._writing[chat_stage_id] = (stage["tenant_name"], outcome["results"])
+            statement, params = write_chat_stage_params(
+                chat_stage_id, outcome["status"], outcome["messages"], outcome["context"], stage["version"]
+            )
+            writes.append((chat_stage_id, statement, params))
+        return writes
+
+    def written(self, chat_stage_id, applied: bool):
+        """Resultado do UPDATE da sessão: False quando outra execução gravou antes."""
+        tenant_name, results = self._writing.pop(chat_stage_id)
+        if applied:
+            self._finish(results)
+        else:
+            _record_chat_stage_conflict(tenant_name)
+            self._conflicts.append(chat_stage_id)
+
+    def next_attempt(self):
+        """
+        Encerra a tentativa (com a transação já fechada). Retorna os segundos
+        de espera antes de reler e reaplicar as sessões em conflito, ou None
+        se não há mais nada a fazer.
+        """
+        self.pending, self._conflicts = sorted(self._conflicts), []
+        if not self.pending:
+            return None
+
+        if self.attempt >= CHAT_STAGE_MAX_RETRIES:
+            for chat_stage_id in self.pending:
+                self._fail(chat_stage_id, "Conflito de concorrência, tente novamente", 409)
+            self.pending = []
+            return None
+
+        delay = random.uniform(0, CHAT_STAGE_RETRY_BACKOFF * (2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def invalidate_active_sessions(self):
+        """Descarta as buscas por telefone das sessões do lote (depois de gravar)."""
+        for chat_stage_id in self.groups:
+            invalidate_active_sessions(chat_stage_id, self.phones.get(chat_stage_id))
+
+def apply_session_updates(items: list, received_at: list = None):
+    """
+    Aplica uma lista de turnos (payloads do /update_session), possivelmente de
+    várias sessões. Os turnos são agrupados por chat_stage_id e aplicados na
+    ordem recebida; cada sessão é lida uma vez e gravada uma vez, com as
+    mensagens de todos os seus turnos.
+
+    A gravação de cada sessão é condicionada à versão lida (sem bloquear a
+    linha durante o processamento). Se outra execução gravou antes, a
+    transação da tentativa termina (as demais sessões ficam gravadas) e, após
+    uma espera, as sessões em conflito são relidas e os turnos reaplicados em
+    uma nova transação, até CHAT_STAGE_MAX_RETRIES vezes (ver SessionUpdate).
+    received_at (opcional) traz o horário de cada turno, quando eles foram
+    recebidos antes (ver service/session_cache.py); por padrão é o horário atual.
+    Retorna um resultado por item, na mesma ordem da entrada.
+    """
+    update = SessionUpdate(items, received_at)
+
+    while update.pending:
+        with tenant_transaction() as conn:
+            stages = _select_chat_stages(conn, update.pending)
+            for chat_stage_id, statement, params in update.plan(stages):
+                update.written(chat_stage_id, conn.execute(statement, params).rowcount == 1)
+
+        delay = update.next_attempt()
+        if delay:
+            time.sleep(delay)
+
+    update.invalidate_active_sessions()
+
+    # Já fora da transação: os próximos turnos dessas vagas usam o esquema
+    form_schema.warm_form_schemas(update.missing_schemas)
+
+    return update.results
+
+# Cache por tenant das perguntas básicas (as tabelas de configuração quase nunca mudam)
+_basic_questions_cache = TTLCache(
+    maxsize=int(os.environ.get("BASIC_QUESTIONS_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("BASIC_QUESTIONS_CACHE_TTL", "600")),
+)
+# Invalidações feitas em qualquer worker valem para todos (ver service/cache_sync.py)
+cache_sync.register_cache("basic_questions", _basic_questions_cache.invalidate)
+
+QUESTION_LABELS = {
+    "nome":   {"label": "Qual o seu nome completo?", "answer_type": "text"},
+    "e-mail":  {"label": "Qual o seu e-mail?","answer_type": "text"},
+    "cpf":    {"label": "Informe seu CPF (somente números, não incula pontos ou traços)","answer_type": "text"},
+    "linkedin ou currículo":  {"label": "Por favor, nos envie seu currículo ou o link do seu perfil do linkedin. se escolher enviar o currículo, utilize a opção de envio de documento aqui do whatsapp.?", "answer_type": "text"},
+    "cidade":  {"label": "Em qual cidade você está morando hoje?", "answer_type": "text"},
+    "data de nascimento":  {"label": "Qual sua data de nascimento? responda nesse formato (DD/MM/AAAA), por favor","answer_type": "text"},
+    "pretensão salarial":  {"label": "Qual a sua pretensão salarial?", "answer_type": "text"},
+    "portfolio / github / site":  {"label": "Você possui algum site, github ou link com seu portfólio? se sim, digite o endereço de acesso. caso contrário é só responder não.", "answer_type": "text"},
+    "phone":  {"label": "Qual o seu telefone?", "answer_type": "text"},
+    "telefone":  {"label": "Qual o seu telefone?", "answer_type": "text"},
+    "source": {"label": "Como você ficou sabendo da vaga? escolha uma das opções abaixo", "answer_type": "options"}
+}
+
+# Lista de chaves ignoradas
+IGNORED_KEYS = {"pais", "país", "country", "estado", "state"}
+
+@lru_cache(maxsize=1024)
+def normalize_key(key):
+    """Remove acentos e coloca em minúsculas para comparação"""
+    nfkd = unicodedata.normalize('NFKD', key)
+    only_ascii = nfkd.encode('ASCII', 'ignore').decode('utf-8')
+    return only_ascii.strip().lower()
 
-    def normalize_key(key):
-        """Remove acentos e coloca em minúsculas para comparação"""
-        nfkd = unicodedata.normalize('NFKD', key)
-        only_ascii = nfkd.encode('ASCII', 'ignore').decode('utf-8')
-        return only_ascii.strip().lower()
+def get_basic_questions(tenant: str):
+    """
+    Retorna as perguntas básicas do tenant, servidas do cache quando possível.
+    Cada chamada recebe uma cópia, então o chamador pode alterá-la livremente.
+    """
+    questions = _basic_questions_cache.get(tenant)
+    if questions is None:
+        cache_sync.watch()
+        questions = _load_basic_questions(tenant)
+        _basic_questions_cache.set(tenant, questions)
+    return copy.deepcopy(questions)
+
+def invalidate_basic_questions(tenant: str = None):
+    """
+    Descarta as perguntas básicas em cache do tenant (ou de todos os tenants)
+    neste worker e, em até CACHE_SYNC_INTERVAL segundos, nos demais (ver
+    service/cache_sync.py). Retorna quantas entradas saíram deste worker.
+    """
+    return cache_sync.publish("basic_questions", tenant)
+
+def basic_questions_cache_stats():
+    """Contadores de acertos/falhas do cache de perguntas básicas."""
+    return _basic_questions_cache.stats()
+
+SELECT_REGISTER_FIELDS_SQL = statements.register("select_register_fields", """
+    SELECT id, key, visible, required
+    FROM ats_candidateregisterfield
+    ORDER BY id
+""")
+
+SELECT_SOURCE_OPTIONS_SQL = statements.register("select_source_options", """
+    SELECT id, name
+    FROM ats_candidatesourceoption
+    WHERE visible = true
+    ORDER BY sequence ASC
+""")
+
+def _load_basic_questions(tenant: str):
+    """
+    Monta as perguntas básicas a partir de ats_candidateregisterfield e
+    ats_candidatesourceoption do tenant.
+    """
 
-    with engine.begin() as conn:
+    with tenant_transaction(tenant) as conn:
         # Busca campos configurados
-        fields_sql = text(f"""
-            SELECT id, key, visible, required
-            FROM {tenant}.ats_candidateregisterfield
-            ORDER BY id
-        """)
-        fields = conn.execute(fields_sql).mappings().all()
+        fields = conn.execute(SELECT_REGISTER_FIELDS_SQL).mappings().all()
 
         # Carrega opções do campo 'source', se necessário
         source_options = []
-        if "source" in question_labels and question_labels["source"]["answer_type"] == "options":
-            source_options_sql = text(f"""
-                SELECT id, name
-                FROM {tenant}.ats_candidatesourceoption
-                WHERE visible = true
-                ORDER BY sequence ASC
-            """)
-            source_options = conn.execute(source_options_sql).mappings().all()
+        if "source" in QUESTION_LABELS and QUESTION_LABELS["source"]["answer_type"] == "options":
+            source_options = conn.execute(SELECT_SOURCE_OPTIONS_SQL).mappings().all()
 
     questions = []
     sequence = 1
@@ -292,11 +864,11 @@ def get_basic_questions(tenant: str):
         key_lower = raw_key.strip().lower()
 
         # Ignorar campos irrelevantes
-        if normalized_key in ignored_keys:
+        if normalized_key in IGNORED_KEYS:
             continue
 
         # Obter config da questão
-        question_config = question_labels.get(key_lower)
+        question_config = QUESTION_LABELS.get(key_lower)
         if not question_config:
             continue  # pula se não estiver no dicionário
 
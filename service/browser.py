@@ -0,0 +1,198 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from service.startup import lazy_import
+
+# Selenium e webdriver_manager são importados sob demanda (ver lazy_import),
+# para não pesar na subida dos workers que nunca abrem um navegador.
+
+
+def _chrome_options():
+    Options = lazy_import("selenium.webdriver.chrome.options").Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")  # modo headless (novo padrão para Chrome 109+)
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--log-level=3")
+    chrome_options.add_argument("--allow-file-access-from-files")  # permite páginas locais (file://) nos testes
+    return chrome_options
+
+
+class BrowserPool:
+    """
+    Pool de sessões do Chrome headless reaproveitadas entre as inscrições.
+    O binário do chromedriver é resolvido uma única vez por processo, as
+    sessões são criadas sob demanda até o limite do pool, limpas a cada
+    devolução e descartadas quando deixam de responder.
+    """
+
+    # Intervalo máximo de espera na fila antes de reavaliar se há vaga para
+    # abrir uma sessão nova (um descarte libera vaga sem devolver nada à fila)
+    ACQUIRE_POLL_INTERVAL = 0.5
+
+    def __init__(self, size: int = 2, max_uses: int = 50, acquire_timeout: float = 30, driver_path: str = None):
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._driver_path = driver_path
+        self._idle = queue.LifoQueue()
+        self._uses = {}
+        self._created = 0
+        self._lock = threading.Lock()
+        self.stats_counters = {"created": 0, "reused": 0, "discarded": 0, "timeouts": 0}
+
+    def driver_path(self):
+        """Resolve o caminho do chromedriver (CHROMEDRIVER_PATH ou webdriver_manager) apenas uma vez."""
+        with self._lock:
+            if self._driver_path is None:
+                self._driver_path = os.environ.get("CHROMEDRIVER_PATH")
+                if not self._driver_path:
+                    ChromeDriverManager = lazy_import("webdriver_manager.chrome").ChromeDriverManager
+                    self._driver_path = ChromeDriverManager().install()
+            return self._driver_path
+
+    def warm_up(self, sessions: int = 1):
+        """Resolve o driver e já deixa algumas sessões abertas no pool."""
+        self.driver_path()
+        for _ in range(min(sessions, self.size)):
+            driver = self._create()
+            if driver is None:
+                break
+            self._idle.put(driver)
+
+    def _create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+
+        try:
+            driver = self._open_driver()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        self._uses[id(driver)] = 0
+        self.stats_counters["created"] += 1
+        return driver
+
+    def _open_driver(self):
+        webdriver = lazy_import("selenium.webdriver")
+        Service = lazy_import("selenium.webdriver.chrome.service").Service
+        return webdriver.Chrome(service=Service(self.driver_path()), options=_chrome_options())
+
+    def _discard(self, driver):
+        self._uses.pop(id(driver), None)
+        with self._lock:
+            self._created -= 1
+        self.stats_counters["discarded"] += 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        """Remove qualquer estado do candidato anterior (cookies, storage e página)."""
+        driver.delete_all_cookies()
+        try:
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        except Exception:
+            pass  # páginas sem storage (about:blank, file://)
+        driver.get("about:blank")
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._create()
+                if driver is not None:
+                    return driver
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats_counters["timeouts"] += 1
+                    raise RuntimeError("Nenhum navegador disponível no pool.")
+                try:
+                    driver = self._idle.get(timeout=min(remaining, self.ACQUIRE_POLL_INTERVAL))
+                except queue.Empty:
+                    continue
+
+            if self._is_healthy(driver):
+                self.stats_counters["reused"] += 1
+                return driver
+
+            self._discard(driver)
+
+    def _release(self, driver):
+        self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+
+        if self._uses[id(driver)] >= self.max_uses:
+            self._discard(driver)
+            return
+
+        try:
+            self._reset(driver)
+        except Exception:
+            self._discard(driver)
+            return
+
+        self._idle.put(driver)
+
+    @contextmanager
+    def session(self):
+        """Empresta uma sessão do pool e a devolve limpa ao final."""
+        driver = self._acquire()
+        try:
+            yield driver
+        finally:
+            self._release(driver)
+
+    def check_health(self):
+        """Verifica as sessões ociosas, descartando as que não respondem."""
+        healthy = []
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._is_healthy(driver):
+                healthy.append(driver)
+            else:
+                self._discard(driver)
+
+        for driver in healthy:
+            self._idle.put(driver)
+
+        return self.stats()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": self._created,
+            "idle": self._idle.qsize(),
+            **self.stats_counters,
+        }
+
+
+browser_pool = BrowserPool(
+    size=int(os.environ.get("BROWSER_POOL_SIZE", "2")),
+    max_uses=int(os.environ.get("BROWSER_POOL_MAX_USES", "50")),
+    acquire_timeout=float(os.environ.get("BROWSER_POOL_ACQUIRE_TIMEOUT", "30")),
+)
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Cache em memória com limite de itens (LRU) e tempo de expiração (TTL).
+    Seguro para uso entre threads do mesmo worker e com contadores de
+    acertos/falhas para acompanhamento.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Retorna o valor guardado para a chave, ou default se ausente/expirado."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Guarda o valor, descartando o item menos usado se o limite for atingido."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove e retorna o valor da chave, sem contar como acerto/falha."""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time.monotonic():
+                return default
+            return item[1]
+
+    def invalidate(self, key=None):
+        """Remove a chave informada, ou todo o cache se nenhuma chave for passada."""
+        with self._lock:
+            if key is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            return 1 if self._data.pop(key, None) is not None else 0
+
+    def stats(self):
+        """Resumo do uso do cache."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,132 @@
+"""
+Invalidação dos caches em memória em todos os workers.
+
+Cada worker tem a sua cópia dos caches (perguntas básicas, esquema do
+formulário). publish() descarta a entrada no worker que recebeu a
+invalidação e a grava em public.cache_invalidations
+(sql/011_cache_invalidations.sql); uma thread de cada worker lê as
+invalidações novas a cada CACHE_SYNC_INTERVAL segundos e descarta as mesmas
+entradas. Assim, depois de uma invalidação, outro worker serve a entrada
+antiga por no máximo CACHE_SYNC_INTERVAL segundos (com o banco fora do ar,
+até o TTL do próprio cache).
+
+A thread só começa quando o worker carrega o primeiro valor de um cache
+(watch()), já depois do fork do gunicorn, e a leitura não acessa o banco.
+"""
+import os
+import threading
+import time
+
+from db_config import tenant_transaction
+from service import codec, statements
+
+CACHE_SYNC_INTERVAL = float(os.environ.get("CACHE_SYNC_INTERVAL", "5"))
+# Invalidações mais antigas que isso (s) são apagadas; os caches já expiraram pelo TTL
+CACHE_INVALIDATION_RETENTION = float(os.environ.get("CACHE_INVALIDATION_RETENTION", "86400"))
+
+PUBLISH_SQL = statements.register("publish_cache_invalidation", """
+    INSERT INTO public.cache_invalidations (cache, key) VALUES (:cache, CAST(:key AS jsonb))
+""")
+
+PURGE_SQL = statements.register("purge_cache_invalidations", """
+    DELETE FROM public.cache_invalidations WHERE created_at < now() - make_interval(secs => :older_than)
+""")
+
+LAST_INVALIDATION_SQL = statements.register("last_cache_invalidation", """
+    SELECT COALESCE(max(id), 0) FROM public.cache_invalidations
+""")
+
+SELECT_INVALIDATIONS_SQL = statements.register("select_cache_invalidations", """
+    SELECT id, cache, key FROM public.cache_invalidations WHERE id > :after ORDER BY id
+""")
+
+# Nome do cache -> função que descarta uma chave (None = o cache inteiro)
+_handlers = {}
+_lock = threading.Lock()
+_last_id = None
+_thread = None
+_counters = {"published": 0, "applied": 0, "sync_errors": 0}
+
+
+def register_cache(name: str, invalidate):
+    """invalidate(key) recebe a chave como gravada em JSON (listas no lugar de tuplas)."""
+    _handlers[name] = invalidate
+
+
+def publish(name: str, key=None):
+    """
+    Invalida a chave (None = o cache inteiro) neste worker e nos demais.
+    Retorna quantas entradas saíram deste worker.
+    """
+    removed = _handlers[name](key)
+    with tenant_transaction() as conn:
+        conn.execute(PUBLISH_SQL, {"cache": name, "key": codec.dumps(key)})
+        conn.execute(PURGE_SQL, {"older_than": CACHE_INVALIDATION_RETENTION})
+    with _lock:
+        _counters["published"] += 1
+    return removed
+
+
+def watch():
+    """
+    Chamado antes de carregar um valor do banco para o cache: na primeira vez
+    anota a última invalidação existente (as anteriores não valem para o que
+    vai ser carregado) e inicia a thread que aplica as próximas.
+    """
+    global _last_id, _thread
+
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        if _last_id is None:
+            try:
+                with tenant_transaction() as conn:
+                    _last_id = conn.execute(LAST_INVALIDATION_SQL).scalar()
+            except Exception as e:
+                print("Erro ao ler as invalidações de cache:", e)
+                _counters["sync_errors"] += 1
+                return
+        _thread = threading.Thread(target=_run, name="cache-sync", daemon=True)
+        _thread.start()
+
+
+def _run():
+    while True:
+        time.sleep(CACHE_SYNC_INTERVAL)
+        try:
+            sync()
+        except Exception as e:
+            print("Erro ao aplicar as invalidações de cache:", e)
+            with _lock:
+                _counters["sync_errors"] += 1
+
+
+def sync():
+    """Aplica neste worker as invalidações gravadas depois da última lida."""
+    global _last_id
+
+    with _lock:
+        after = _last_id
+    if after is None:
+        return 0
+
+    with tenant_transaction() as conn:
+        rows = conn.execute(SELECT_INVALIDATIONS_SQL, {"after": after}).all()
+
+    for row in rows:
+        handler = _handlers.get(row.cache)
+        if handler is not None:
+            handler(row.key)
+
+    with _lock:
+        if rows:
+            _last_id = max(_last_id, rows[-1].id)
+        _counters["applied"] += len(rows)
+    return len(rows)
+
+
+def cache_sync_stats():
+    with _lock:
+        return {**_counters, "interval": CACHE_SYNC_INTERVAL, "running": int(_thread is not None and _thread.is_alive())}
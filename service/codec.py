@@ -0,0 +1,108 @@
+"""
+Codec JSON usado nas requisições/respostas do Flask e nas colunas jsonb
+(context, conversation, question_sequence). Usa o orjson quando instalado e
+cai para o json da biblioteca padrão caso contrário; JSON_CODEC=stdlib força
+a biblioteca padrão.
+
+O orjson só representa inteiros de 64 bits: na leitura, um inteiro maior
+vira float (perdendo dígitos) e, na escrita, é recusado. Nos dois casos o
+codec usa o json da biblioteca padrão, que preserva o valor; na leitura, o
+texto com uma sequência de 20 ou mais dígitos (19 depois de um sinal de
+menos) vai direto para ele.
+"""
+import datetime
+import decimal
+import json
+import os
+import re
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CODEC = os.environ.get("JSON_CODEC") or ("orjson" if orjson else "stdlib")
+if JSON_CODEC == "orjson" and orjson is None:
+    print("⚠️ JSON_CODEC=orjson, mas o orjson não está instalado; usando json da biblioteca padrão")
+    JSON_CODEC = "stdlib"
+
+
+def _default(obj):
+    """Tipos que aparecem nas linhas do banco e não são JSON nativo."""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+
+
+def _stdlib_dumps(obj, default=None, sort_keys=False, indent=False):
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        default=default or _default,
+        sort_keys=sort_keys,
+        indent=2 if indent else None,
+        separators=(",", ": ") if indent else (",", ":"),
+    )
+
+
+def dumps(obj, default=None, sort_keys=False, indent=False):
+    """Serializa para str (UTF-8, sem escapar acentos)."""
+    if JSON_CODEC == "orjson":
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+        if default is not None:
+            # Datas passam pelo default para manter o formato de quem chamou (ex.: Flask)
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default or _default, option=option).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # Ex.: inteiros acima de 64 bits, que o orjson não aceita
+            pass
+    return _stdlib_dumps(obj, default, sort_keys, indent)
+
+
+# Podem ser um inteiro fora dos 64 bits (ou estar dentro de uma string): 20
+# dígitos seguidos, ou 19 negativos (abaixo de -2**63)
+_LONG_DIGITS = re.compile(r"-\d{19}|\d{20}")
+_LONG_DIGITS_BYTES = re.compile(rb"-\d{19}|\d{20}")
+
+
+def _may_overflow(data):
+    pattern = _LONG_DIGITS if isinstance(data, str) else _LONG_DIGITS_BYTES
+    return pattern.search(data) is not None
+
+
+def loads(data):
+    """Desserializa str ou bytes."""
+    if JSON_CODEC == "orjson" and not _may_overflow(data):
+        return orjson.loads(data)
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+def install_flask_provider(app):
+    """Faz jsonify, request.get_json e companhia usarem este codec."""
+    from flask.json.provider import DefaultJSONProvider
+
+    class CodecJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return dumps(
+                obj,
+                default=kwargs.get("default", self.default),
+                sort_keys=kwargs.get("sort_keys", self.sort_keys),
+                indent=bool(kwargs.get("indent")),
+            )
+
+        def loads(self, s, **kwargs):
+            return loads(s)
+
+    app.json = CodecJSONProvider(app)
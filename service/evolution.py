@@ -0,0 +1,294 @@
+import binascii
+import mimetypes
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+from service import idempotency
+
+# Código da vaga enviado na primeira mensagem: @VAGA<id>-<tenant>
+VAGA_PATTERN = re.compile(r"@VAGA(\d+)-([A-Za-z0-9_-]+)", re.IGNORECASE)
+
+# Diretório onde as mídias (áudio/documento) decodificadas são gravadas. O n8n
+# baixa a mídia pela URL do evento (GET /media/<id>); com mais de uma instância
+# da API, MEDIA_DIR deve ser um volume compartilhado entre elas
+MEDIA_DIR = os.environ.get("MEDIA_DIR") or tempfile.gettempdir()
+MEDIA_PREFIX = "evolution_"
+# Endereço público da API usado na URL da mídia (ex.: https://api.exemplo.com);
+# vazio = o mesmo endereço que recebeu o webhook
+MEDIA_BASE_URL = os.environ.get("MEDIA_BASE_URL", "").rstrip("/")
+# Mídias gravadas há mais que isso (h) são apagadas de MEDIA_DIR
+MEDIA_RETENTION_HOURS = float(os.environ.get("MEDIA_RETENTION_HOURS", "24"))
+# Intervalo mínimo (s) entre duas limpezas de MEDIA_DIR, feitas a cada mídia gravada
+MEDIA_PURGE_INTERVAL = float(os.environ.get("MEDIA_PURGE_INTERVAL", "600"))
+
+# Tamanho dos blocos de base64 decodificados por vez
+BASE64_CHUNK_SIZE = 64 * 1024
+
+# Prefixo data URI ("data:audio/ogg;base64,") que alguns clientes mandam junto
+DATA_URI_PATTERN = re.compile(r"^\s*data:([^,;]*)(?:;[^,]*)?;base64,", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Nome das mídias gravadas: prefixo, 128 bits aleatórios (o id funciona como
+# link secreto) e a extensão
+MEDIA_SUFFIX_PATTERN = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+MEDIA_ID_PATTERN = re.compile(rf"^{MEDIA_PREFIX}[0-9a-f]{{32}}(\.[A-Za-z0-9]{{1,10}})?$")
+
+# Escopo das mensagens já processadas na tabela de idempotência (vale para
+# todos os workers): reenvios do webhook com o mesmo data.key.id são descartados
+EVOLUTION_SCOPE = "evolution"
+
+_dedupe_counters = {"processed": 0, "duplicates": 0, "in_progress": 0}
+_dedupe_lock = threading.Lock()
+
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def iter_base64_chunks(data: str, chunk_size: int = BASE64_CHUNK_SIZE):
+    """
+    Decodifica o base64 em blocos, aceitando quebras de linha e espaços no
+    meio do texto: os caracteres que sobram de um bloco (fora do múltiplo de
+    4) seguem para o próximo. Lança ValueError (binascii.Error) se o base64
+    for inválido.
+    """
+    pending = ""
+    for start in range(0, len(data), chunk_size):
+        pending += WHITESPACE_PATTERN.sub("", data[start:start + chunk_size])
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield binascii.a2b_base64(pending[:usable], strict_mode=True)
+            pending = pending[usable:]
+
+    if pending:
+        raise ValueError("tamanho incompleto")
+
+
+def save_base64_media(data: str, file_name: str = None, mime_type: str = None):
+    """
+    Decodifica o base64 (com ou sem prefixo data URI) em blocos direto para um
+    arquivo em MEDIA_DIR, sem montar o binário inteiro em memória. Retorna o
+    caminho e o tamanho; se o base64 for inválido, o arquivo parcial é apagado
+    e ValueError é lançado.
+    """
+    match = DATA_URI_PATTERN.match(data)
+    if match:
+        mime_type = mime_type or match.group(1) or None
+        data = data[match.end():]
+
+    suffix = os.path.splitext(file_name or "")[1]
+    if not MEDIA_SUFFIX_PATTERN.match(suffix):
+        suffix = mimetypes.guess_extension(mime_type or "") or ""
+    purge_media()
+
+    size = 0
+    path = os.path.join(MEDIA_DIR, f"{MEDIA_PREFIX}{secrets.token_hex(16)}{suffix}")
+    with open(path, "xb") as f:
+        try:
+            for chunk in iter_base64_chunks(data):
+                f.write(chunk)
+                size += len(chunk)
+        except BaseException as e:
+            # Não deixa o arquivo parcial em MEDIA_DIR
+            f.close()
+            os.unlink(f.name)
+            if isinstance(e, ValueError):
+                raise ValueError(f"Mídia em base64 inválida: {e}") from e
+            raise
+
+    return f.name, size
+
+
+def media_info(path: str, size: int, mime_type: str, file_name: str):
+    """Descrição da mídia gravada no evento: id e URL de download (GET /media/<id>)."""
+    media_id = os.path.basename(path)
+    return {
+        "id": media_id,
+        "url": f"{MEDIA_BASE_URL}/media/{media_id}",
+        "size": size,
+        "mime_type": mime_type,
+        "file_name": file_name,
+    }
+
+
+def media_path(media_id: str):
+    """
+    Caminho da mídia gravada por save_base64_media, ou None se o id for
+    inválido ou a mídia não existir mais (apagada depois de MEDIA_RETENTION_HOURS).
+    """
+    if not MEDIA_ID_PATTERN.match(media_id or ""):
+        return None
+
+    path = os.path.join(MEDIA_DIR, media_id)
+    try:
+        expired = os.stat(path).st_mtime < time.time() - MEDIA_RETENTION_HOURS * 3600
+    except OSError:
+        return None
+    return None if expired else path
+
+
+def purge_media(older_than: float = None, force: bool = False):
+    """
+    Apaga de MEDIA_DIR as mídias gravadas por save_base64_media há mais de
+    older_than segundos (padrão: MEDIA_RETENTION_HOURS). Sem force, roda no
+    máximo uma vez a cada MEDIA_PURGE_INTERVAL. Retorna quantos arquivos saíram.
+    """
+    global _last_purge
+
+    now = time.time()
+    with _purge_lock:
+        if not force and now - _last_purge < MEDIA_PURGE_INTERVAL:
+            return 0
+        _last_purge = now
+
+    cutoff = now - (MEDIA_RETENTION_HOURS * 3600 if older_than is None else older_than)
+    removed = 0
+    try:
+        entries = list(os.scandir(MEDIA_DIR))
+    except OSError as e:
+        print("Erro ao listar MEDIA_DIR:", e)
+        return 0
+
+    for entry in entries:
+        if not entry.name.startswith(MEDIA_PREFIX):
+            continue
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            # Apagado por outro worker no meio tempo
+            continue
+
+    if removed:
+        print(f"🧹 {removed} mídias antigas apagadas de {MEDIA_DIR}")
+    return removed
+
+
+def parse_evolution_event(body: dict):
+    """
+    Normaliza o webhook da Evolution API (texto, áudio ou documento), como o
+    nó "Parser universal para mensagens do Evolution API" do n8n.
+    Retorna None para mensagens enviadas pelo próprio número (fromMe).
+    """
+    data = body.get("data") or {}
+    key = data.get("key") or {}
+
+    if key.get("fromMe") is True:
+        return None
+
+    # --- Extrai remetente ---
+    remote_jid = key.get("remoteJid") or data.get("remoteJid") or body.get("sender")
+    phone = remote_jid.replace("@s.whatsapp.net", "") if remote_jid else None
+
+    # --- Extrai informações da mensagem ---
+    message = data.get("message") or {}
+    message_type = data.get("messageType") or "unknown"
+
+    event = {
+        "event": body.get("event"),
+        "message_id": key.get("id"),
+        "phone": phone,
+        "job_posting_id": None,
+        "tenant_name": None,
+        "raw_remoteJid": remote_jid,
+        "message_type": "unknown",
+        "message_content": None,
+        "media": None,
+    }
+
+    if message_type in ("conversation", "text"):
+        event["message_type"] = "text"
+        content = message.get("conversation") or (message.get("text") or {}).get("body")
+        event["message_content"] = content
+
+        # Verifica se o texto tem a vaga
+        match = VAGA_PATTERN.search(content or "")
+        if match:
+            event["job_posting_id"] = match.group(1)
+            event["tenant_name"] = match.group(2)
+
+    elif message_type in ("audioMessage", "audio"):
+        audio = message.get("audioMessage") or {}
+        event["message_type"] = "audio"
+        event["message_content"] = audio.get("url") or audio.get("id")
+
+        if message.get("base64"):
+            mime_type = (audio.get("mimetype") or "audio/ogg").split(";")[0]
+            path, size = save_base64_media(message["base64"], "whatsapp-audio.ogg", mime_type)
+            event["media"] = media_info(path, size, mime_type, "whatsapp-audio.ogg")
+
+    elif message_type in ("documentMessage", "document"):
+        document = message.get("documentMessage") or {}
+        event["message_type"] = "document"
+        event["message_content"] = {
+            "file_name": document.get("fileName"),
+            "mime_type": document.get("mimetype"),
+            "url": document.get("url"),
+            "file_size": document.get("fileLength"),
+        }
+
+        if message.get("base64"):
+            file_name = document.get("fileName") or message.get("fileName") or "arquivo.pdf"
+            mime_type = document.get("mimetype") or message.get("mimetype")
+            path, size = save_base64_media(message["base64"], file_name, mime_type)
+            event["media"] = media_info(path, size, mime_type, file_name)
+
+    return event
+
+
+def _count(counter: str):
+    with _dedupe_lock:
+        _dedupe_counters[counter] += 1
+
+
+def ingest_evolution_event(body: dict):
+    """
+    Processa um webhook da Evolution API: ignora fromMe, descarta ids já
+    vistos e devolve o evento normalizado (com a mídia já gravada em disco).
+    Retorna (evento, motivo), onde motivo é "fromMe"/"duplicada" quando o
+    evento foi descartado, ou "em_processamento" quando outra entrega da
+    mesma mensagem ainda está sendo processada.
+
+    O id da mensagem (data.key.id) é reservado na tabela de idempotência antes
+    do parse (para não decodificar a mídia de novo), então entregas repetidas
+    ou simultâneas são descartadas em qualquer worker. Se o parse falhar, a
+    reserva é liberada e um reenvio é processado.
+    """
+    key = (body.get("data") or {}).get("key") or {}
+    if key.get("fromMe") is True:
+        return None, "fromMe"
+
+    message_id = key.get("id")
+    if message_id:
+        if idempotency.cached_response(EVOLUTION_SCOPE, message_id) is not None:
+            _count("duplicates")
+            return None, "duplicada"
+
+        claimed, row = idempotency.claim_key(EVOLUTION_SCOPE, message_id)
+        if not claimed:
+            if idempotency.stored_response(EVOLUTION_SCOPE, message_id, row) is None:
+                _count("in_progress")
+                return None, "em_processamento"
+            _count("duplicates")
+            return None, "duplicada"
+
+    try:
+        event = parse_evolution_event(body)
+    except BaseException:
+        if message_id:
+            idempotency.release_key(EVOLUTION_SCOPE, message_id)
+        raise
+
+    if message_id:
+        idempotency.complete_key(EVOLUTION_SCOPE, message_id, 200, {"message_id": message_id})
+    _count("processed")
+    return event, None
+
+
+def evolution_dedupe_stats():
+    with _dedupe_lock:
+        return dict(_dedupe_counters)
@@ -0,0 +1,163 @@
+"""
+Exportação das inscrições de uma vaga (processo, candidato, telefone e
+respostas) em NDJSON ou CSV.
+
+A consulta roda com cursor no servidor (stream_results) e as linhas são
+lidas e escritas em blocos de EXPORT_CHUNK_SIZE, então a memória não cresce
+com o tamanho da vaga. Os filtros since/until (created_at) e updated_since
+(updated_at) permitem puxadas incrementais.
+"""
+import csv
+import io
+import os
+from datetime import datetime
+
+from db_config import tenant_transaction, validate_tenant_name
+from service import codec, statements
+
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_FORMATS = ("ndjson", "csv")
+
+EXPORT_COLUMNS = (
+    "recruitment_process_id",
+    "status",
+    "subscription_type",
+    "created_at",
+    "updated_at",
+    "candidate_id",
+    "name",
+    "email",
+    "cpf",
+    "phone",
+    "text_answers",
+    "alternative_answers",
+)
+
+JOB_POSTING_EXISTS_SQL = statements.register("job_posting_exists", """
+    SELECT 1 FROM ats_jobposting WHERE id = :job_posting_id
+""")
+
+# Um processo por linha; as respostas vêm agregadas por processo
+EXPORT_APPLICATIONS_SQL = statements.register("export_applications", """
+    SELECT rp.id AS recruitment_process_id,
+           rp.status,
+           rp.subscription_type,
+           rp.created_at,
+           rp.updated_at,
+           c.id AS candidate_id,
+           c.name,
+           c.email,
+           c.cpf,
+           phone.number AS phone,
+           COALESCE(answers.items, '[]'::json) AS text_answers,
+           COALESCE(alternatives.items, '[]'::json) AS alternative_answers
+    FROM ats_recruitmentprocess rp
+    JOIN ats_candidate c ON c.id = rp.candidate_id
+    LEFT JOIN LATERAL (
+        SELECT p.number
+        FROM ats_candidatephonecontact p
+        WHERE p.candidate_id = c.id
+        ORDER BY p.id DESC
+        LIMIT 1
+    ) phone ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('question_id', a.question_id, 'text', a.text) ORDER BY a.id) AS items
+        FROM ats_answertext a
+        WHERE a.recruitment_process_id = rp.id
+    ) answers ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(a.question_alternative_id ORDER BY a.id) AS items
+        FROM ats_answeralternative a
+        WHERE a.recruitment_process_id = rp.id
+    ) alternatives ON true
+    WHERE rp.job_posting_id = :job_posting_id
+      AND (CAST(:since AS timestamptz) IS NULL OR rp.created_at >= :since)
+      AND (CAST(:until AS timestamptz) IS NULL OR rp.created_at < :until)
+      AND (CAST(:updated_since AS timestamptz) IS NULL OR rp.updated_at >= :updated_since)
+    ORDER BY rp.id
+""")
+
+
+class ExportNotFoundError(LookupError):
+    pass
+
+
+def parse_export_date(value, name: str):
+    """Data ISO 8601 do filtro (ex.: 2025-11-05 ou 2025-11-05T09:00:00Z); vazio vira None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Parâmetro '{name}' inválido: use uma data ISO 8601")
+
+
+def _export_row(row):
+    item = dict(row)
+    for column in ("created_at", "updated_at"):
+        if item[column] is not None:
+            item[column] = item[column].isoformat()
+    for column in ("text_answers", "alternative_answers"):
+        if isinstance(item[column], str):
+            item[column] = codec.loads(item[column])
+    return item
+
+
+def _iter_chunks(tenant_name: str, params: dict):
+    """Blocos de até EXPORT_CHUNK_SIZE linhas, lidos do cursor no servidor."""
+    with tenant_transaction(tenant_name) as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE).execute(
+            EXPORT_APPLICATIONS_SQL, params
+        ).mappings()
+        for chunk in result.partitions():
+            yield [_export_row(row) for row in chunk]
+
+
+def _ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(codec.dumps(item) + "\n" for item in chunk)
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for chunk in chunks:
+        for item in chunk:
+            writer.writerow([
+                codec.dumps(item[column]) if column in ("text_answers", "alternative_answers") else item[column]
+                for column in EXPORT_COLUMNS
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Vaga sem inscrições: só o cabeçalho
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_applications(tenant_name: str, job_posting_id: int, output_format: str = "ndjson",
+                        since=None, until=None, updated_since=None):
+    """
+    Valida tenant, vaga e filtros antes de começar a resposta e retorna um
+    gerador de pedaços de texto no formato pedido. A transação (e a conexão
+    do pool) fica aberta enquanto o gerador é consumido.
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato inválido: use {' ou '.join(EXPORT_FORMATS)}")
+
+    validate_tenant_name(tenant_name)
+    with tenant_transaction(tenant_name) as conn:
+        if conn.execute(JOB_POSTING_EXISTS_SQL, {"job_posting_id": job_posting_id}).first() is None:
+            raise ExportNotFoundError(f"Vaga {job_posting_id} não encontrada")
+
+    params = {
+        "job_posting_id": job_posting_id,
+        "since": since,
+        "until": until,
+        "updated_since": updated_since,
+    }
+    chunks = _iter_chunks(tenant_name, params)
+    return _csv(chunks) if output_format == "csv" else _ndjson(chunks)
@@ -0,0 +1,208 @@
+"""
+Esquema compilado do formulário de uma vaga (ats_jobposting.question_sequence).
+
+O question_sequence é percorrido uma vez e vira índices por id e por key,
+mapas de opções (option_id e texto da opção -> option_id) e as posições dos
+campos do candidato. O esquema fica em cache por (tenant, vaga), então os
+turnos do /update_session, o /add_application e a gravação das respostas
+não precisam varrer as listas de perguntas e opções a cada chamada.
+
+O context da sessão é uma cópia do question_sequence, com as respostas; as
+posições do esquema são conferidas contra o context antes do uso e, se não
+baterem (context de outra versão do formulário), volta-se à busca linear.
+"""
+import os
+import unicodedata
+from collections import namedtuple
+
+from db_config import tenant_transaction, UnknownTenantError
+from service import cache_sync, statements
+from service.cache import TTLCache
+
+FORM_SCHEMA_CACHE_SIZE = int(os.environ.get("FORM_SCHEMA_CACHE_SIZE", "1000"))
+# A vaga pode ser editada no ATS: o esquema é recompilado depois disso (s)
+FORM_SCHEMA_CACHE_TTL = float(os.environ.get("FORM_SCHEMA_CACHE_TTL", "300"))
+# Recusa (422) respostas de múltipla escolha que não correspondem a nenhuma opção
+FORM_SCHEMA_VALIDATE_ANSWERS = os.environ.get("FORM_SCHEMA_VALIDATE_ANSWERS", "false").lower() in ("1", "true", "yes")
+
+SELECT_QUESTION_SEQUENCE_SQL = statements.register("select_question_sequence", """
+    SELECT question_sequence FROM ats_jobposting WHERE id = :job_posting_id
+""")
+
+# Campos do candidato no context: (chave do campo, chaves aceitas, exige type == "basic")
+# As perguntas básicas usam as chaves do cadastro do tenant ("nome", "e-mail")
+APPLICATION_FIELDS = (
+    ("name", ("name", "nome"), True),
+    ("email", ("email", "e-mail"), True),
+    ("cpf", ("cpf",), True),
+    ("document", ("document",), False),
+)
+
+CompiledQuestion = namedtuple("CompiledQuestion", "id key type answer_type position option_ids option_texts")
+
+# Marca, no cache, vaga sem question_sequence (evita reconsultar a cada turno)
+_NO_SCHEMA = object()
+
+
+def context_questions(context):
+    """
+    Lista de perguntas do context. Sessões criadas pelo n8n guardam o
+    question_sequence dentro de uma lista ([{"steps": ...}]).
+    """
+    if isinstance(context, list):
+        context = context[0] if context else {}
+    if not isinstance(context, dict):
+        return []
+    return context.get("steps", {}).get("questions", [])
+
+
+def normalize_option_text(value):
+    """Texto da opção sem acentos, caixa e espaços nas pontas."""
+    text = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode("ascii")
+    return text.strip().lower()
+
+
+class FormSchema:
+    def __init__(self, question_sequence):
+        self.by_id = {}
+        self.by_key = {}
+        self.fields = {}
+        self.customized = []
+
+        questions = context_questions(question_sequence)
+        self.size = len(questions)
+
+        for position, question in enumerate(questions):
+            options = question.get("answer_options") or []
+            compiled = CompiledQuestion(
+                id=question.get("id"),
+                key=question.get("key"),
+                type=question.get("type"),
+                answer_type=question.get("answer_type"),
+                position=position,
+                option_ids={str(opt.get("option_id")): opt.get("option_id") for opt in options if isinstance(opt, dict)},
+                option_texts={
+                    normalize_option_text(opt["option"]): opt.get("option_id")
+                    for opt in options if isinstance(opt, dict) and opt.get("option") is not None
+                },
+            )
+            if compiled.id is not None:
+                self.by_id.setdefault(compiled.id, compiled)
+            if compiled.key is not None:
+                self.by_key.setdefault(compiled.key, compiled)
+
+            for field, keys, basic_only in APPLICATION_FIELDS:
+                if compiled.key in keys and (compiled.type == "basic" or not basic_only):
+                    self.fields[field] = position
+            if compiled.type == "customized":
+                self.customized.append(position)
+
+    def _matches(self, questions, position, question_id=None, key=None):
+        if position >= len(questions):
+            return False
+        question = questions[position]
+        return isinstance(question, dict) and (key is None or question.get("key") == key) and (
+            question_id is None or question.get("id") == question_id
+        )
+
+    def find(self, questions: list, question_id):
+        """Pergunta do context com esse id, pela posição compilada; None se o context não bater."""
+        compiled = self.by_id.get(question_id)
+        if compiled is None or not self._matches(questions, compiled.position, question_id=question_id):
+            return None
+        return questions[compiled.position]
+
+    def layout_matches(self, questions: list):
+        """O context tem as mesmas perguntas, nas mesmas posições, que o esquema."""
+        return len(questions) == self.size and all(
+            self._matches(questions, compiled.position, key=compiled.key) for compiled in self.by_key.values()
+        )
+
+    def match_option(self, question_id, answer):
+        """option_id da resposta (pelo id ou pelo texto da opção); None se não corresponder."""
+        compiled = self.by_id.get(question_id)
+        if compiled is None or answer is None:
+            return None
+        option_id = compiled.option_ids.get(str(answer))
+        if option_id is None:
+            option_id = compiled.option_texts.get(normalize_option_text(answer))
+        return option_id
+
+    def validate_answer(self, question_id, answer):
+        """Mensagem de erro se a resposta não serve para a pergunta; None se serve."""
+        compiled = self.by_id.get(question_id)
+        if compiled is None or compiled.answer_type != "options" or not compiled.option_ids:
+            return None
+        if self.match_option(question_id, answer) is None:
+            return f"Resposta inválida para a questão {question_id}: escolha uma das opções"
+        return None
+
+
+_schemas = TTLCache(maxsize=FORM_SCHEMA_CACHE_SIZE, ttl=FORM_SCHEMA_CACHE_TTL)
+
+
+def _invalidate_local(key):
+    """Chave como gravada em cache_invalidations: [tenant, vaga], ou None para tudo."""
+    return _schemas.invalidate() if key is None else _schemas.invalidate((key[0], int(key[1])))
+
+
+# Invalidações feitas em qualquer worker valem para todos (ver service/cache_sync.py)
+cache_sync.register_cache("form_schema", _invalidate_local)
+
+
+def peek_form_schema(tenant_name, job_posting_id):
+    """Esquema em cache, sem acessar o banco (para uso dentro de transações e locks)."""
+    if not tenant_name or job_posting_id is None:
+        return None
+    schema = _schemas.get((tenant_name, int(job_posting_id)))
+    return None if schema is _NO_SCHEMA else schema
+
+
+def get_form_schema(tenant_name, job_posting_id):
+    """
+    Esquema compilado da vaga, do cache ou carregado do question_sequence.
+    Retorna None se a vaga não existir, não tiver question_sequence ou a carga
+    falhar: quem chama continua com a busca linear.
+    """
+    if not tenant_name or job_posting_id is None:
+        return None
+
+    key = (tenant_name, int(job_posting_id))
+    schema = _schemas.get(key)
+    if schema is not None:
+        return None if schema is _NO_SCHEMA else schema
+
+    cache_sync.watch()
+    try:
+        with tenant_transaction(tenant_name) as conn:
+            question_sequence = conn.execute(SELECT_QUESTION_SEQUENCE_SQL, {"job_posting_id": key[1]}).scalar()
+    except UnknownTenantError:
+        question_sequence = None
+    except Exception as e:
+        print(f"Erro ao carregar o formulário da vaga {job_posting_id} ({tenant_name}):", e)
+        return None
+
+    schema = FormSchema(question_sequence) if question_sequence else None
+    _schemas.set(key, schema if schema is not None else _NO_SCHEMA)
+    return schema
+
+
+def warm_form_schemas(postings):
+    """Carrega no cache os esquemas das (tenant, vaga) ainda ausentes."""
+    for tenant_name, job_posting_id in set(postings):
+        get_form_schema(tenant_name, job_posting_id)
+
+
+def invalidate_form_schema(tenant_name=None, job_posting_id=None):
+    """
+    Descarta o esquema da vaga (ou todo o cache) neste worker e, em até
+    CACHE_SYNC_INTERVAL segundos, nos demais. Retorna quantas entradas saíram
+    deste worker.
+    """
+    if tenant_name is None or job_posting_id is None:
+        return cache_sync.publish("form_schema")
+    return cache_sync.publish("form_schema", [tenant_name, int(job_posting_id)])
+
+
+def form_schema_cache_stats():
+    return _schemas.stats()
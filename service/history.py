@@ -0,0 +1,290 @@
+"""
+Histórico frio das conversas (public.ats_chat_message_archive).
+
+O histórico de uma sessão fica em duas camadas, da mais antiga para a mais
+recente:
+
+  1. blocos arquivados: JSON comprimido com zlib, em ordem de chunk_seq;
+  2. a coluna ats_chat_stage.conversation (linha quente).
+
+compact_chat_stage move as mensagens antigas da coluna para blocos
+arquivados, mantendo só as últimas `keep_last` na linha quente. Sessões
+finalizadas (ou paradas há CHAT_ARCHIVE_AFTER_DAYS dias) são arquivadas por
+inteiro. get_chat_messages devolve as últimas N mensagens percorrendo as duas
+camadas, paginando para trás com um cursor.
+
+Cada mensagem tem um número de sequência absoluto: as arquivadas vão de 1 a
+ats_chat_stage.archived_messages e as da coluna continuam a partir daí. A
+compactação só move mensagens de camada, sem mudar o número delas, então o
+cursor (o número da mensagem mais antiga da página) continua valendo depois
+de uma compactação. A data da mensagem não serve de cursor: as do n8n têm
+precisão de segundos e repetem.
+
+O n8n regrava a coluna conversation inteira; o trigger da migração 009 corta
+dela as mensagens até archived_through, para que uma gravação feita a partir
+de uma leitura anterior à compactação não traga de volta o que foi arquivado.
+"""
+import os
+import zlib
+
+from db_config import tenant_transaction
+from service import application, codec, statements
+
+# Mensagens que ficam na linha quente de uma sessão em andamento
+CHAT_HOT_MESSAGES = int(os.environ.get("CHAT_HOT_MESSAGES", "200"))
+# Sessão sem atualização há mais que isso é tratada como finalizada
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", "7"))
+CHAT_ARCHIVE_CHUNK_SIZE = int(os.environ.get("CHAT_ARCHIVE_CHUNK_SIZE", "500"))
+CHAT_ARCHIVE_COMPRESSION = int(os.environ.get("CHAT_ARCHIVE_COMPRESSION", "6"))
+CHAT_MESSAGES_MAX_LIMIT = int(os.environ.get("CHAT_MESSAGES_MAX_LIMIT", "500"))
+
+ARCHIVE_TABLE = "public.ats_chat_message_archive"
+ARCHIVE_COLUMNS = ("chat_stage_id", "chunk_seq", "message_count", "first_at", "last_at", "payload")
+
+# Sessão finalizada: por status, pela interação do n8n ou parada há :after_days dias
+FINISHED_SQL = """
+    COALESCE(s.status = 'finalizada' OR s.interaction = 'finalizado'
+             OR s.updated_at < now() - make_interval(days => :after_days), false)
+"""
+
+# Sessões com algo a arquivar: finalizadas com qualquer histórico quente, ou
+# em andamento com mais de :keep_last mensagens na linha quente. Cada ramo usa
+# um dos índices parciais sobre hot_messages (migração 009), sem varrer a tabela
+SELECT_COMPACTION_CANDIDATES_SQL = statements.register("select_compaction_candidates", f"""
+    SELECT s.id, {FINISHED_SQL} AS finished
+    FROM (
+        (SELECT id FROM public.ats_chat_stage
+         WHERE hot_messages > :keep_last
+         ORDER BY hot_messages DESC LIMIT :limit)
+        UNION
+        (SELECT id FROM public.ats_chat_stage
+         WHERE hot_messages > 0 AND updated_at < now() - make_interval(days => :after_days)
+         ORDER BY updated_at LIMIT :limit)
+        UNION
+        (SELECT id FROM public.ats_chat_stage
+         WHERE hot_messages > 0 AND (status = 'finalizada' OR interaction = 'finalizado')
+         ORDER BY id LIMIT :limit)
+    ) candidates
+    JOIN public.ats_chat_stage s ON s.id = candidates.id
+    ORDER BY s.id
+    LIMIT :limit
+""")
+
+SELECT_COMPACTION_CANDIDATES_BY_ID_SQL = statements.register("select_compaction_candidates_by_id", f"""
+    SELECT id, finished
+    FROM (
+        SELECT s.id, s.hot_messages, {FINISHED_SQL} AS finished
+        FROM public.ats_chat_stage s
+        WHERE s.id = ANY(CAST(:ids AS integer[]))
+    ) candidates
+    WHERE hot_messages > CASE WHEN finished THEN 0 ELSE :keep_last END
+    ORDER BY id
+    LIMIT :limit
+""")
+
+LOCK_CHAT_STAGE_SQL = statements.register("lock_chat_stage_conversation", """
+    SELECT conversation FROM public.ats_chat_stage WHERE id = :chat_stage_id FOR UPDATE
+""")
+
+NEXT_CHUNK_SEQ_SQL = statements.register("next_archive_chunk_seq", f"""
+    SELECT COALESCE(max(chunk_seq), 0) + 1 FROM {ARCHIVE_TABLE} WHERE chat_stage_id = :chat_stage_id
+""")
+
+WRITE_COMPACTED_CONVERSATION_SQL = statements.register("write_compacted_conversation", """
+    UPDATE public.ats_chat_stage
+    SET conversation = CAST(:conversation AS jsonb),
+        archived_messages = archived_messages + :archived,
+        archived_through = CAST(:archived_through AS jsonb)
+    WHERE id = :chat_stage_id
+""")
+
+# --- leitura paginada ---
+
+# Mensagens da coluna com número anterior a :before; a linha da sessão vem
+# mesmo sem mensagens (posição nula), e serve de checagem de existência
+SELECT_HOT_PAGE_SQL = statements.register("select_hot_messages_page", """
+    SELECT s.archived_messages, e.position, e.message
+    FROM public.ats_chat_stage s
+    LEFT JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(s.conversation) = 'array' THEN s.conversation ELSE '[]'::jsonb END
+    ) WITH ORDINALITY AS e(message, position) ON s.archived_messages + e.position < :before
+    WHERE s.id = :chat_stage_id
+    ORDER BY e.position DESC NULLS LAST
+    LIMIT :limit
+""")
+
+# Número da última mensagem de cada bloco, sem ler os payloads
+SELECT_ARCHIVE_CHUNKS_SQL = statements.register("select_archive_chunks", f"""
+    SELECT chunk_seq, message_count, sum(message_count) OVER (ORDER BY chunk_seq) AS last_seq
+    FROM {ARCHIVE_TABLE}
+    WHERE chat_stage_id = :chat_stage_id
+    ORDER BY chunk_seq DESC
+""")
+
+SELECT_ARCHIVE_PAYLOAD_SQL = statements.register("select_archive_payload", f"""
+    SELECT payload FROM {ARCHIVE_TABLE} WHERE chat_stage_id = :chat_stage_id AND chunk_seq = :chunk_seq
+""")
+
+# Posição "infinita" usada quando não há cursor
+_END = 2 ** 62
+
+
+def _compress(messages: list):
+    return zlib.compress(codec.dumps(messages).encode("utf-8"), CHAT_ARCHIVE_COMPRESSION)
+
+
+def _decompress(payload):
+    return codec.loads(zlib.decompress(bytes(payload)))
+
+
+def compact_chat_stage(conn, chat_stage_id: int, keep_last: int):
+    """
+    Arquiva o histórico quente da sessão, mantendo as últimas `keep_last`
+    mensagens fora do arquivo. Roda na transação recebida e trava a linha da
+    sessão. Retorna o número de mensagens arquivadas.
+    """
+    locked = conn.execute(LOCK_CHAT_STAGE_SQL, {"chat_stage_id": chat_stage_id}).first()
+    if locked is None:
+        return 0
+
+    hot = locked[0] if isinstance(locked[0], list) else []
+
+    # As mais antigas saem primeiro
+    to_archive = max(len(hot) - keep_last, 0)
+    if to_archive == 0:
+        return 0
+
+    messages = hot[:to_archive]
+
+    next_seq = conn.execute(NEXT_CHUNK_SEQ_SQL, {"chat_stage_id": chat_stage_id}).scalar()
+    chunks = [messages[start:start + CHAT_ARCHIVE_CHUNK_SIZE] for start in range(0, len(messages), CHAT_ARCHIVE_CHUNK_SIZE)]
+    rows = [
+        {
+            "chat_stage_id": chat_stage_id,
+            "chunk_seq": next_seq + i,
+            "message_count": len(chunk),
+            "first_at": chunk[0].get("date"),
+            "last_at": chunk[-1].get("date"),
+            "payload": _compress(chunk),
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    conn.execute(
+        statements.multi_row_insert(ARCHIVE_TABLE, ARCHIVE_COLUMNS, len(rows)),
+        statements.multi_row_params(rows, ARCHIVE_COLUMNS)
+    )
+
+    conn.execute(WRITE_COMPACTED_CONVERSATION_SQL, {
+        "chat_stage_id": chat_stage_id,
+        "conversation": codec.dumps(hot[to_archive:]),
+        "archived": len(messages),
+        "archived_through": codec.dumps(messages[-1]),
+    })
+
+    return len(messages)
+
+
+def compact_chat_stages(keep_last: int = None, limit: int = 100, chat_stage_ids=None):
+    """
+    Arquiva o histórico das sessões finalizadas (por inteiro) e das sessões em
+    andamento com mais de keep_last mensagens quentes. Cada sessão usa a sua
+    própria transação, para não segurar travas. Retorna um resumo.
+    """
+    keep_last = CHAT_HOT_MESSAGES if keep_last is None else keep_last
+
+    params = {"after_days": CHAT_ARCHIVE_AFTER_DAYS, "keep_last": keep_last, "limit": limit}
+    with tenant_transaction() as conn:
+        if chat_stage_ids is None:
+            candidates = conn.execute(SELECT_COMPACTION_CANDIDATES_SQL, params).all()
+        else:
+            candidates = conn.execute(SELECT_COMPACTION_CANDIDATES_BY_ID_SQL, {
+                **params, "ids": [int(chat_stage_id) for chat_stage_id in chat_stage_ids]
+            }).all()
+
+    summary = {"sessions": 0, "archived_messages": 0, "errors": 0}
+    for candidate in candidates:
+        try:
+            with tenant_transaction() as conn:
+                archived = compact_chat_stage(conn, candidate.id, 0 if candidate.finished else keep_last)
+        except Exception as e:
+            print(f"Erro ao arquivar o histórico da sessão {candidate.id}:", e)
+            summary["errors"] += 1
+            continue
+
+        if archived:
+            summary["sessions"] += 1
+            summary["archived_messages"] += archived
+            application.invalidate_active_sessions(candidate.id)
+
+    print(f"📦 Histórico arquivado: {summary['archived_messages']} mensagens de {summary['sessions']} sessões")
+    return summary
+
+
+def _parse_cursor(before):
+    """Cursor de get_chat_messages: número da mensagem. None = mais recentes."""
+    if before is None or before == "":
+        return _END
+    try:
+        position = int(before)
+    except (TypeError, ValueError):
+        position = 0
+    if position < 1:
+        raise ValueError(f"Cursor inválido: {before}")
+    return position
+
+
+def get_chat_messages(chat_stage_id: int, limit: int = 50, before: str = None):
+    """
+    Últimas `limit` mensagens da sessão anteriores ao cursor `before`, em ordem
+    cronológica, juntando a coluna conversation e o arquivo. Só
+    descomprime os blocos arquivados necessários para completar a página.
+    Retorna {"messages": [...], "next_before": cursor ou None}, ou None se a
+    sessão não existir.
+    """
+    limit = max(1, min(int(limit), CHAT_MESSAGES_MAX_LIMIT))
+    before = _parse_cursor(before)
+    # Uma mensagem a mais indica se ainda há página anterior
+    wanted = limit + 1
+    page = []  # (número, mensagem), da mais recente para a mais antiga
+
+    with tenant_transaction() as conn:
+        rows = conn.execute(SELECT_HOT_PAGE_SQL, {
+            "chat_stage_id": chat_stage_id, "before": before, "limit": wanted
+        }).mappings().all()
+        if not rows:
+            return None
+
+        archived_messages = rows[0]["archived_messages"]
+        page.extend((archived_messages + row["position"], row["message"]) for row in rows if row["position"] is not None)
+
+        # Uma compactação entre as duas leituras já entrou na página pela
+        # coluna: do arquivo, só as mensagens arquivadas até a primeira leitura
+        before = min(before, archived_messages + 1)
+        chunks = []
+        if len(page) < wanted and before > 1:
+            chunks = conn.execute(SELECT_ARCHIVE_CHUNKS_SQL, {"chat_stage_id": chat_stage_id}).all()
+
+        # Um bloco por vez, do mais recente para o mais antigo, até completar a página
+        for chunk in chunks:
+            if len(page) == wanted:
+                break
+            first_seq = chunk.last_seq - chunk.message_count + 1
+            if first_seq >= before:
+                continue
+
+            payload = conn.execute(SELECT_ARCHIVE_PAYLOAD_SQL, {
+                "chat_stage_id": chat_stage_id, "chunk_seq": chunk.chunk_seq
+            }).scalar()
+            messages = _decompress(payload)
+            for i in range(min(len(messages), before - first_seq) - 1, -1, -1):
+                page.append((first_seq + i, messages[i]))
+                if len(page) == wanted:
+                    break
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    return {
+        "chat_stage_id": chat_stage_id,
+        "messages": [message for _, message in reversed(page)],
+        "next_before": str(page[-1][0]) if has_more else None,
+    }
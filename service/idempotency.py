@@ -0,0 +1,271 @@
+import contextvars
+import os
+import threading
+from functools import wraps
+
+from db_config import tenant_transaction
+from service import codec, statements
+from service.cache import TTLCache
+
+# Por quanto tempo (s) uma chave continua valendo; depois disso a requisição é processada de novo
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+
+# Uma reserva 'processando' mais antiga que isso (s) é considerada abandonada (worker caiu no meio)
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+
+# Respostas recentes ficam em memória para que as repetições nem consultem o banco
+_responses = TTLCache(
+    maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=min(IDEMPOTENCY_TTL, float(os.environ.get("IDEMPOTENCY_CACHE_TTL", "3600"))),
+)
+
+# Reserva a chave; uma linha expirada ou abandonada pode ser reaproveitada
+CLAIM_SQL = statements.register("idempotency_claim", """
+    INSERT INTO public.api_idempotency (scope, idempotency_key, status)
+    VALUES (:scope, :key, 'processando')
+    ON CONFLICT (scope, idempotency_key) DO UPDATE
+    SET status = 'processando', response_code = NULL, response_body = NULL,
+        created_at = now(), updated_at = now()
+    WHERE api_idempotency.created_at < now() - make_interval(secs => :ttl)
+       OR (api_idempotency.status = 'processando'
+           AND api_idempotency.updated_at < now() - make_interval(secs => :lock_timeout))
+    RETURNING status
+""")
+
+SELECT_SQL = statements.register("idempotency_select", """
+    SELECT status, response_code, response_body
+    FROM public.api_idempotency
+    WHERE scope = :scope AND idempotency_key = :key
+""")
+
+COMPLETE_SQL = statements.register("idempotency_complete", """
+    UPDATE public.api_idempotency
+    SET status = 'concluido', response_code = :code, response_body = CAST(:body AS jsonb), updated_at = now()
+    WHERE scope = :scope AND idempotency_key = :key
+""")
+
+RELEASE_SQL = statements.register("idempotency_release", """
+    DELETE FROM public.api_idempotency
+    WHERE scope = :scope AND idempotency_key = :key AND status = 'processando'
+""")
+
+PURGE_SQL = statements.register("idempotency_purge", """
+    DELETE FROM public.api_idempotency
+    WHERE created_at < now() - make_interval(secs => :older_than)
+""")
+
+
+class DeferredKey:
+    """
+    Chave de uma requisição cuja gravação foi adiada (cache write-behind de
+    sessões, ver service/session_cache.py). A chave continua 'processando' até
+    que os turnos cheguem ao banco: só então a resposta é guardada; se a
+    gravação falhar, a chave é liberada. Repetições no meio tempo recebem 409.
+    """
+
+    def __init__(self, scope: str, key: str):
+        self.scope = scope
+        self.key = key
+        self.deferred = False
+        self.turns = 0
+        self.failed = False
+        self.response = None
+        self._lock = threading.Lock()
+
+    def add_turn(self):
+        with self._lock:
+            self.deferred = True
+            self.turns += 1
+
+    def respond(self, code: int, body):
+        """Resposta enviada ao cliente (chamado pelo decorator ao fim da rota)."""
+        with self._lock:
+            self.response = (code, body)
+            done = self.turns == 0
+        if done:
+            self._finish()
+
+    def resolve(self, stored: bool):
+        """Resultado da gravação de um dos turnos adiados."""
+        with self._lock:
+            self.turns -= 1
+            self.failed = self.failed or not stored
+            done = self.turns == 0 and self.response is not None
+        if done:
+            self._finish()
+
+    def _finish(self):
+        code, body = self.response
+        try:
+            if not self.failed and 200 <= code < 300:
+                complete_key(self.scope, self.key, code, body)
+            else:
+                release_key(self.scope, self.key)
+        except Exception as e:
+            print(f"Erro ao concluir a chave de idempotência {self.key}:", e)
+
+
+# Chave da requisição em andamento (contextvar: vale também em asyncio.to_thread)
+_current = contextvars.ContextVar("idempotency_current", default=None)
+
+
+def defer_current_key():
+    """
+    Marca a chave da requisição em andamento como adiada por mais um turno e a
+    retorna (None se a requisição não tem chave). Quem adia deve chamar
+    resolve() quando o turno for gravado (ou falhar).
+    """
+    deferred = _current.get()
+    if deferred is not None:
+        deferred.add_turn()
+    return deferred
+
+
+# As funções abaixo são compartilhadas com as versões assíncronas (service/aio.py e asgi.py)
+
+IN_PROGRESS_ERROR = "Requisição com esta chave ainda está em processamento"
+
+
+def idempotency_key(header, payload):
+    """
+    Chave enviada no cabeçalho Idempotency-Key ou, no corpo JSON, em
+    idempotency_key / message_id (id da mensagem da Evolution API).
+    """
+    key = header
+    if not key and isinstance(payload, dict):
+        key = payload.get("idempotency_key") or payload.get("message_id")
+    return str(key)[:255] if key else None
+
+
+def get_idempotency_key(req):
+    return idempotency_key(req.headers.get("Idempotency-Key"), req.get_json(silent=True))
+
+
+def claim_params(scope: str, key: str):
+    return {"scope": scope, "key": key, "ttl": IDEMPOTENCY_TTL, "lock_timeout": IDEMPOTENCY_LOCK_TIMEOUT}
+
+
+def complete_params(scope: str, key: str, code: int, body):
+    return {"scope": scope, "key": key, "code": code, "body": codec.dumps(body)}
+
+
+def claimed_row(row):
+    """Linha da chave que já estava reservada, com o corpo da resposta decodificado."""
+    # A linha pode ter sido liberada entre o INSERT e o SELECT: trata como em processamento
+    if not row:
+        return {"status": "processando"}
+    row = dict(row)
+    # O asyncpg devolve json como string
+    if isinstance(row.get("response_body"), str):
+        row["response_body"] = codec.loads(row["response_body"])
+    return row
+
+
+def cached_response(scope: str, key: str):
+    """(código, corpo) da resposta em memória, ou None."""
+    return _responses.get((scope, key))
+
+
+def remember_response(scope: str, key: str, code: int, body):
+    _responses.set((scope, key), (code, body))
+
+
+def stored_response(scope: str, key: str, row: dict):
+    """(código, corpo) da resposta registrada na linha, ou None se ainda está em processamento."""
+    if row["status"] != "concluido":
+        return None
+    remember_response(scope, key, row["response_code"], row["response_body"])
+    return row["response_code"], row["response_body"]
+
+
+def claim_key(scope: str, key: str):
+    """
+    Tenta reservar a chave. Retorna (True, None) se esta requisição deve ser
+    processada, ou (False, linha) com o status/resposta já registrados.
+    """
+    params = claim_params(scope, key)
+    with tenant_transaction() as conn:
+        if conn.execute(CLAIM_SQL, params).first() is not None:
+            return True, None
+        row = conn.execute(SELECT_SQL, params).mappings().first()
+
+    return False, claimed_row(row)
+
+
+def complete_key(scope: str, key: str, code: int, body):
+    with tenant_transaction() as conn:
+        conn.execute(COMPLETE_SQL, complete_params(scope, key, code, body))
+    remember_response(scope, key, code, body)
+
+
+def release_key(scope: str, key: str):
+    """Libera a reserva quando a requisição falhou, para que a retentativa seja processada."""
+    with tenant_transaction() as conn:
+        conn.execute(RELEASE_SQL, {"scope": scope, "key": key})
+
+
+def purge_idempotency_keys(older_than: float = IDEMPOTENCY_TTL):
+    """Remove do banco as chaves mais antigas que older_than segundos."""
+    with tenant_transaction() as conn:
+        return conn.execute(PURGE_SQL, {"older_than": older_than}).rowcount
+
+
+def idempotent(scope: str):
+    """
+    Decorator de rota Flask: requisições repetidas com a mesma chave recebem
+    a resposta da primeira, sem executar a rota (nem tocar nas tabelas do
+    tenant) de novo. Só respostas 2xx são guardadas; erros liberam a chave.
+    Se a rota adiou a gravação (defer_current_key), a resposta só é guardada
+    depois dela. Sem chave, a rota é executada normalmente.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import jsonify, make_response, request
+
+            key = get_idempotency_key(request)
+            if not key:
+                return view(*args, **kwargs)
+
+            cached = cached_response(scope, key)
+            if cached is None:
+                claimed, row = claim_key(scope, key)
+                if not claimed:
+                    cached = stored_response(scope, key, row)
+                    if cached is None:
+                        return jsonify({"error": IN_PROGRESS_ERROR}), 409
+
+            if cached is not None:
+                response = make_response(jsonify(cached[1]), cached[0])
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+
+            deferred = DeferredKey(scope, key)
+            token = _current.set(deferred)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                finish_key(deferred, 500, None)
+                raise
+            finally:
+                _current.reset(token)
+
+            finish_key(deferred, response.status_code, response.get_json(silent=True))
+            return response
+
+        return wrapper
+    return decorator
+
+
+def finish_key(deferred: DeferredKey, code: int, body):
+    """Guarda a resposta (2xx) ou libera a chave; se a gravação foi adiada, espera por ela."""
+    if deferred.deferred:
+        deferred.respond(code, body)
+    elif 200 <= code < 300:
+        complete_key(deferred.scope, deferred.key, code, body)
+    else:
+        release_key(deferred.scope, deferred.key)
+
+
+def idempotency_cache_stats():
+    return _responses.stats()
@@ -0,0 +1,131 @@
+from datetime import datetime
+
+from db_config import tenant_transaction, validate_tenant_name, UnknownTenantError
+from service import codec, statements
+from service.application import get_basic_questions
+
+JOB_POSTING_COLUMNS = (
+    "name",
+    "status",
+    "positions",
+    "created_at",
+    "updated_at",
+    "description",
+    "external_publication",
+    "netvagas_external_publication",
+    "google_for_jobs_external_publication",
+    "already_suspended",
+    "already_canceled",
+    "linkedin_external_publication",
+    "unlisted_external_publication",
+    "careerjet_external_publication",
+    "jooble_external_publication",
+    "competencies",
+    "question_sequence",
+    "job_code",
+)
+
+
+def _job_posting_row(name, job_code, question_sequence, now):
+    """Linha de ats_jobposting com os valores padrão de uma vaga criada pelo bot."""
+    return {
+        "name": name,
+        "status": "aberta",
+        "positions": 0,
+        "created_at": now,
+        "updated_at": now,
+        "description": "",
+        "external_publication": False,
+        "netvagas_external_publication": False,
+        "google_for_jobs_external_publication": False,
+        "already_suspended": False,
+        "already_canceled": False,
+        "linkedin_external_publication": False,
+        "unlisted_external_publication": False,
+        "careerjet_external_publication": False,
+        "jooble_external_publication": False,
+        "competencies": [],
+        "question_sequence": question_sequence,
+        "job_code": job_code,
+    }
+
+
+def job_posting_insert(question_sequence: dict, postings: list):
+    """
+    (comando, parâmetros) do INSERT ... RETURNING id das vagas, todas com o
+    mesmo question_sequence (serializado uma vez só).
+    postings é uma lista de (name, job_code).
+    """
+    encoded = codec.dumps(question_sequence)
+    now = datetime.utcnow()
+    rows = [_job_posting_row(name, job_code, encoded, now) for name, job_code in postings]
+    return (
+        statements.multi_row_insert("ats_jobposting", JOB_POSTING_COLUMNS, len(rows), returning="id"),
+        statements.multi_row_params(rows, JOB_POSTING_COLUMNS)
+    )
+
+
+def insert_job_postings(tenant_name: str, postings: list):
+    """
+    Cria as vagas do tenant com um único INSERT ... RETURNING, todas com o
+    question_sequence das perguntas básicas. Retorna os ids na ordem de postings.
+    """
+    statement, params = job_posting_insert(get_basic_questions(tenant_name), postings)
+
+    with tenant_transaction(tenant_name) as conn:
+        ids = conn.execute(statement, params).scalars().all()
+
+    # A identity é gerada na ordem do VALUES; ordenar garante a correspondência com a entrada
+    return sorted(ids)
+
+
+def create_job_posting(tenant_name: str, name: str, job_code: str = None):
+    return insert_job_postings(tenant_name, [(name, job_code)])[0]
+
+
+def create_job_postings(items: list):
+    """
+    Cria vagas de vários tenants. Os itens ({tenant, name, job_code}) são
+    agrupados por tenant: um INSERT e uma transação por tenant. Retorna um
+    resultado por item, na ordem recebida, com job_posting_id ou error/code.
+    """
+    results = [None] * len(items)
+    by_tenant = {}
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "error": "Item inválido", "code": 400}
+            continue
+
+        tenant = item.get("tenant") or item.get("tenant_name")
+        name = item.get("name")
+        if not name or not tenant:
+            results[index] = {"index": index, "error": "Campos 'tenant' e 'name' são obrigatórios", "code": 400}
+            continue
+
+        by_tenant.setdefault(tenant, []).append((index, name, item.get("job_code")))
+
+    for tenant, entries in by_tenant.items():
+        try:
+            validate_tenant_name(tenant)
+            ids = insert_job_postings(tenant, [(name, job_code) for _, name, job_code in entries])
+        except UnknownTenantError as e:
+            for index, name, job_code in entries:
+                results[index] = {"index": index, "tenant": tenant, "name": name, "error": str(e), "code": 400}
+            continue
+        except Exception as e:
+            print(f"Erro ao criar vagas do tenant {tenant}:", e)
+            for index, name, job_code in entries:
+                results[index] = {"index": index, "tenant": tenant, "name": name, "error": str(e), "code": 500}
+            continue
+
+        for (index, name, job_code), job_posting_id in zip(entries, ids):
+            results[index] = {
+                "index": index,
+                "tenant": tenant,
+                "name": name,
+                "job_code": job_code,
+                "job_posting_id": job_posting_id,
+            }
+
+    return results
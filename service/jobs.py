@@ -0,0 +1,241 @@
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from db_config import tenant_transaction
+from service import statements
+
+JOB_COLUMNS = ("job_id", "status", "attempts", "error", "created_at", "started_at", "finished_at")
+
+SAVE_JOB_SQL = statements.register("save_form_job", """
+    INSERT INTO public.form_jobs (job_id, status, attempts, error, created_at, started_at, finished_at)
+    VALUES (:job_id, :status, :attempts, :error, to_timestamp(:created_at),
+            to_timestamp(:started_at), to_timestamp(:finished_at))
+    ON CONFLICT (job_id) DO UPDATE
+    SET status = EXCLUDED.status, attempts = EXCLUDED.attempts, error = EXCLUDED.error,
+        started_at = EXCLUDED.started_at, finished_at = EXCLUDED.finished_at
+""")
+
+LOAD_JOB_SQL = statements.register("load_form_job", """
+    SELECT job_id, status, attempts, error,
+           extract(epoch FROM created_at)::float AS created_at,
+           extract(epoch FROM started_at)::float AS started_at,
+           extract(epoch FROM finished_at)::float AS finished_at
+    FROM public.form_jobs
+    WHERE job_id = :job_id
+""")
+
+PURGE_JOBS_SQL = statements.register("purge_form_jobs", """
+    DELETE FROM public.form_jobs WHERE finished_at < now() - make_interval(secs => :older_than)
+""")
+
+
+class QueueFullError(Exception):
+    """A fila atingiu o limite de jobs pendentes."""
+
+
+class RetryableJobError(Exception):
+    """O job falhou antes de qualquer efeito externo e pode ser repetido com segurança."""
+
+
+class DatabaseJobStore:
+    """
+    Estado dos jobs em public.form_jobs (sql/010_form_jobs.sql), visível a
+    todos os workers. Falhas do banco são logadas e não interrompem o job.
+    """
+
+    def save(self, job: dict):
+        try:
+            with tenant_transaction() as conn:
+                conn.execute(SAVE_JOB_SQL, {column: job[column] for column in JOB_COLUMNS})
+        except Exception as e:
+            print(f"Erro ao gravar o estado do job {job['job_id']}:", e)
+
+    def load(self, job_id: str):
+        try:
+            with tenant_transaction() as conn:
+                row = conn.execute(LOAD_JOB_SQL, {"job_id": job_id}).mappings().first()
+        except Exception as e:
+            print(f"Erro ao ler o estado do job {job_id}:", e)
+            return None
+        return dict(row) if row else None
+
+    def purge(self, older_than: float):
+        try:
+            with tenant_transaction() as conn:
+                conn.execute(PURGE_JOBS_SQL, {"older_than": older_than})
+        except Exception as e:
+            print("Erro ao limpar os jobs finalizados:", e)
+
+
+class JobQueue:
+    """
+    Fila de jobs executados em segundo plano por um pool limitado de threads.
+    Cada job é uma função que retorna True em caso de sucesso. Só falhas
+    sinalizadas com RetryableJobError são reprocessadas, com backoff
+    exponencial até o limite de tentativas; retorno falso ou qualquer outra
+    exceção encerra o job com erro, porque o efeito pode já ter acontecido
+    (ex.: o formulário foi enviado e só a confirmação falhou).
+
+    O job roda no worker que o recebeu, e max_pending vale por worker. O
+    estado fica na memória do worker e, com um `store` (ex.: DatabaseJobStore),
+    também no banco, para que get() funcione em qualquer worker. Sem store,
+    o app deve rodar com um único worker. Um job em andamento quando o worker
+    cai fica no último estado gravado.
+    """
+
+    # Intervalo mínimo (s) entre limpezas dos jobs finalizados no store
+    PURGE_INTERVAL = 60
+
+    def __init__(self, workers: int = 2, max_pending: int = 100, max_attempts: int = 3,
+                 backoff: float = 2, result_ttl: float = 3600, store=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.result_ttl = result_ttl
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._purged_at = 0.0
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0, "retried": 0, "rejected": 0}
+
+    def submit(self, fn, *args, **kwargs):
+        """Enfileira o job e retorna o seu id. Lança QueueFullError se a fila estiver cheia."""
+        with self._lock:
+            self._prune()
+            if self._pending_count() >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise QueueFullError("Fila de inscrições cheia, tente novamente mais tarde.")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "na_fila",
+                "attempts": 0,
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self.counters["submitted"] += 1
+            snapshot = dict(self._jobs[job_id])
+
+        self._save(snapshot)
+        self.purge()
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _save(self, snapshot):
+        if self.store is not None:
+            self.store.save(snapshot)
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "executando"
+            job["attempts"] += 1
+            if job["started_at"] is None:
+                job["started_at"] = time.time()
+            snapshot = dict(job)
+        self._save(snapshot)
+
+        retryable = False
+        try:
+            success = bool(fn(*args, **kwargs))
+            error = None if success else "Job retornou falha"
+        except RetryableJobError as e:
+            success = False
+            retryable = True
+            error = str(e)
+        except Exception as e:
+            success = False
+            error = str(e)
+
+        if success:
+            self._finish(job, "concluido", None)
+            return
+
+        with self._lock:
+            retry = retryable and job["attempts"] < self.max_attempts
+            if retry:
+                job["status"] = "aguardando_retentativa"
+                job["error"] = error
+                self.counters["retried"] += 1
+                delay = self.backoff * (2 ** (job["attempts"] - 1))
+                snapshot = dict(job)
+
+        if not retry:
+            self._finish(job, "erro", error)
+            return
+
+        self._save(snapshot)
+        # Reagenda sem ocupar a thread durante a espera
+        timer = threading.Timer(delay, self._executor.submit, args=(self._run, job_id, fn, args, kwargs))
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self, job, status, error):
+        with self._lock:
+            job["status"] = status
+            job["error"] = error
+            job["finished_at"] = time.time()
+            self._latencies.append(job["finished_at"] - job["created_at"])
+            self.counters["succeeded" if status == "concluido" else "failed"] += 1
+            snapshot = dict(job)
+        self._save(snapshot)
+
+    def _pending_count(self):
+        return sum(1 for job in self._jobs.values() if job["finished_at"] is None)
+
+    def _prune(self):
+        # Remove jobs finalizados há mais tempo que result_ttl
+        limit = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] < limit]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def purge(self):
+        """Remove do store os jobs finalizados há mais de result_ttl (no máximo a cada PURGE_INTERVAL)."""
+        now = time.monotonic()
+        if self.store is None or now - self._purged_at < self.PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        self.store.purge(self.result_ttl)
+
+    def get(self, job_id):
+        """
+        Retorna uma cópia do estado do job, ou None se não existir. Um job de
+        outro worker vem do store.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self.store.load(job_id) if self.store is not None else None
+
+    def stats(self):
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()]
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queued": sum(1 for job in jobs if job["status"] in ("na_fila", "aguardando_retentativa")),
+            "running": sum(1 for job in jobs if job["status"] == "executando"),
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+            **self.counters,
+        }
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from db_config import UnknownTenantError, async_validate_tenant_name, validate_tenant_name
+
+# Limites (em segundos) dos buckets de latência
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Requisições mais lentas que isso (ms) são logadas com o detalhamento dos comandos SQL; 0 desliga
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+
+
+def _escape_label_value(value):
+    # Formato texto do Prometheus: \, " e quebra de linha são escapados
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def tenant_label(tenant_name):
+    """
+    Valor do label tenant. O nome vem da requisição: só tenants válidos viram
+    label, os demais contam como "unknown" (o número de séries não cresce com
+    o que os clientes enviam).
+    """
+    if not tenant_name:
+        return ""
+    try:
+        return validate_tenant_name(tenant_name)
+    except UnknownTenantError:
+        return "unknown"
+
+
+async def async_tenant_label(tenant_name):
+    """tenant_label para o event loop."""
+    if not tenant_name:
+        return ""
+    try:
+        return await async_validate_tenant_name(tenant_name)
+    except UnknownTenantError:
+        return "unknown"
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, limit in enumerate(self.buckets):
+                if value <= limit:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                for limit, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', limit),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latência das requisições por rota e tenant",
+    ("route", "method", "status", "tenant"),
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "Comandos SQL executados por requisição",
+    ("route", "tenant"), buckets=COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Tempo total no banco por requisição",
+    ("route", "tenant"),
+)
+DB_STATEMENTS = Counter("db_statements_total", "Comandos SQL executados (inclui jobs em segundo plano)")
+DB_SECONDS = Counter("db_statement_seconds_total", "Tempo total gasto em comandos SQL")
+SELENIUM_SECONDS = Histogram(
+    "selenium_form_duration_seconds", "Tempo de preenchimento do formulário no Selenium",
+    ("result",),
+)
+
+_request_stats = ContextVar("request_stats", default=None)
+_collectors = []
+
+
+def register_collector(collector):
+    """
+    Registra uma função que devolve métricas pontuais (gauges) no formato
+    [(nome, {labels}, valor), ...], lidas a cada chamada de /metrics.
+    """
+    _collectors.append(collector)
+
+
+def install_sqlalchemy_hooks(engine):
+    """Conta os comandos SQL e o tempo no banco, por requisição e no total."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_STATEMENTS.inc()
+        DB_SECONDS.inc(elapsed)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats["statements"].append((statement, elapsed))
+
+
+def install_flask_hooks(app, tenant_resolver):
+    """Mede cada requisição; tenant_resolver(request) devolve o tenant (ou None)."""
+    from flask import request
+
+    @app.before_request
+    def _start_request_metrics():
+        request.environ["metrics.started"] = time.perf_counter()
+        request.environ["metrics.token"] = _request_stats.set({"statements": []})
+
+    @app.after_request
+    def _record_request_metrics(response):
+        started = request.environ.get("metrics.started")
+        stats = _request_stats.get()
+        if started is None or stats is None:
+            return response
+
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "desconhecida"
+        tenant = tenant_label(tenant_resolver(request))
+        db_seconds = sum(duration for _, duration in stats["statements"])
+
+        REQUEST_LATENCY.observe(elapsed, route=route, method=request.method, status=response.status_code, tenant=tenant)
+        REQUEST_DB_STATEMENTS.observe(len(stats["statements"]), route=route, tenant=tenant)
+        REQUEST_DB_SECONDS.observe(db_seconds, route=route, tenant=tenant)
+
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            print(f"🐢 Requisição lenta: {request.method} {route} tenant={tenant or '-'} "
+                  f"total={elapsed * 1000:.1f}ms db={db_seconds * 1000:.1f}ms comandos={len(stats['statements'])}")
+            for statement, duration in stats["statements"]:
+                print(f"   {duration * 1000:8.1f}ms  {' '.join(statement.split())[:160]}")
+
+        return response
+
+    @app.teardown_request
+    def _reset_request_metrics(exc):
+        token = request.environ.pop("metrics.token", None)
+        if token is not None:
+            _request_stats.reset(token)
+
+
+def render():
+    """Todas as métricas no formato texto do Prometheus."""
+    lines = []
+    for metric in (REQUEST_LATENCY, REQUEST_DB_STATEMENTS, REQUEST_DB_SECONDS, DB_STATEMENTS, DB_SECONDS, SELENIUM_SECONDS):
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        for name, labels, value in collector():
+            if value is None:
+                continue
+            lines.append(f"{name}{_format_labels(tuple(labels.items()))} {float(value)}")
+
+    return "\n".join(lines) + "\n"
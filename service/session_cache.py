@@ -0,0 +1,454 @@
+"""
+Cache write-behind das sessões em andamento (ats_chat_stage), ligado com
+SESSION_CACHE_ENABLED=true.
+
+Cada sessão ativa fica em memória com o estado já atualizado pelos turnos
+recebidos; leituras (get_chat_stage_by_id, busca por telefone) são servidas
+daqui. Os turnos não gravam no banco na hora: ficam pendentes e são gravados
+em lote a cada SESSION_CACHE_FLUSH_INTERVAL segundos, quando a sessão muda
+para um status de SESSION_CACHE_FLUSH_STATUSES (ex.: finalizada) ou quando
+ela sai do cache. A gravação reaplica os turnos pendentes por
+apply_session_updates (mesmo caminho com checagem de versão), então uma
+escrita feita por outro worker no meio tempo não é perdida; depois dela a
+sessão é relida do banco (com os turnos ainda pendentes reaplicados por cima),
+e sessões sem turnos pendentes são relidas a cada SESSION_CACHE_FLUSH_INTERVAL.
+
+Turnos que não puderem ser gravados (conflito, sessão removida, resposta
+inválida) não somem em silêncio: a próxima chamada para a sessão recebe 409.
+Requisições com chave de idempotência só têm a resposta guardada depois da
+gravação (ver idempotency.DeferredKey).
+
+Cada sessão com turnos pendentes é gravada SESSION_CACHE_FLUSH_INTERVAL
+segundos depois do primeiro deles (o gravador acorda no prazo da sessão mais
+antiga). Se o processo cair, perdem-se os turnos recebidos nesse intervalo,
+mais o tempo da própria gravação; enquanto o banco recusar as gravações, os
+turnos continuam pendentes. Com vários workers, outro worker pode ler a
+sessão do banco com até uma janela de atraso; prefira rotear o mesmo
+telefone sempre ao mesmo worker.
+"""
+import atexit
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db_config import tenant_transaction
+from service import application, form_schema, history, idempotency, statements
+
+SESSION_CACHE_ENABLED = os.environ.get("SESSION_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "5000"))
+# Sessão sem turnos pendentes e sem acesso há mais que isso (s) sai do cache
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "30"))
+SESSION_CACHE_FLUSH_INTERVAL = float(os.environ.get("SESSION_CACHE_FLUSH_INTERVAL", "1"))
+SESSION_CACHE_FLUSH_BATCH = int(os.environ.get("SESSION_CACHE_FLUSH_BATCH", "500"))
+SESSION_CACHE_FLUSH_STATUSES = {
+    status.strip() for status in os.environ.get("SESSION_CACHE_FLUSH_STATUSES", "finalizada").split(",") if status.strip()
+}
+
+SELECT_CHAT_STAGES_FULL_SQL = statements.register("select_chat_stages_full", """
+    SELECT * FROM public.ats_chat_stage WHERE id = ANY(:ids)
+""")
+
+
+class _Entry:
+    __slots__ = ("row", "pending", "times", "keys", "dirty_since", "last_access", "loaded_at")
+
+    def __init__(self, row):
+        self.row = row
+        # Turnos ainda não gravados, com o horário e a chave de idempotência de cada um
+        self.pending = []
+        self.times = []
+        self.keys = []
+        self.dirty_since = None
+        self.last_access = self.loaded_at = time.monotonic()
+
+
+def _project(row, columns=None):
+    """
+    Cópia da sessão para quem chamou, só com as colunas pedidas: a cópia é
+    profunda (quem chamou pode alterar o context), mas a conversation, a maior
+    parte da linha, só é copiada quando foi pedida.
+    """
+    if columns is None:
+        return copy.deepcopy(row)
+    return {column: copy.deepcopy(row[column]) for column in columns if column in row}
+
+
+def _apply_outcome(row, outcome):
+    """Aplica ao estado em memória o resultado de application._apply_stage_turns."""
+    if outcome["context"] is not None:
+        row["context"] = outcome["context"]
+    row["status"] = outcome["status"]
+    row["conversation"].extend(outcome["messages"])
+
+
+class SessionCache:
+    def __init__(self, maxsize: int, ttl: float, flush_interval: float, flush_statuses: set, flush_batch: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_statuses = flush_statuses
+        self.flush_batch = flush_batch
+
+        self._entries = OrderedDict()
+        # Sessões com turnos que falharam na gravação: erro devolvido na próxima chamada
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+        # Uma gravação por vez, para que os turnos de uma sessão cheguem ao banco na ordem
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_turns = 0
+        self.flush_failures = 0
+
+    # --- leitura ---
+
+    def _load(self, chat_stage_ids):
+        with tenant_transaction() as conn:
+            rows = conn.execute(SELECT_CHAT_STAGES_FULL_SQL, {"ids": list(chat_stage_ids)}).mappings().all()
+        return {row["id"]: application._chat_stage_row(row) for row in rows}
+
+    def _fresh(self, entry, now):
+        """Entrada que pode ser servida da memória: tem turnos pendentes ou foi lida há pouco."""
+        return entry.pending or now - entry.loaded_at < self.flush_interval
+
+    def _store(self, loaded):
+        """Guarda (ou atualiza) as sessões lidas do banco; chamado com o lock."""
+        for chat_stage_id, row in loaded.items():
+            entry = self._entries.get(chat_stage_id)
+            if entry is None:
+                self._entries[chat_stage_id] = _Entry(row)
+            elif not entry.pending:
+                entry.row, entry.loaded_at = row, time.monotonic()
+
+    def get(self, chat_stage_id, columns=None):
+        """Sessão atual (ou só as colunas pedidas), da memória ou do banco; None se não existe."""
+        with self._lock:
+            entry = self._entries.get(chat_stage_id)
+            if entry is not None and self._fresh(entry, time.monotonic()):
+                self.hits += 1
+                self._touch(chat_stage_id, entry)
+                return _project(entry.row, columns)
+            self.misses += 1
+
+        row = self._load([chat_stage_id]).get(chat_stage_id)
+        if row is None:
+            with self._lock:
+                entry = self._entries.get(chat_stage_id)
+                if entry is not None and not entry.pending:
+                    del self._entries[chat_stage_id]
+            return None
+
+        self._ensure_flusher()
+        with self._lock:
+            self._store({chat_stage_id: row})
+            entry = self._entries[chat_stage_id]
+            self._touch(chat_stage_id, entry)
+            result = _project(entry.row, columns)
+            evicted = self._evict_over_limit()
+        self._flush_entries(evicted)
+        return result
+
+    def overlay(self, sessions):
+        """Troca as sessões que estão no cache pela versão em memória (mais recente)."""
+        with self._lock:
+            return [
+                _project(self._entries[session["id"]].row, tuple(session)) if session["id"] in self._entries else session
+                for session in sessions
+            ]
+
+    # --- escrita ---
+
+    def apply(self, items: list):
+        """
+        Mesmo contrato de application.apply_session_updates, mas aplica os
+        turnos ao estado em memória e só agenda a gravação no banco.
+        """
+        now = datetime.utcnow()
+        times = [now] * len(items)
+        results, groups = application.group_session_items(items)
+
+        if not groups:
+            return results
+
+        self._ensure_flusher()
+
+        with self._lock:
+            checked = time.monotonic()
+            missing = [
+                chat_stage_id for chat_stage_id in groups
+                if chat_stage_id not in self._entries or not self._fresh(self._entries[chat_stage_id], checked)
+            ]
+        loaded = self._load(missing) if missing else {}
+
+        flush_now = []
+        missing_schemas = []
+        with self._lock:
+            self._store(loaded)
+
+            for chat_stage_id, indexes in groups.items():
+                entry = self._entries.get(chat_stage_id)
+                if entry is None:
+                    for index in indexes:
+                        results[index] = {"chat_stage_id": chat_stage_id, "error": "Registro não encontrado", "code": 404}
+                    continue
+
+                failure = self._failed.pop(chat_stage_id, None)
+                if failure is not None:
+                    # Turnos anteriores, já respondidos com sucesso, não foram gravados
+                    for index in indexes:
+                        results[index] = {
+                            "chat_stage_id": chat_stage_id,
+                            "error": f"Turnos anteriores da sessão não foram gravados ({failure}); releia a sessão",
+                            "code": 409,
+                        }
+                    continue
+
+                self._touch(chat_stage_id, entry)
+                schema = application.stage_form_schema(entry.row)
+                if schema is None:
+                    missing_schemas.append((entry.row.get("tenant_name"), entry.row.get("job_posting_id")))
+                outcome = application._apply_stage_turns(entry.row, items, indexes, times, schema)
+                for index, result in outcome["results"].items():
+                    results[index] = result
+                if not outcome["messages"]:
+                    continue
+
+                previous_status = entry.row["status"]
+                _apply_outcome(entry.row, outcome)
+
+                applied = [index for index in indexes if "error" not in results[index]]
+                entry.pending.extend(items[index] for index in applied)
+                entry.times.extend(times[index] for index in applied)
+                entry.keys.extend(idempotency.defer_current_key() for _ in applied)
+                if entry.dirty_since is None:
+                    entry.dirty_since = time.monotonic()
+
+                if outcome["status"] != previous_status and outcome["status"] in self.flush_statuses:
+                    flush_now.append(chat_stage_id)
+
+            evicted = self._evict_over_limit()
+
+        if flush_now:
+            self.flush(flush_now)
+        self._flush_entries(evicted)
+        form_schema.warm_form_schemas(missing_schemas)
+        return results
+
+    def flush(self, chat_stage_ids=None):
+        """Grava os turnos pendentes das sessões informadas (ou de todas)."""
+        with self._lock:
+            ids = list(self._entries) if chat_stage_ids is None else chat_stage_ids
+            entries = [(chat_stage_id, self._entries[chat_stage_id]) for chat_stage_id in ids if chat_stage_id in self._entries]
+        self._flush_entries(entries)
+
+    def _flush_entries(self, entries):
+        """entries: lista de (chat_stage_id, _Entry), no cache ou já removidas dele."""
+        for start in range(0, len(entries), self.flush_batch):
+            self._flush_batch(entries[start:start + self.flush_batch])
+
+    def _flush_batch(self, entries):
+        with self._flush_lock:
+            with self._lock:
+                batch = []
+                for chat_stage_id, entry in entries:
+                    if entry.pending:
+                        batch.append((chat_stage_id, entry, entry.pending, entry.times, entry.keys))
+                        entry.pending, entry.times, entry.keys, entry.dirty_since = [], [], [], None
+            if not batch:
+                return
+
+            items = [item for _, _, pending, _, _ in batch for item in pending]
+            times = [moment for _, _, _, pending_times, _ in batch for moment in pending_times]
+            keys = [key for _, _, _, _, pending_keys in batch for key in pending_keys]
+
+            try:
+                results = application.apply_session_updates(items, received_at=times)
+            except Exception as e:
+                print("Erro ao gravar sessões do cache, nova tentativa no próximo ciclo:", e)
+                with self._lock:
+                    self.flush_failures += len(items)
+                    for chat_stage_id, entry, pending, pending_times, pending_keys in batch:
+                        entry.pending = pending + entry.pending
+                        entry.times = pending_times + entry.times
+                        entry.keys = pending_keys + entry.keys
+                        entry.dirty_since = entry.dirty_since or time.monotonic()
+                        # Sessão removida do cache antes da falha volta para não perder os turnos
+                        self._entries.setdefault(chat_stage_id, entry)
+                return
+
+            for key, result in zip(keys, results):
+                if key is not None:
+                    key.resolve("error" not in result)
+
+            # O banco pode ter gravações de outros workers (e do n8n): relê as sessões
+            flushed = [chat_stage_id for chat_stage_id, *_ in batch]
+            try:
+                loaded = self._load(flushed)
+            except Exception as e:
+                print("Erro ao reler sessões gravadas pelo cache:", e)
+                loaded = None
+
+            with self._lock:
+                self.flushes += 1
+                self.flushed_turns += len(items)
+                for result in results:
+                    if "error" not in result:
+                        continue
+                    self.flush_failures += 1
+                    chat_stage_id = result.get("chat_stage_id")
+                    print(f"⚠️ Turno da sessão {chat_stage_id} não pôde ser gravado: {result['error']}")
+                    self._failed[chat_stage_id] = result["error"]
+                    self._failed.move_to_end(chat_stage_id)
+                while len(self._failed) > self.maxsize:
+                    self._failed.popitem(last=False)
+
+                for chat_stage_id in flushed:
+                    entry = self._entries.get(chat_stage_id)
+                    if entry is None:
+                        continue
+                    if loaded is None:
+                        # Sem releitura, a próxima leitura vai ao banco
+                        entry.loaded_at = float("-inf")
+                    elif chat_stage_id not in loaded:
+                        if not entry.pending:
+                            del self._entries[chat_stage_id]
+                    else:
+                        self._rebase(entry, loaded[chat_stage_id])
+
+    def _rebase(self, entry, row):
+        """Troca o estado da entrada pelo lido do banco, reaplicando os turnos ainda pendentes."""
+        if entry.pending:
+            outcome = application._apply_stage_turns(
+                row, entry.pending, range(len(entry.pending)), entry.times, application.stage_form_schema(row)
+            )
+            _apply_outcome(row, outcome)
+        entry.row, entry.loaded_at = row, time.monotonic()
+
+    # --- manutenção ---
+
+    def _touch(self, chat_stage_id, entry):
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(chat_stage_id)
+
+    def _evict_over_limit(self):
+        """Remove as sessões menos usadas acima do limite; retorna as que ainda precisam ser gravadas."""
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            chat_stage_id, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            if entry.pending:
+                evicted.append((chat_stage_id, entry))
+        return evicted
+
+    def _ensure_flusher(self):
+        # A thread é criada no primeiro uso, já dentro do worker (depois do fork do gunicorn)
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, name="session-cache-flusher", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self._next_tick()):
+            try:
+                self._tick()
+            except Exception as e:
+                print("Erro no ciclo do cache de sessões:", e)
+
+    def _next_tick(self):
+        """
+        Espera (s) até o prazo da sessão pendente mais antiga, ou uma janela
+        inteira se não há nenhuma: uma sessão que fique pendente durante a
+        espera vence depois dela.
+        """
+        with self._lock:
+            oldest = min(
+                (entry.dirty_since for entry in self._entries.values() if entry.pending and entry.dirty_since is not None),
+                default=None,
+            )
+        if oldest is None:
+            return self.flush_interval
+        return min(self.flush_interval, max(0.0, oldest + self.flush_interval - time.monotonic()))
+
+    def _tick(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                (chat_stage_id, entry) for chat_stage_id, entry in self._entries.items()
+                if entry.pending and entry.dirty_since is not None and now - entry.dirty_since >= self.flush_interval
+            ]
+            for chat_stage_id in [
+                chat_stage_id for chat_stage_id, entry in self._entries.items()
+                if not entry.pending and now - entry.last_access > self.ttl
+            ]:
+                del self._entries[chat_stage_id]
+                self.evictions += 1
+        self._flush_entries(due)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "dirty": sum(1 for entry in self._entries.values() if entry.pending),
+                "pending_turns": sum(len(entry.pending) for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "flushes": self.flushes,
+                "flushed_turns": self.flushed_turns,
+                "flush_failures": self.flush_failures,
+                "failed_sessions": len(self._failed),
+            }
+
+
+session_cache = SessionCache(
+    maxsize=SESSION_CACHE_SIZE,
+    ttl=SESSION_CACHE_TTL,
+    flush_interval=SESSION_CACHE_FLUSH_INTERVAL,
+    flush_statuses=SESSION_CACHE_FLUSH_STATUSES,
+    flush_batch=SESSION_CACHE_FLUSH_BATCH,
+)
+
+if SESSION_CACHE_ENABLED:
+    # Desligamento normal do worker grava o que estiver pendente
+    atexit.register(session_cache.flush)
+
+
+def apply_session_updates(items: list):
+    if SESSION_CACHE_ENABLED:
+        return session_cache.apply(items)
+    return application.apply_session_updates(items)
+
+
+def get_chat_stage_by_id(chat_stage_id, columns=None):
+    if SESSION_CACHE_ENABLED:
+        return session_cache.get(int(chat_stage_id), columns)
+    return application.get_chat_stage_by_id(chat_stage_id, columns=columns)
+
+
+def get_active_sessions_by_phone(phone: str):
+    sessions = application.get_active_sessions_by_phone(phone)
+    if SESSION_CACHE_ENABLED:
+        return session_cache.overlay(sessions)
+    return sessions
+
+
+def get_chat_messages(chat_stage_id, limit=50, before=None):
+    if SESSION_CACHE_ENABLED:
+        # Turnos ainda pendentes entram na página
+        session_cache.flush([int(chat_stage_id)])
+    return history.get_chat_messages(int(chat_stage_id), limit, before)
+
+
+def session_cache_stats():
+    return {"enabled": int(SESSION_CACHE_ENABLED), **session_cache.stats()}
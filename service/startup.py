@@ -0,0 +1,58 @@
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Marca o início do carregamento do processo (primeiro import deste módulo)
+_started = time.perf_counter()
+_ready = None
+_imports = {}
+_lazy_imports = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def timed(name: str):
+    """Mede o tempo de um bloco de imports da subida e registra com o nome informado."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _imports[name] = time.perf_counter() - start
+
+
+def lazy_import(module_name: str):
+    """
+    Importa o módulo apenas no primeiro uso, registrando quanto tempo levou.
+    Nas chamadas seguintes devolve o módulo já carregado.
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+
+    with _lock:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _lazy_imports.setdefault(module_name, time.perf_counter() - start)
+    return module
+
+
+def mark_ready():
+    """Registra o fim da subida da aplicação."""
+    global _ready
+    _ready = time.perf_counter() - _started
+    return _ready
+
+
+def report():
+    """Tempos da subida (imports por módulo) e dos imports feitos sob demanda."""
+    def rounded(timings):
+        ordered = sorted(timings.items(), key=lambda item: item[1], reverse=True)
+        return {name: round(seconds, 4) for name, seconds in ordered}
+
+    return {
+        "startup_seconds": round(_ready, 4) if _ready is not None else None,
+        "imports": rounded(_imports),
+        "lazy_imports": rounded(_lazy_imports),
+    }
@@ -0,0 +1,64 @@
+"""
+Registro dos comandos SQL da aplicação. Como o schema do tenant vem do
+search_path (ver db_config.tenant_transaction), o texto de cada comando é o
+mesmo para todos os tenants: o text() é montado uma única vez e reaproveitado,
+e o cache de compilação do SQLAlchemy acerta sempre.
+"""
+import os
+from functools import lru_cache
+
+from sqlalchemy import text
+
+# Quantos formatos de INSERT com várias linhas (tabela, colunas, nº de linhas) ficam em cache
+SQL_STATEMENT_CACHE_SIZE = int(os.environ.get("SQL_STATEMENT_CACHE_SIZE", "256"))
+
+_registry = {}
+
+
+def register(name: str, sql: str):
+    """Monta o comando uma vez e o guarda pelo nome; retorna o text() pronto."""
+    if name in _registry:
+        raise ValueError(f"Comando SQL já registrado: {name}")
+    _registry[name] = text(sql)
+    return _registry[name]
+
+
+def get(name: str):
+    return _registry[name]
+
+
+@lru_cache(maxsize=SQL_STATEMENT_CACHE_SIZE)
+def multi_row_insert(table: str, columns: tuple, rows: int, returning: str = None):
+    """
+    INSERT com `rows` linhas em VALUES e parâmetros :coluna_0, :coluna_1, ...
+    (ver multi_row_params). Os nomes de tabela e colunas vêm sempre do código,
+    nunca da requisição.
+    """
+    values = ",\n".join(
+        "(" + ", ".join(f":{column}_{i}" for column in columns) + ")"
+        for i in range(rows)
+    )
+    sql = f"INSERT INTO {table}\n({', '.join(columns)})\nVALUES {values}"
+    if returning:
+        sql += f"\nRETURNING {returning}"
+    return text(sql)
+
+
+def multi_row_params(rows: list, columns: tuple):
+    """Parâmetros de multi_row_insert para a lista de dicts informada."""
+    params = {}
+    for i, row in enumerate(rows):
+        for column in columns:
+            params[f"{column}_{i}"] = row[column]
+    return params
+
+
+def statement_stats():
+    info = multi_row_insert.cache_info()
+    return {
+        "registered": len(_registry),
+        "multi_row_cached": info.currsize,
+        "multi_row_maxsize": info.maxsize,
+        "multi_row_hits": info.hits,
+        "multi_row_misses": info.misses,
+    }
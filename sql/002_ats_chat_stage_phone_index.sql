@@ -0,0 +1,9 @@
+-- Index: idx_chat_stage_phone_job_updated
+-- Busca da sessão ativa por telefone (GET /session/active): a sessão mais
+-- recente de cada vaga sai direto do índice, sem varrer nem ordenar a tabela.
+-- Em produção, prefira criar com CREATE INDEX CONCURRENTLY fora de transação.
+
+CREATE INDEX IF NOT EXISTS idx_chat_stage_phone_job_updated
+    ON public.ats_chat_stage USING btree
+    (candidate_phone_number_id, job_posting_id, updated_at DESC)
+    TABLESPACE pg_default;
@@ -0,0 +1,26 @@
+-- Column: public.ats_chat_stage.version
+-- Versão da sessão para concorrência otimista: cada gravação incrementa a
+-- versão e só é aplicada se a versão lida ainda for a atual.
+
+ALTER TABLE IF EXISTS public.ats_chat_stage
+    ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 0;
+
+-- O incremento fica num trigger, e não nos UPDATEs da API: os nós do n8n
+-- (update_*_conversation, update_finish_status) gravam a tabela direto e
+-- também precisam invalidar a versão lida por uma execução concorrente.
+CREATE OR REPLACE FUNCTION public.ats_chat_stage_bump_version()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS ats_chat_stage_bump_version ON public.ats_chat_stage;
+
+CREATE TRIGGER ats_chat_stage_bump_version
+    BEFORE UPDATE ON public.ats_chat_stage
+    FOR EACH ROW
+    EXECUTE FUNCTION public.ats_chat_stage_bump_version();
@@ -0,0 +1,24 @@
+-- Table: public.api_idempotency
+-- Chaves de idempotência dos endpoints chamados pelo n8n/Evolution API: a
+-- primeira requisição com a chave reserva a linha (status 'processando') e,
+-- ao terminar, grava a resposta; as repetições recebem a resposta guardada.
+
+CREATE TABLE IF NOT EXISTS public.api_idempotency
+(
+    scope character varying(50) COLLATE pg_catalog."default" NOT NULL,
+    idempotency_key character varying(255) COLLATE pg_catalog."default" NOT NULL,
+    status character varying(20) COLLATE pg_catalog."default" NOT NULL DEFAULT 'processando',
+    response_code integer,
+    response_body jsonb,
+    created_at timestamp without time zone NOT NULL DEFAULT now(),
+    updated_at timestamp without time zone NOT NULL DEFAULT now(),
+    CONSTRAINT api_idempotency_pkey PRIMARY KEY (scope, idempotency_key)
+)
+
+TABLESPACE pg_default;
+
+-- Limpeza periódica das chaves antigas (purge_idempotency_keys)
+CREATE INDEX IF NOT EXISTS idx_api_idempotency_created_at
+    ON public.api_idempotency USING btree
+    (created_at)
+    TABLESPACE pg_default;
@@ -0,0 +1,20 @@
+-- Índices de busca do candidato no schema do tenant ({tenant} é substituído
+-- pelo nome do schema; aplicar uma vez por tenant).
+-- create_application procura o candidato pelo CPF, e-mail e telefone
+-- normalizados; as expressões abaixo são as mesmas usadas na consulta, então
+-- a busca continua indexada mesmo para linhas antigas gravadas com máscara
+-- ou e-mail em maiúsculas. Em tabelas grandes, prefira criar os índices
+-- com CREATE INDEX CONCURRENTLY fora de uma transação.
+
+CREATE INDEX IF NOT EXISTS idx_candidate_cpf_normalized
+    ON "{tenant}".ats_candidate USING btree
+    (regexp_replace(cpf, '\D', '', 'g'))
+    WHERE cpf IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_candidate_email_lower
+    ON "{tenant}".ats_candidate USING btree
+    (lower(email));
+
+CREATE INDEX IF NOT EXISTS idx_candidatephonecontact_number_normalized
+    ON "{tenant}".ats_candidatephonecontact USING btree
+    (regexp_replace("number", '\D', '', 'g'), candidate_id);
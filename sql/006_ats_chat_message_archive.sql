@@ -0,0 +1,23 @@
+-- Table: public.ats_chat_message_archive
+-- Histórico frio das conversas: mensagens antigas ou de sessões finalizadas
+-- saem de ats_chat_stage.conversation e são gravadas aqui em blocos (JSON
+-- comprimido com zlib), em ordem de chunk_seq.
+-- Ver service/history.py (compact_chat_stage e get_chat_messages).
+
+CREATE TABLE IF NOT EXISTS public.ats_chat_message_archive
+(
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    chat_stage_id integer NOT NULL,
+    chunk_seq integer NOT NULL,
+    message_count integer NOT NULL,
+    first_at character varying(40) COLLATE pg_catalog."default",
+    last_at character varying(40) COLLATE pg_catalog."default",
+    payload bytea NOT NULL,
+    created_at timestamp without time zone NOT NULL DEFAULT now(),
+    CONSTRAINT ats_chat_message_archive_pkey PRIMARY KEY (id),
+    CONSTRAINT ats_chat_message_archive_chunk_key UNIQUE (chat_stage_id, chunk_seq),
+    CONSTRAINT ats_chat_message_archive_chat_stage_fk FOREIGN KEY (chat_stage_id)
+        REFERENCES public.ats_chat_stage (id) ON DELETE CASCADE
+)
+
+TABLESPACE pg_default;
@@ -0,0 +1,21 @@
+-- Índices da exportação de inscrições por vaga (service/export.py) no schema
+-- do tenant ({tenant} é substituído pelo nome do schema; aplicar uma vez por
+-- tenant). A exportação percorre os processos da vaga em ordem de id,
+-- filtrando por created_at ou updated_at (puxadas incrementais), e busca as
+-- respostas de cada processo.
+
+CREATE INDEX IF NOT EXISTS idx_recruitmentprocess_job_posting
+    ON "{tenant}".ats_recruitmentprocess USING btree
+    (job_posting_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_recruitmentprocess_job_posting_updated
+    ON "{tenant}".ats_recruitmentprocess USING btree
+    (job_posting_id, updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_answertext_recruitment_process
+    ON "{tenant}".ats_answertext USING btree
+    (recruitment_process_id);
+
+CREATE INDEX IF NOT EXISTS idx_answeralternative_recruitment_process
+    ON "{tenant}".ats_answeralternative USING btree
+    (recruitment_process_id);
@@ -0,0 +1,102 @@
+-- Columns: public.ats_chat_stage.hot_messages / archived_messages / archived_through
+-- Suporte à compactação do histórico (service/history.py):
+--   hot_messages: mensagens na coluna conversation, mantido pelo trigger
+--     abaixo; a busca de sessões a compactar usa os índices parciais sobre ele
+--     em vez de calcular o tamanho da conversation de todas as linhas.
+--   archived_messages: mensagens já movidas para ats_chat_message_archive. A
+--     posição de uma mensagem no histórico (archived_messages + posição na
+--     coluna) não muda quando ela é arquivada; é o cursor da paginação.
+--   archived_through: última mensagem arquivada. Os nós do n8n leem a
+--     conversation e a regravam inteira; se a leitura foi anterior a uma
+--     compactação, a gravação traria de volta as mensagens já arquivadas. O
+--     trigger descarta tudo até archived_through antes de gravar.
+
+ALTER TABLE IF EXISTS public.ats_chat_stage
+    ADD COLUMN IF NOT EXISTS hot_messages integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS archived_messages integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS archived_through jsonb;
+
+UPDATE public.ats_chat_stage
+SET hot_messages = CASE WHEN jsonb_typeof(conversation) = 'array' THEN jsonb_array_length(conversation) ELSE 0 END
+WHERE hot_messages = 0 AND jsonb_typeof(conversation) = 'array' AND jsonb_array_length(conversation) > 0;
+
+-- Sessões arquivadas antes desta migração ficam sem archived_through até a
+-- próxima compactação (o bloco arquivado não é legível em SQL)
+UPDATE public.ats_chat_stage s
+SET archived_messages = archived.total
+FROM (
+    SELECT chat_stage_id, sum(message_count) AS total
+    FROM public.ats_chat_message_archive
+    GROUP BY chat_stage_id
+) archived
+WHERE archived.chat_stage_id = s.id AND s.archived_messages <> archived.total;
+
+CREATE OR REPLACE FUNCTION public.ats_chat_stage_conversation_guard()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+DECLARE
+    cut bigint;
+BEGIN
+    IF jsonb_typeof(NEW.conversation) IS DISTINCT FROM 'array' THEN
+        NEW.hot_messages := 0;
+        RETURN NEW;
+    END IF;
+
+    NEW.hot_messages := jsonb_array_length(NEW.conversation);
+
+    -- Nada arquivado ainda (a maioria das sessões), ou a própria compactação,
+    -- que troca archived_through: não há o que cortar
+    IF TG_OP = 'INSERT' OR NEW.archived_through IS NULL
+       OR NEW.archived_through IS DISTINCT FROM OLD.archived_through THEN
+        RETURN NEW;
+    END IF;
+
+    -- Acréscimos da API e regravações do n8n feitas a partir da coluna atual
+    -- começam pela mesma mensagem; só uma leitura anterior à compactação
+    -- começa por uma mensagem arquivada. Assim a varredura abaixo só roda
+    -- nas gravações que de fato trazem o arquivo de volta.
+    IF NEW.conversation->0 IS NOT DISTINCT FROM OLD.conversation->0 THEN
+        RETURN NEW;
+    END IF;
+
+    SELECT max(e.position) INTO cut
+    FROM jsonb_array_elements(NEW.conversation) WITH ORDINALITY AS e(message, position)
+    WHERE e.message = NEW.archived_through;
+
+    IF cut IS NOT NULL THEN
+        NEW.conversation := COALESCE((
+            SELECT jsonb_agg(e.message ORDER BY e.position)
+            FROM jsonb_array_elements(NEW.conversation) WITH ORDINALITY AS e(message, position)
+            WHERE e.position > cut
+        ), '[]'::jsonb);
+        NEW.hot_messages := jsonb_array_length(NEW.conversation);
+    END IF;
+
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS ats_chat_stage_conversation_guard ON public.ats_chat_stage;
+
+CREATE TRIGGER ats_chat_stage_conversation_guard
+    BEFORE INSERT OR UPDATE OF conversation ON public.ats_chat_stage
+    FOR EACH ROW
+    EXECUTE FUNCTION public.ats_chat_stage_conversation_guard();
+
+-- Índices parciais: só as sessões com histórico quente entram; as finalizadas
+-- saem deles quando são compactadas
+CREATE INDEX IF NOT EXISTS idx_chat_stage_hot_messages
+    ON public.ats_chat_stage USING btree
+    (hot_messages)
+    WHERE hot_messages > 0;
+
+CREATE INDEX IF NOT EXISTS idx_chat_stage_hot_updated
+    ON public.ats_chat_stage USING btree
+    (updated_at)
+    WHERE hot_messages > 0;
+
+CREATE INDEX IF NOT EXISTS idx_chat_stage_hot_finished
+    ON public.ats_chat_stage USING btree
+    (id)
+    WHERE hot_messages > 0 AND (status = 'finalizada' OR interaction = 'finalizado');
@@ -0,0 +1,25 @@
+-- Table: public.form_jobs
+-- Estado dos jobs da fila de inscrições finais (/inscricaofinal, service/jobs.py).
+-- O job roda no worker que o recebeu, mas o estado fica aqui: a consulta
+-- GET /inscricaofinal/<job_id> pode cair em qualquer worker.
+
+CREATE TABLE IF NOT EXISTS public.form_jobs
+(
+    job_id character varying(32) COLLATE pg_catalog."default" NOT NULL,
+    status character varying(30) COLLATE pg_catalog."default" NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    error text COLLATE pg_catalog."default",
+    created_at timestamp with time zone NOT NULL,
+    started_at timestamp with time zone,
+    finished_at timestamp with time zone,
+    CONSTRAINT form_jobs_pkey PRIMARY KEY (job_id)
+)
+
+TABLESPACE pg_default;
+
+-- Limpeza dos jobs finalizados (JobQueue.result_ttl)
+CREATE INDEX IF NOT EXISTS idx_form_jobs_finished_at
+    ON public.form_jobs USING btree
+    (finished_at)
+    TABLESPACE pg_default
+    WHERE finished_at IS NOT NULL;
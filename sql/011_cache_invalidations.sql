@@ -0,0 +1,22 @@
+-- Table: public.cache_invalidations
+-- Invalidações dos caches em memória dos workers (perguntas básicas, esquema
+-- do formulário): o worker que recebe a invalidação grava uma linha aqui e os
+-- demais leem as linhas novas (id crescente) a cada CACHE_SYNC_INTERVAL
+-- segundos. Ver service/cache_sync.py.
+
+CREATE TABLE IF NOT EXISTS public.cache_invalidations
+(
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    cache character varying(50) COLLATE pg_catalog."default" NOT NULL,
+    key jsonb,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    CONSTRAINT cache_invalidations_pkey PRIMARY KEY (id)
+)
+
+TABLESPACE pg_default;
+
+-- Limpeza das invalidações antigas (CACHE_INVALIDATION_RETENTION)
+CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created_at
+    ON public.cache_invalidations USING btree
+    (created_at)
+    TABLESPACE pg_default;
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from service.admission import AdmissionController, AdmissionRejected, TokenBucket, payload_tenant
+
+
+def controller(tenant_concurrency=0, tenant_rate=0, tenant_burst=0, tenant_limits=None, route_limits=None,
+               queue_timeout=0):
+    return AdmissionController(
+        tenant_concurrency, tenant_rate, tenant_burst, tenant_limits or {}, route_limits or {}, queue_timeout, 1
+    )
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=2, burst=2, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == pytest.approx(0.5)
+    assert bucket.take(0.5) == 0
+    assert bucket.idle(100)
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_refund_is_capped():
+    bucket = TokenBucket(rate=1, burst=1, now=0)
+    bucket.take(0)
+    bucket.refund()
+    bucket.refund()
+    assert bucket.tokens == 1
+
+
+def test_tenant_concurrency_rejects_with_429():
+    c = controller(tenant_concurrency=1)
+    ticket = c.enter("acme", "/r")
+    with pytest.raises(AdmissionRejected) as rejected:
+        c.enter("acme", "/r")
+    assert (rejected.value.status, rejected.value.scope, rejected.value.reason) == (429, "tenant", "concurrency")
+
+    # Outro tenant não é afetado
+    c.leave(c.enter("outro", "/r"))
+    c.leave(ticket)
+    c.leave(ticket)
+    assert c._inflight == {}
+
+
+def test_route_concurrency_rejects_with_503():
+    c = controller(route_limits={"/r": {"concurrency": 1}})
+    c.enter(None, "/r")
+    with pytest.raises(AdmissionRejected) as rejected:
+        c.enter("acme", "/r")
+    assert (rejected.value.status, rejected.value.scope) == (503, "route")
+
+
+def test_waits_for_a_released_slot():
+    c = controller(tenant_concurrency=1, queue_timeout=5)
+    ticket = c.enter("acme", "/r")
+    threading.Timer(0.05, c.leave, args=(ticket,)).start()
+    c.leave(c.enter("acme", "/r"))
+    assert c.shed == {}
+
+
+def test_route_rate_rejection_refunds_the_tenant_token():
+    c = controller(tenant_limits={"acme": {"rate": 0.001, "burst": 2}}, route_limits={"/r": {"rate": 0.001, "burst": 1}})
+    c.leave(c.enter("acme", "/r"))
+    with pytest.raises(AdmissionRejected) as rejected:
+        c.enter("acme", "/r")
+    assert (rejected.value.scope, rejected.value.reason) == ("route", "rate")
+    assert c._buckets[("tenant", "acme")].tokens == pytest.approx(1, abs=0.01)
+
+
+def test_try_enter_defers_without_counting_shed():
+    c = controller(tenant_concurrency=1, tenant_rate=0.001, tenant_burst=3, queue_timeout=0.01)
+    ticket = c.try_enter("acme", "/r")
+    assert ticket is not None
+    assert c.try_enter("acme", "/r") is None
+    assert c.shed == {}
+
+    with pytest.raises(AdmissionRejected):
+        c.enter("acme", "/r", wait=True, check_rates=False)
+    assert c.shed == {("tenant", "acme", "concurrency"): 1}
+    # A ficha cobrada no try_enter volta com a recusa final
+    assert c._buckets[("tenant", "acme")].tokens == pytest.approx(2, abs=0.01)
+
+
+def test_stats_format():
+    c = controller(tenant_concurrency=1)
+    c.enter("acme", "/r")
+    with pytest.raises(AdmissionRejected):
+        c.enter("acme", "/r")
+    stats = c.stats()
+    assert ("admission_admitted_total", {}, 1) in stats
+    assert ("admission_inflight", {"scope": "tenant", "key": "acme"}, 1) in stats
+    assert ("admission_shed_total", {"scope": "tenant", "key": "acme", "reason": "concurrency"}, 1) in stats
+
+
+@pytest.mark.parametrize("payload, tenant", [
+    ({"tenant_name": "acme"}, "acme"),
+    ({"tenant": "acme"}, "acme"),
+    ([{"tenant_name": "acme"}, {"tenant_name": "acme"}], "acme"),
+    ({"items": [{"tenant_name": "acme"}, {"tenant_name": "outro"}]}, None),
+    ({"items": [{"chat_stage_id": 1}]}, None),
+    (None, None),
+])
+def test_payload_tenant(payload, tenant):
+    assert payload_tenant(payload) == tenant
@@ -0,0 +1,195 @@
+import pytest
+from sqlalchemy import text
+
+from service import application
+from tests.conftest import TEST_TENANT
+
+
+def conversation(db, chat_stage_id):
+    with db.connect() as conn:
+        return conn.execute(
+            text("SELECT conversation FROM public.ats_chat_stage WHERE id = :id"), {"id": chat_stage_id}
+        ).scalar()
+
+
+def test_update_chat_stage_appends_to_the_conversation(db, chat_stage):
+    chat_stage_id = chat_stage(history=3)
+    before = conversation(db, chat_stage_id)
+
+    turn = [{"date": "2026-01-01T00:00:00Z", "from": "candidate", "message": "oi"}]
+    assert application.update_chat_stage(chat_stage_id, TEST_TENANT, turn, "em_andamento")
+
+    assert conversation(db, chat_stage_id) == before + turn
+
+
+def test_update_chat_stage_keeps_what_n8n_wrote_in_between(db, chat_stage):
+    chat_stage_id = chat_stage()
+    application.update_chat_stage(chat_stage_id, TEST_TENANT, [{"from": "candidate", "message": "1"}], "em_andamento")
+
+    # O n8n regrava a coluna inteira entre dois turnos da API
+    n8n = [{"from": "candidate", "message": "1"}, {"from": "system", "message": "n8n"}]
+    with db.begin() as conn:
+        conn.execute(text("UPDATE public.ats_chat_stage SET conversation = CAST(:c AS jsonb) WHERE id = :id"),
+                     {"c": application.codec.dumps(n8n), "id": chat_stage_id})
+
+    application.update_chat_stage(chat_stage_id, TEST_TENANT, [{"from": "candidate", "message": "2"}], "em_andamento")
+    assert conversation(db, chat_stage_id) == n8n + [{"from": "candidate", "message": "2"}]
+
+
+def test_update_chat_stage_starts_a_conversation_that_is_not_an_array(db, chat_stage):
+    chat_stage_id = chat_stage()
+    with db.begin() as conn:
+        conn.execute(text("UPDATE public.ats_chat_stage SET conversation = 'null' WHERE id = :id"), {"id": chat_stage_id})
+
+    application.update_chat_stage(chat_stage_id, TEST_TENANT, [{"from": "candidate", "message": "oi"}], "em_andamento")
+    assert conversation(db, chat_stage_id) == [{"from": "candidate", "message": "oi"}]
+
+
+def count(db, table, **where):
+    clause = " AND ".join(f"{column} = :{column}" for column in where) or "true"
+    with db.connect() as conn:
+        return conn.execute(text(f'SELECT count(*) FROM "{TEST_TENANT}".{table} WHERE {clause}'), where).scalar()
+
+
+def answered_questions(question_sequence):
+    questions = [dict(q) for q in question_sequence["steps"]["questions"] if q["type"] == "customized"]
+    for question in questions:
+        options = question["answer_options"]
+        question["user_answer"] = str(options[0]["option_id"]) if options else "Resposta"
+    return questions
+
+
+def test_create_application_registers_candidate_process_and_answers(db, job_posting_id, question_sequence):
+    answers = answered_questions(question_sequence)
+
+    result = application.create_application(
+        TEST_TENANT, job_posting_id, "Ana Souza", "ana.app@example.com", "11122233344", "5511977770001", answers
+    )
+
+    assert count(db, "ats_candidate", id=result["candidate_id"]) == 1
+    assert count(db, "ats_candidatephonecontact", candidate_id=result["candidate_id"]) == 1
+    assert count(db, "ats_recruitmentprocess", id=result["recruitment_process_id"], job_posting_id=job_posting_id) == 1
+    assert (
+        count(db, "ats_answertext", recruitment_process_id=result["recruitment_process_id"])
+        + count(db, "ats_answeralternative", recruitment_process_id=result["recruitment_process_id"])
+    ) == len(answers)
+
+
+def test_create_application_writes_nothing_when_an_answer_fails(db, job_posting_id):
+    candidates = count(db, "ats_candidate")
+    # question_id NOT NULL: o INSERT das respostas falha depois do candidato
+    answers = [{"id": None, "answer_type": "text", "user_answer": "sem questão"}]
+
+    with pytest.raises(Exception):
+        application.create_application(
+            TEST_TENANT, job_posting_id, "Bruno", "bruno.app@example.com", "22233344455", "5511977770002", answers
+        )
+
+    assert count(db, "ats_candidate") == candidates
+
+
+def version(db, chat_stage_id):
+    with db.connect() as conn:
+        return conn.execute(
+            text("SELECT version FROM public.ats_chat_stage WHERE id = :id"), {"id": chat_stage_id}
+        ).scalar()
+
+
+def turn(chat_stage_id, message):
+    return {"chat_stage_id": chat_stage_id, "tenant_name": TEST_TENANT, "interaction": "question",
+            "system_message": "Pergunta", "candidate_message": message, "status": "em_andamento"}
+
+
+def test_update_chat_stage_with_stale_version_writes_nothing(db, chat_stage):
+    chat_stage_id = chat_stage()
+    stale = version(db, chat_stage_id)
+    assert application.update_chat_stage(chat_stage_id, TEST_TENANT, [{"message": "1"}], "em_andamento")
+    conflicts = application.chat_stage_conflict_stats().get(TEST_TENANT, 0)
+
+    assert not application.update_chat_stage(
+        chat_stage_id, TEST_TENANT, [{"message": "2"}], "finalizado", expected_version=stale
+    )
+
+    assert conversation(db, chat_stage_id) == [{"message": "1"}]
+    assert application.chat_stage_conflict_stats()[TEST_TENANT] == conflicts + 1
+
+
+@pytest.fixture
+def concurrent_writer(monkeypatch):
+    """Grava na sessão logo depois de cada leitura de apply_session_updates (até `times` vezes)."""
+    select = application._select_chat_stages
+
+    def install(chat_stage_id, times):
+        writes = []
+
+        def select_then_write(conn, chat_stage_ids):
+            stages = select(conn, chat_stage_ids)
+            if len(writes) < times:
+                writes.append(f"n8n {len(writes)}")
+                with application.tenant_transaction() as other:
+                    application._write_chat_stage(other, chat_stage_id, "em_andamento", [{"message": writes[-1]}])
+            return stages
+
+        monkeypatch.setattr(application, "_select_chat_stages", select_then_write)
+        return writes
+
+    return install
+
+
+def test_apply_session_updates_retries_a_version_conflict(db, chat_stage, concurrent_writer):
+    chat_stage_id = chat_stage()
+    writes = concurrent_writer(chat_stage_id, times=1)
+    conflicts = application.chat_stage_conflict_stats().get(TEST_TENANT, 0)
+
+    results = application.apply_session_updates([turn(chat_stage_id, "resposta")])
+
+    assert results == [{"chat_stage_id": chat_stage_id, "status": "OK", "code": 200}]
+    messages = [m["message"] for m in conversation(db, chat_stage_id)]
+    # A escrita concorrente fica, e o turno é reaplicado depois dela (uma vez só)
+    assert messages == writes + ["Pergunta", "resposta"]
+    assert application.chat_stage_conflict_stats()[TEST_TENANT] == conflicts + 1
+
+
+def test_apply_session_updates_gives_up_after_the_retry_limit(db, chat_stage, concurrent_writer, monkeypatch):
+    monkeypatch.setattr(application, "CHAT_STAGE_MAX_RETRIES", 1)
+    chat_stage_id = chat_stage()
+    writes = concurrent_writer(chat_stage_id, times=10)
+
+    results = application.apply_session_updates([turn(chat_stage_id, "resposta")])
+
+    assert results[0]["code"] == 409
+    assert [m["message"] for m in conversation(db, chat_stage_id)] == writes
+
+
+def test_create_application_reuses_the_candidate_matched_by_cpf_email_or_phone(db, job_posting_id):
+    first = application.create_application(
+        TEST_TENANT, job_posting_id, "Carla", "carla.app@example.com", "333.444.555-66", "5511977770003", []
+    )
+
+    # Mesmo CPF (formatado de outro jeito), mesmo e-mail (caixa diferente), mesmo telefone
+    for email, cpf, phone in [
+        ("outro@example.com", "33344455566", "5511977770099"),
+        ("Carla.App@Example.com", "99988877766", "5511977770098"),
+        ("mais.um@example.com", "99988877700", "+55 11 97777-0003"),
+    ]:
+        again = application.create_application(TEST_TENANT, job_posting_id, "Carla", email, cpf, phone, [])
+        assert again["existing_candidate"]
+        assert again["candidate_id"] == first["candidate_id"]
+        assert again["recruitment_process_id"] != first["recruitment_process_id"]
+
+    assert count(db, "ats_candidate", id=first["candidate_id"]) == 1
+
+
+def test_concurrent_applications_of_the_same_candidate_create_one_candidate(db, job_posting_id):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def apply(i):
+        return application.create_application(
+            TEST_TENANT, job_posting_id, "Davi", f"davi{i}@example.com", "44455566677", f"55119777701{i:02}", []
+        )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(apply, range(8)))
+
+    assert len({result["candidate_id"] for result in results}) == 1
+    assert len({result["recruitment_process_id"] for result in results}) == 8
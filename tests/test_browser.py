@@ -0,0 +1,158 @@
+import os
+import shutil
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import main  # noqa: E402
+from service.browser import BrowserPool  # noqa: E402
+from service.jobs import RetryableJobError  # noqa: E402
+
+REGISTER_PAGE = (Path(__file__).parent / "fixtures" / "register_page.html").as_uri()
+
+
+class RecordingPool(BrowserPool):
+    """Guarda a URL de cada sessão antes de ela ser limpa e devolvida ao pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.released_urls = []
+
+    def _release(self, driver):
+        self.released_urls.append(driver.current_url)
+        super()._release(driver)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    driver_path = os.environ.get("CHROMEDRIVER_PATH") or shutil.which("chromedriver")
+    if not driver_path:
+        pytest.skip("chromedriver não encontrado (defina CHROMEDRIVER_PATH)")
+
+    pool = RecordingPool(size=1, max_uses=10, acquire_timeout=5, driver_path=driver_path)
+    try:
+        pool.warm_up(1)
+    except Exception as e:
+        pytest.skip(f"Chrome indisponível: {e}")
+
+    yield pool
+
+    while not pool._idle.empty():
+        pool._discard(pool._idle.get_nowait())
+
+
+@pytest.fixture
+def form(pool, monkeypatch):
+    monkeypatch.setattr(main, "browser_pool", pool)
+    monkeypatch.setattr(main, "FORM_TIMEOUT", 5)
+    pool.released_urls.clear()
+    return pool
+
+
+def submitted(url):
+    return {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+
+
+def test_preencher_formulario_envia_os_dados(form):
+    assert main.preencher_formulario(
+        "Ana Souza", "ana@example.com", "11999990000", "01/02/1990", "12345678900", "LinkedIn", url=REGISTER_PAGE
+    )
+
+    assert submitted(form.released_urls[-1]) == {
+        "name": "Ana Souza",
+        "email": "ana@example.com",
+        "candidatePhoneNumbers_0_phoneNumber": "11999990000",
+        "birthday": "01/02/1990",
+        "candidateCPF": "12345678900",
+        "source": "LinkedIn",
+    }
+
+
+def test_sessao_reaproveitada_e_limpa(form):
+    created = form.stats()["created"]
+
+    for nome in ("Bruno", "Carla"):
+        assert main.preencher_formulario(
+            nome, f"{nome.lower()}@example.com", "11999990000", "01/02/1990", "12345678900", "Instagram",
+            url=REGISTER_PAGE,
+        )
+
+    stats = form.stats()
+    assert stats["created"] == created
+    assert stats["reused"] >= 2
+    assert submitted(form.released_urls[-1])["name"] == "Carla"
+
+    # A sessão volta ao pool sem a página do candidato anterior
+    with form.session() as driver:
+        assert driver.current_url == "about:blank"
+
+
+def test_origem_inexistente_falha_antes_do_envio_sem_travar_o_pool(form):
+    with pytest.raises(RetryableJobError):
+        main.preencher_formulario(
+            "Davi", "davi@example.com", "11999990000", "01/02/1990", "12345678900", "Jornal", url=REGISTER_PAGE
+        )
+    assert form.stats()["open"] == 1
+    assert form.check_health()["idle"] == 1
+
+
+def test_erro_de_validacao_depois_do_envio_nao_e_repetido(form):
+    # O clique já foi feito: a falha é definitiva, sem RetryableJobError
+    assert main.preencher_formulario(
+        "Elisa", "elisa@example.com", "11999990000", "01/02/1990", "00000000000", "LinkedIn", url=REGISTER_PAGE
+    ) is False
+
+
+class FakeDriver:
+    def execute_script(self, script):
+        return 1
+
+    def delete_all_cookies(self):
+        pass
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        pass
+
+
+class FakePool(BrowserPool):
+    """Pool sem Chrome, para exercitar só a contabilidade de vagas."""
+
+    def _open_driver(self):
+        return FakeDriver()
+
+
+def test_descarte_acorda_quem_espera_por_vaga():
+    import threading
+
+    pool = FakePool(size=1, max_uses=1, acquire_timeout=5, driver_path="fake")
+    pool.ACQUIRE_POLL_INTERVAL = 0.05
+    held = pool._acquire()
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool._acquire()))
+    waiter.start()
+
+    # max_uses=1: a devolução descarta a sessão em vez de recolocá-la na fila
+    pool._release(held)
+    waiter.join(timeout=2)
+
+    assert not waiter.is_alive()
+    assert acquired and acquired[0] is not held
+    assert pool.stats()["open"] == 1
+    assert pool.stats_counters["timeouts"] == 0
+
+
+def test_acquire_respeita_o_timeout_total():
+    pool = FakePool(size=1, acquire_timeout=0.2, driver_path="fake")
+    pool.ACQUIRE_POLL_INTERVAL = 0.05
+    pool._acquire()
+
+    with pytest.raises(RuntimeError):
+        pool._acquire()
+    assert pool.stats_counters["timeouts"] == 1
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+from service import cache
+from service.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Relógio controlado pelo teste no lugar de time.monotonic."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_get_set_and_stats(clock):
+    c = TTLCache(maxsize=2, ttl=10)
+    assert c.get("a") is None
+    c.set("a", 1)
+    assert c.get("a") == 1
+    assert c.get("b", "padrão") == "padrão"
+    assert c.stats() == {"size": 1, "maxsize": 2, "ttl": 10, "hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_expired_items_are_misses(clock):
+    c = TTLCache(maxsize=2, ttl=10)
+    c.set("a", 1)
+    clock.value += 10.5
+    assert c.get("a") is None
+    assert c.stats()["size"] == 0
+
+
+def test_evicts_least_recently_used(clock):
+    c = TTLCache(maxsize=2, ttl=10)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+    assert c.evictions == 1
+
+
+def test_falsy_values_are_cached(clock):
+    c = TTLCache()
+    c.set("vazio", [])
+    assert c.get("vazio", "ausente") == []
+
+
+def test_pop_does_not_count_and_ignores_expired(clock):
+    c = TTLCache(ttl=10)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.pop("a") == 1
+    assert c.pop("a", "ausente") == "ausente"
+    clock.value += 11
+    assert c.pop("b") is None
+    assert (c.hits, c.misses) == (0, 0)
+
+
+def test_invalidate_key_or_all(clock):
+    c = TTLCache()
+    c.set("a", 1)
+    c.set("b", 2)
+    c.set("c", 3)
+    assert c.invalidate("a") == 1
+    assert c.invalidate("a") == 0
+    assert c.invalidate() == 2
+    assert c.stats()["size"] == 0
@@ -0,0 +1,48 @@
+import pytest
+
+from service import application, cache_sync, form_schema
+from tests.conftest import TEST_TENANT
+
+
+@pytest.fixture
+def other_worker(db, monkeypatch):
+    """Simula outro worker: as invalidações deste não passam pelo cache local."""
+    cache_sync.watch()
+    cache_sync.sync()
+
+    def publish_elsewhere(name, key=None):
+        handler = cache_sync._handlers[name]
+        monkeypatch.setitem(cache_sync._handlers, name, lambda key: 0)
+        try:
+            cache_sync.publish(name, key)
+        finally:
+            monkeypatch.setitem(cache_sync._handlers, name, handler)
+
+    return publish_elsewhere
+
+
+def test_invalidation_published_elsewhere_reaches_this_worker(other_worker):
+    application.get_basic_questions(TEST_TENANT)
+    assert application._basic_questions_cache.get(TEST_TENANT) is not None
+
+    other_worker("basic_questions", TEST_TENANT)
+    assert application._basic_questions_cache.get(TEST_TENANT) is not None
+
+    assert cache_sync.sync() == 1
+    assert application._basic_questions_cache.get(TEST_TENANT) is None
+
+
+def test_invalidate_basic_questions_clears_this_worker_right_away(db):
+    application.get_basic_questions(TEST_TENANT)
+    assert application.invalidate_basic_questions(TEST_TENANT) == 1
+    assert application._basic_questions_cache.get(TEST_TENANT) is None
+
+
+def test_form_schema_invalidation_reaches_this_worker(other_worker, job_posting_id):
+    assert form_schema.get_form_schema(TEST_TENANT, job_posting_id) is not None
+
+    other_worker("form_schema", [TEST_TENANT, job_posting_id])
+    assert form_schema.peek_form_schema(TEST_TENANT, job_posting_id) is not None
+
+    assert cache_sync.sync() == 1
+    assert form_schema.peek_form_schema(TEST_TENANT, job_posting_id) is None
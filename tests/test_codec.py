@@ -0,0 +1,63 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+from service import codec
+
+CODECS = ["stdlib"] + (["orjson"] if codec.orjson is not None else [])
+
+
+@pytest.fixture(params=CODECS)
+def json_codec(request, monkeypatch):
+    monkeypatch.setattr(codec, "JSON_CODEC", request.param)
+    return request.param
+
+
+def test_round_trip(json_codec):
+    value = {"nome": "João", "lista": [1, 2.5, None, True], "vazio": {}}
+    text = codec.dumps(value)
+    assert "João" in text
+    assert codec.loads(text) == value
+    assert codec.loads(text.encode("utf-8")) == value
+
+
+def test_database_types(json_codec):
+    value = {
+        "data": datetime.datetime(2025, 11, 5, 9, 30),
+        "dia": datetime.date(2025, 11, 5),
+        "valor": decimal.Decimal("1.5"),
+        "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "conjunto": {1},
+    }
+    assert codec.loads(codec.dumps(value)) == {
+        "data": "2025-11-05T09:30:00",
+        "dia": "2025-11-05",
+        "valor": 1.5,
+        "id": "12345678-1234-5678-1234-567812345678",
+        "conjunto": [1],
+    }
+
+
+def test_unknown_type_raises(json_codec):
+    with pytest.raises(TypeError):
+        codec.dumps({"objeto": object()})
+
+
+def test_sort_keys_and_indent(json_codec):
+    assert codec.dumps({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+    assert codec.dumps({"a": 1}, indent=True) == '{\n  "a": 1\n}'
+
+
+@pytest.mark.parametrize("number", [2 ** 64, -(2 ** 63) - 1, 10 ** 30])
+def test_wide_integers_keep_their_value(json_codec, number):
+    text = codec.dumps({"n": number})
+    loaded = codec.loads(text)["n"]
+    assert loaded == number
+    assert isinstance(loaded, int)
+    assert codec.loads(f"[{number}]".encode("utf-8")) == [number]
+
+
+def test_long_digit_strings_stay_strings(json_codec):
+    assert codec.loads('{"id": "123456789012345678901234"}') == {"id": "123456789012345678901234"}
@@ -0,0 +1,185 @@
+import base64
+import os
+import time
+import uuid
+
+import pytest
+
+from service import evolution, idempotency
+
+AUDIO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def media_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(evolution, "MEDIA_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _media_files(media_dir):
+    return sorted(path.name for path in media_dir.iterdir() if path.name.startswith(evolution.MEDIA_PREFIX))
+
+
+def _wrapped(data: bytes, width: int = 76):
+    text = base64.b64encode(data).decode("ascii")
+    return "\n".join(text[i:i + width] for i in range(0, len(text), width))
+
+
+def test_iter_base64_chunks_carries_the_remainder():
+    encoded = base64.b64encode(AUDIO).decode("ascii")
+    assert b"".join(evolution.iter_base64_chunks(encoded, chunk_size=7)) == AUDIO
+
+
+def test_iter_base64_chunks_ignores_line_breaks():
+    assert b"".join(evolution.iter_base64_chunks(_wrapped(AUDIO), chunk_size=100)) == AUDIO
+
+
+@pytest.mark.parametrize("data", ["abc", "ab!=", "YWJj\nZA"])
+def test_iter_base64_chunks_rejects_invalid_input(data):
+    with pytest.raises(ValueError):
+        b"".join(evolution.iter_base64_chunks(data))
+
+
+def test_save_base64_media_strips_data_uri(media_dir):
+    path, size = evolution.save_base64_media("data:audio/ogg;codecs=opus;base64," + _wrapped(AUDIO), "audio.ogg")
+    assert size == len(AUDIO)
+    assert path.endswith(".ogg")
+    with open(path, "rb") as f:
+        assert f.read() == AUDIO
+
+
+def test_save_base64_media_removes_partial_file(media_dir):
+    with pytest.raises(ValueError, match="Mídia em base64 inválida"):
+        evolution.save_base64_media(base64.b64encode(AUDIO).decode("ascii") + "A", "audio.ogg")
+    assert _media_files(media_dir) == []
+
+
+def test_purge_media_removes_only_old_media(media_dir):
+    old = media_dir / f"{evolution.MEDIA_PREFIX}old.ogg"
+    new = media_dir / f"{evolution.MEDIA_PREFIX}new.ogg"
+    other = media_dir / "other.ogg"
+    for path in (old, new, other):
+        path.write_bytes(b"x")
+    past = time.time() - 7200
+    os.utime(old, (past, past))
+    os.utime(other, (past, past))
+
+    assert evolution.purge_media(older_than=3600, force=True) == 1
+    assert sorted(path.name for path in media_dir.iterdir()) == ["evolution_new.ogg", "other.ogg"]
+
+
+def _event(message_type, message, **key):
+    return {
+        "event": "messages.upsert",
+        "data": {
+            "key": {"remoteJid": "5511999999999@s.whatsapp.net", "fromMe": False, "id": "MSG1", **key},
+            "messageType": message_type,
+            "message": message,
+        },
+    }
+
+
+def test_parse_text_with_job_code():
+    event = evolution.parse_evolution_event(_event("conversation", {"conversation": "Oi! @VAGA42-acme_rh"}))
+    assert event["phone"] == "5511999999999"
+    assert event["message_id"] == "MSG1"
+    assert (event["message_type"], event["message_content"]) == ("text", "Oi! @VAGA42-acme_rh")
+    assert (event["job_posting_id"], event["tenant_name"]) == ("42", "acme_rh")
+
+
+def test_parse_extended_text_without_job_code():
+    event = evolution.parse_evolution_event(_event("text", {"text": {"body": "tudo bem?"}}))
+    assert event["message_content"] == "tudo bem?"
+    assert event["job_posting_id"] is None
+
+
+def test_parse_ignores_own_messages():
+    assert evolution.parse_evolution_event(_event("conversation", {"conversation": "oi"}, fromMe=True)) is None
+
+
+def test_parse_audio_saves_media(media_dir):
+    event = evolution.parse_evolution_event(_event("audioMessage", {
+        "audioMessage": {"url": "https://mmg/audio", "mimetype": "audio/ogg; codecs=opus"},
+        "base64": _wrapped(AUDIO),
+    }))
+    assert (event["message_type"], event["message_content"]) == ("audio", "https://mmg/audio")
+    assert event["media"]["mime_type"] == "audio/ogg"
+    assert event["media"]["size"] == len(AUDIO)
+    assert event["media"]["url"] == f"/media/{event['media']['id']}"
+    assert os.path.dirname(evolution.media_path(event["media"]["id"])) == str(media_dir)
+
+
+@pytest.mark.parametrize("media_id", ["", "../etc/passwd", "evolution_abc.ogg", "outro_" + "0" * 32 + ".ogg",
+                                      evolution.MEDIA_PREFIX + "0" * 32 + ".o/g"])
+def test_media_path_rejects_invalid_ids(media_dir, media_id):
+    assert evolution.media_path(media_id) is None
+
+
+def test_media_path_hides_expired_media(media_dir):
+    path, _ = evolution.save_base64_media(base64.b64encode(AUDIO).decode("ascii"), "audio.ogg")
+    media_id = os.path.basename(path)
+    assert evolution.media_path(media_id) == path
+
+    past = time.time() - evolution.MEDIA_RETENTION_HOURS * 3600 - 60
+    os.utime(path, (past, past))
+    assert evolution.media_path(media_id) is None
+
+
+def test_saved_media_name_ignores_unsafe_suffix(media_dir):
+    path, _ = evolution.save_base64_media(base64.b64encode(AUDIO).decode("ascii"), "cv.p df", "application/pdf")
+    assert path.endswith(".pdf")
+    assert evolution.MEDIA_ID_PATTERN.match(os.path.basename(path))
+
+
+def test_media_route_serves_the_file(media_dir):
+    import main
+
+    client = main.app.test_client()
+    path, _ = evolution.save_base64_media(base64.b64encode(AUDIO).decode("ascii"), "audio.ogg")
+
+    response = client.get(f"/media/{os.path.basename(path)}")
+    assert response.status_code == 200
+    assert response.data == AUDIO
+    assert client.get("/media/evolution_nao_existe.ogg").status_code == 404
+
+
+def test_parse_document_metadata():
+    event = evolution.parse_evolution_event(_event("documentMessage", {
+        "documentMessage": {"fileName": "cv.pdf", "mimetype": "application/pdf", "url": "https://mmg/doc", "fileLength": "10"},
+    }))
+    assert event["message_type"] == "document"
+    assert event["message_content"] == {
+        "file_name": "cv.pdf", "mime_type": "application/pdf", "url": "https://mmg/doc", "file_size": "10",
+    }
+    assert event["media"] is None
+
+
+def test_repeated_delivery_is_processed_once(db):
+    body = _event("conversation", {"conversation": "oi"}, id=uuid.uuid4().hex)
+
+    event, skipped = evolution.ingest_evolution_event(body)
+    assert (event["message_content"], skipped) == ("oi", None)
+
+    # Outro worker, sem o cache em memória deste
+    idempotency._responses.invalidate()
+    assert evolution.ingest_evolution_event(body) == (None, "duplicada")
+
+
+def test_delivery_in_progress_elsewhere_is_not_processed_again(db):
+    message_id = uuid.uuid4().hex
+    idempotency.claim_key(evolution.EVOLUTION_SCOPE, message_id)
+
+    body = _event("conversation", {"conversation": "oi"}, id=message_id)
+    assert evolution.ingest_evolution_event(body) == (None, "em_processamento")
+
+
+def test_failed_parse_releases_the_message_id(db, media_dir):
+    message_id = uuid.uuid4().hex
+    body = _event("audioMessage", {"audioMessage": {}, "base64": "abc"}, id=message_id)
+
+    with pytest.raises(ValueError):
+        evolution.ingest_evolution_event(body)
+
+    body["data"]["message"]["base64"] = base64.b64encode(AUDIO).decode("ascii")
+    event, _ = evolution.ingest_evolution_event(body)
+    assert event["media"]["size"] == len(AUDIO)
@@ -0,0 +1,57 @@
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from service import application, codec, export
+from service.jobposting import create_job_posting
+from tests.conftest import TEST_TENANT
+
+
+@pytest.fixture
+def job_posting(db, monkeypatch):
+    # Blocos pequenos: a exportação atravessa vários
+    monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 2)
+    job_posting_id = create_job_posting(TEST_TENANT, "Vaga exportada", "EXPORT")
+    answers = [{"id": 1000, "answer_type": "text", "user_answer": "Cinco anos"},
+               {"id": 1001, "answer_type": "options", "user_answer": "1", "answer_options": [{"option": "Sim", "option_id": 1}]}]
+    processes = [
+        application.create_application(TEST_TENANT, job_posting_id, f"Pessoa {i}", f"export{i}@example.com",
+                                       f"5556667770{i}", f"55119666600{i}", answers)["recruitment_process_id"]
+        for i in range(3)
+    ]
+    return job_posting_id, processes
+
+
+def test_ndjson_has_one_line_per_application_with_answers(job_posting):
+    job_posting_id, processes = job_posting
+
+    lines = "".join(export.export_applications(TEST_TENANT, job_posting_id)).splitlines()
+    items = [codec.loads(line) for line in lines]
+
+    assert [item["recruitment_process_id"] for item in items] == processes
+    assert items[0]["name"] == "Pessoa 0"
+    assert items[0]["text_answers"] == [{"question_id": 1000, "text": "Cinco anos"}]
+    assert items[0]["alternative_answers"] == [1]
+
+
+def test_csv_has_header_and_rows(job_posting):
+    job_posting_id, processes = job_posting
+
+    rows = list(csv.reader(io.StringIO("".join(export.export_applications(TEST_TENANT, job_posting_id, "csv")))))
+
+    assert tuple(rows[0]) == export.EXPORT_COLUMNS
+    assert [int(row[0]) for row in rows[1:]] == processes
+
+
+def test_filters_and_unknown_job_posting(job_posting):
+    job_posting_id, _ = job_posting
+    tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+
+    assert "".join(export.export_applications(TEST_TENANT, job_posting_id, since=tomorrow)) == ""
+    assert "".join(export.export_applications(TEST_TENANT, job_posting_id, "csv", since=tomorrow)).strip() == ",".join(
+        export.EXPORT_COLUMNS
+    )
+    with pytest.raises(export.ExportNotFoundError):
+        export.export_applications(TEST_TENANT, 10 ** 9)
@@ -0,0 +1,76 @@
+import pytest
+
+from service.form_schema import FormSchema, context_questions, normalize_option_text
+
+QUESTION_SEQUENCE = [{"steps": {"questions": [
+    {"id": None, "key": "nome", "type": "basic"},
+    {"id": None, "key": "e-mail", "type": "basic"},
+    {"id": None, "key": "cpf", "type": "basic"},
+    {"id": 7, "key": "q7", "type": "customized", "answer_type": "text"},
+    {"id": 8, "key": "q8", "type": "customized", "answer_type": "options", "answer_options": [
+        {"option": "Manhã", "option_id": 81},
+        {"option": "Noite", "option_id": 82},
+    ]},
+]}}]
+
+
+@pytest.fixture
+def schema():
+    return FormSchema(QUESTION_SEQUENCE)
+
+
+def test_context_questions_accepts_list_or_dict():
+    assert len(context_questions(QUESTION_SEQUENCE)) == 5
+    assert context_questions(QUESTION_SEQUENCE[0]) == context_questions(QUESTION_SEQUENCE)
+    assert context_questions([]) == []
+    assert context_questions(None) == []
+
+
+def test_compiles_fields_and_positions(schema):
+    assert schema.size == 5
+    assert schema.fields == {"name": 0, "email": 1, "cpf": 2}
+    assert schema.customized == [3, 4]
+    assert schema.by_id[8].position == 4
+
+
+def test_normalize_option_text():
+    assert normalize_option_text("  MANHÃ ") == "manha"
+
+
+@pytest.mark.parametrize("answer, option_id", [
+    (81, 81), ("82", 82), ("manha", 81), (" NOITE ", 82), ("tarde", None), (None, None),
+])
+def test_match_option(schema, answer, option_id):
+    assert schema.match_option(8, answer) == option_id
+
+
+def test_match_option_unknown_question(schema):
+    assert schema.match_option(99, "81") is None
+
+
+def test_validate_answer(schema):
+    assert schema.validate_answer(8, "Manhã") is None
+    assert schema.validate_answer(8, "tarde") == "Resposta inválida para a questão 8: escolha uma das opções"
+    # Texto livre e pergunta desconhecida não são validados
+    assert schema.validate_answer(7, "qualquer coisa") is None
+    assert schema.validate_answer(99, "x") is None
+
+
+def test_find_checks_the_context_layout(schema):
+    questions = context_questions(QUESTION_SEQUENCE)
+    assert schema.find(questions, 8) is questions[4]
+    assert schema.layout_matches(questions)
+
+    reordered = questions[:3] + [questions[4], questions[3]]
+    assert schema.find(reordered, 8) is None
+    assert not schema.layout_matches(reordered)
+
+
+# Sem tenant a admissão não consulta o banco, então a validação roda sem Postgres
+@pytest.mark.parametrize("query", ["job_posting_id=abc", "job_posting_id=1.5", "job_posting_id=3"])
+def test_invalidate_route_rejects_invalid_job_posting_id(query):
+    import main
+
+    response = main.app.test_client().post(f"/cache/form_schema/invalidate?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
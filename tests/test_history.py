@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import text
+
+from service import application, codec, history
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Vários blocos por sessão, para a paginação atravessar blocos
+    monkeypatch.setattr(history, "CHAT_ARCHIVE_CHUNK_SIZE", 4)
+
+
+def numbers(messages):
+    return [int(message["message"].rsplit(" ", 1)[1]) for message in messages]
+
+
+def all_pages(chat_stage_id, limit):
+    pages, before = [], None
+    while True:
+        page = history.get_chat_messages(chat_stage_id, limit, before)
+        pages.append(numbers(page["messages"]))
+        before = page["next_before"]
+        if before is None:
+            return pages
+
+
+def test_pages_walk_back_through_hot_and_archived_messages(db, chat_stage):
+    chat_stage_id = chat_stage(history=30)
+
+    summary = history.compact_chat_stages(keep_last=10, chat_stage_ids=[chat_stage_id])
+    assert summary["archived_messages"] == 20
+
+    pages = all_pages(chat_stage_id, limit=7)
+    assert pages[0] == list(range(24, 31))
+    assert [n for page in reversed(pages) for n in page] == list(range(1, 31))
+
+
+def test_cursor_stays_valid_across_a_compaction(db, chat_stage):
+    chat_stage_id = chat_stage(history=30)
+    first = history.get_chat_messages(chat_stage_id, 5)
+
+    history.compact_chat_stages(keep_last=3, chat_stage_ids=[chat_stage_id])
+    second = history.get_chat_messages(chat_stage_id, 5, first["next_before"])
+
+    assert numbers(second["messages"]) + numbers(first["messages"]) == list(range(21, 31))
+
+
+def test_stale_n8n_rewrite_does_not_bring_archived_messages_back(db, chat_stage):
+    chat_stage_id = chat_stage(history=12)
+    with db.connect() as conn:
+        stale = conn.execute(
+            text("SELECT conversation FROM public.ats_chat_stage WHERE id = :id"), {"id": chat_stage_id}
+        ).scalar()
+
+    history.compact_chat_stages(keep_last=2, chat_stage_ids=[chat_stage_id])
+
+    # O n8n regrava a conversa lida antes da compactação, com uma mensagem nova
+    with db.begin() as conn:
+        conn.execute(text("UPDATE public.ats_chat_stage SET conversation = CAST(:c AS jsonb) WHERE id = :id"),
+                     {"c": codec.dumps(stale + [{"message": "Mensagem nova 13"}]), "id": chat_stage_id})
+
+    assert [n for page in reversed(all_pages(chat_stage_id, limit=5)) for n in page] == list(range(1, 14))
+    assert application.get_chat_stage_by_id(chat_stage_id, columns=("conversation",))["conversation"][0]["message"].endswith(" 11")
+
+
+def test_invalid_cursor(db, chat_stage):
+    with pytest.raises(ValueError):
+        history.get_chat_messages(chat_stage(), 5, "abc")
+
+
+@pytest.mark.parametrize("chat_stage_ids", ["1,2", [1, "x"], [True], [2 ** 31], {"id": 1}])
+def test_compact_route_rejects_invalid_ids(chat_stage_ids):
+    import main
+
+    response = main.app.test_client().post("/chat_stage/compact", json={"chat_stage_ids": chat_stage_ids})
+    assert response.status_code == 400
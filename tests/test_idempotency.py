@@ -0,0 +1,72 @@
+import uuid
+
+import pytest
+from flask import Flask, jsonify
+
+from service import idempotency
+
+
+@pytest.fixture
+def key(db):
+    return uuid.uuid4().hex
+
+
+def test_claim_is_exclusive_until_released(key):
+    assert idempotency.claim_key("pytest", key) == (True, None)
+
+    claimed, row = idempotency.claim_key("pytest", key)
+    assert not claimed
+    assert row["status"] == "processando"
+    assert idempotency.stored_response("pytest", key, row) is None
+
+    idempotency.release_key("pytest", key)
+    assert idempotency.claim_key("pytest", key) == (True, None)
+
+
+def test_completed_key_returns_the_stored_response(key):
+    idempotency.claim_key("pytest", key)
+    idempotency.complete_key("pytest", key, 201, {"id": 7})
+
+    claimed, row = idempotency.claim_key("pytest", key)
+    assert not claimed
+    assert idempotency.stored_response("pytest", key, row) == (201, {"id": 7})
+    # Já concluída, a chave não é liberada por engano
+    idempotency.release_key("pytest", key)
+    assert idempotency.claim_key("pytest", key)[0] is False
+
+
+def test_abandoned_claim_can_be_taken_over(key, monkeypatch):
+    idempotency.claim_key("pytest", key)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_TIMEOUT", 0)
+    assert idempotency.claim_key("pytest", key) == (True, None)
+
+
+@pytest.fixture
+def client(db):
+    app = Flask(__name__)
+    calls = []
+
+    @app.route("/pytest_idempotent", methods=["POST"])
+    @idempotency.idempotent("pytest_route")
+    def route():
+        calls.append(1)
+        if len(calls) == 1:
+            return jsonify({"error": "falhou"}), 500
+        return jsonify({"call": len(calls)}), 200
+
+    app.calls = calls
+    return app.test_client()
+
+
+def test_route_runs_again_after_an_error_and_then_replays(client, key):
+    headers = {"Idempotency-Key": key}
+
+    assert client.post("/pytest_idempotent", json={}, headers=headers).status_code == 500
+
+    response = client.post("/pytest_idempotent", json={}, headers=headers)
+    assert (response.status_code, response.json) == (200, {"call": 2})
+
+    replay = client.post("/pytest_idempotent", json={}, headers=headers)
+    assert (replay.status_code, replay.json) == (200, {"call": 2})
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert client.application.calls == [1, 1]
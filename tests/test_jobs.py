@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from service.jobs import JobQueue, RetryableJobError
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"job {job_id} não terminou")
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(workers=1, max_attempts=3, backoff=0.01)
+
+
+def test_falha_antes_do_envio_e_repetida(queue):
+    calls = []
+
+    def job():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RetryableJobError("página não carregou")
+        return True
+
+    job = wait_finished(queue, queue.submit(job))
+    assert job["status"] == "concluido"
+    assert job["attempts"] == 3
+    assert queue.counters["retried"] == 2
+
+
+def test_falha_retentavel_para_no_limite(queue):
+    def job():
+        raise RetryableJobError("página não carregou")
+
+    job = wait_finished(queue, queue.submit(job))
+    assert job["status"] == "erro"
+    assert job["attempts"] == 3
+
+
+@pytest.mark.parametrize("outcome", [False, RuntimeError("envio não confirmado")])
+def test_falha_depois_do_envio_e_definitiva(queue, outcome):
+    def job():
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    job = wait_finished(queue, queue.submit(job))
+    assert job["status"] == "erro"
+    assert job["attempts"] == 1
+    assert queue.counters["retried"] == 0
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import text
+
+from service import application
+from service.session_cache import SessionCache
+from tests.conftest import TEST_TENANT
+
+
+@pytest.fixture
+def cache(db):
+    # Janela longa: só grava quando o teste pede (ou pelo status)
+    cache = SessionCache(maxsize=100, ttl=60, flush_interval=3600, flush_statuses={"finalizada"}, flush_batch=10)
+    yield cache
+    cache._stop.set()
+
+
+def stored_messages(db, chat_stage_id):
+    with db.connect() as conn:
+        conversation = conn.execute(
+            text("SELECT conversation FROM public.ats_chat_stage WHERE id = :id"), {"id": chat_stage_id}
+        ).scalar()
+    return [message["message"] for message in conversation]
+
+
+def turn(chat_stage_id, message, status="em_andamento"):
+    return {"chat_stage_id": chat_stage_id, "tenant_name": TEST_TENANT, "interaction": "question",
+            "system_message": "Pergunta", "candidate_message": message, "status": status}
+
+
+def test_turns_are_served_from_memory_and_written_on_flush(db, chat_stage, cache):
+    chat_stage_id = chat_stage()
+
+    assert cache.apply([turn(chat_stage_id, "1"), turn(chat_stage_id, "2")])[1]["code"] == 200
+    assert stored_messages(db, chat_stage_id) == []
+    assert [m["message"] for m in cache.get(chat_stage_id)["conversation"]] == ["Pergunta", "1", "Pergunta", "2"]
+    assert cache.stats()["pending_turns"] == 2
+
+    cache.flush()
+
+    assert stored_messages(db, chat_stage_id) == ["Pergunta", "1", "Pergunta", "2"]
+    assert cache.stats()["pending_turns"] == 0
+
+
+def test_flush_keeps_writes_made_by_others_in_between(db, chat_stage, cache):
+    chat_stage_id = chat_stage()
+    cache.apply([turn(chat_stage_id, "cache")])
+
+    # Outro worker (ou o n8n) grava direto no banco antes da gravação do cache
+    application.update_chat_stage(chat_stage_id, TEST_TENANT, [{"message": "outro"}], "em_andamento")
+    cache.flush()
+
+    assert stored_messages(db, chat_stage_id) == ["outro", "Pergunta", "cache"]
+    assert [m["message"] for m in cache.get(chat_stage_id)["conversation"]] == ["outro", "Pergunta", "cache"]
+
+
+def test_final_status_is_written_immediately(db, chat_stage, cache):
+    chat_stage_id = chat_stage()
+
+    cache.apply([turn(chat_stage_id, "tchau", status="finalizada")])
+
+    assert stored_messages(db, chat_stage_id) == ["Pergunta", "tchau"]
+
+
+def test_flusher_wakes_up_when_the_oldest_pending_session_is_due(db, chat_stage, cache):
+    assert cache._next_tick() == cache.flush_interval
+
+    chat_stage_id = chat_stage()
+    cache.apply([turn(chat_stage_id, "1")])
+    first_due = cache._next_tick()
+    assert first_due <= cache.flush_interval
+
+    # Sessões que ficam pendentes depois não adiam o prazo da primeira
+    cache.apply([turn(chat_stage(), "2")])
+    assert cache._next_tick() <= first_due
+
+
+def test_get_copies_only_the_requested_columns(db, chat_stage, cache):
+    chat_stage_id = chat_stage(history=2)
+
+    row = cache.get(chat_stage_id, ("context", "status"))
+    assert set(row) == {"context", "status"}
+
+    row["context"].append("alterado")
+    assert "alterado" not in cache.get(chat_stage_id)["context"]
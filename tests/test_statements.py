@@ -0,0 +1,37 @@
+import pytest
+
+from service import statements
+
+
+def test_multi_row_insert_sql():
+    sql = str(statements.multi_row_insert("ats_answertext", ("text", "question_id"), 2, returning="id"))
+    assert sql == (
+        "INSERT INTO ats_answertext\n"
+        "(text, question_id)\n"
+        "VALUES (:text_0, :question_id_0),\n"
+        "(:text_1, :question_id_1)\n"
+        "RETURNING id"
+    )
+
+
+def test_multi_row_insert_is_cached():
+    first = statements.multi_row_insert("t_cache", ("a",), 3)
+    assert statements.multi_row_insert("t_cache", ("a",), 3) is first
+    assert statements.multi_row_insert("t_cache", ("a",), 4) is not first
+
+
+def test_multi_row_params_match_the_placeholders():
+    columns = ("text", "question_id")
+    rows = [{"text": "sim", "question_id": 7, "extra": 1}, {"text": "não", "question_id": 8}]
+    params = statements.multi_row_params(rows, columns)
+    assert params == {"text_0": "sim", "question_id_0": 7, "text_1": "não", "question_id_1": 8}
+
+    statement = statements.multi_row_insert("ats_answertext", columns, len(rows))
+    assert set(statement.compile().params) == set(params)
+
+
+def test_register_rejects_duplicate_names():
+    statements.register("teste_registro_duplicado", "SELECT 1")
+    assert str(statements.get("teste_registro_duplicado")) == "SELECT 1"
+    with pytest.raises(ValueError):
+        statements.register("teste_registro_duplicado", "SELECT 2")